@@ -11,6 +11,7 @@ Daifugo
 from itertools import cycle, product, groupby, combinations, chain, ifilter
 from random import shuffle
 from collections import defaultdict
+from timeit import default_timer
 
 
 def swap_cards(hand, pid):
@@ -57,8 +58,14 @@ def swap_cards(hand, pid):
             list - Cards available to throwaway
         """
 
+        if SWAP_CACHE is not None:
+            cached = SWAP_CACHE.get(encode_hand(hand))
+
+            if cached is not None:
+                return list(cached)
+
         keepers = [card for card in hand
-                   if ORDERED_RANKS.index(card[0]) >= ORDERED_RANKS.index('K')]
+                   if CARD_RANK_INDEX[card] >= RANK_INDEX['K']]
 
         for combo in chain(get_all_straights(hand), get_all_n_of_a_kind(hand)):
             [keepers.append(card) for card in combo if card not in keepers]
@@ -72,6 +79,9 @@ def swap_cards(hand, pid):
             # noinspection PyUnusedLocal
             throwaways += keepers
 
+        if SWAP_CACHE is not None:
+            SWAP_CACHE.put(encode_hand(hand), tuple(throwaways))
+
         return throwaways
 
     sort_cards(hand)
@@ -103,20 +113,245 @@ def generate_plays(hand):
         list    - comprising of cards.
     """
 
-    hand.sort()
+    mask = encode_hand(hand)
+
+    if PLAY_CACHE is not None:
+        cached = PLAY_CACHE.get(mask)
+
+        if cached is not None:
+            return map(list, cached)
+
+    plays = [decode_hand(play) for play in generate_plays_mask(mask)]
+
+    if PLAY_CACHE is not None:
+        PLAY_CACHE.put(mask, tuple(map(tuple, plays)))
+
+    return plays
+
+
+def generate_plays_mask(mask):
+    """
+    The packed counterpart of `generate_plays`. Every possible (non-pass)
+    play is returned as a card mask in the same order as `generate_plays`:
+    singles, then n-of-a-kind, then straights.
+
+    INPUTS:
+        mask    - int, a hand packed with `encode_hand`
+
+    RETURNS
+        list    - list of int card masks
+    """
 
     # add all the cards as single plays
-    plays = [[card] for card in hand]
+    plays = []
+    remaining = mask
+
+    while remaining:
+        bit = remaining & -remaining
+        plays.append(bit)
+        remaining ^= bit
 
     # add all two,three and four-of-a-kind combinations
-    plays += get_all_n_of_a_kind(hand)
+    plays += get_all_n_of_a_kind_mask(mask)
 
     # add all the > 3 card straights
-    plays += get_all_straights(hand)
+    plays += get_all_straights_mask(mask)
 
     return plays
 
 
+def generate_follows(hand, rnd):
+    """
+    Returns only the plays from `hand` that can legally follow `rnd`, in the
+    order `generate_plays` would list them. On a pair lead, for example,
+    only the pairs ranked above the top of the round are built, and no
+    singles or straights. On the lead every play is returned.
+
+    INPUTS:
+        hand    - A list of cards you currently hold
+        rnd     - the round to date, as a list of plays or a RoundState
+
+    RETURNS
+        list    - comprising of cards.
+    """
+
+    if not isinstance(rnd, RoundState):
+        rnd = RoundState(rnd)
+
+    return [decode_hand(mask) for mask in
+            generate_follows_mask(encode_hand(hand), rnd)]
+
+
+def generate_follows_mask(mask, state):
+    """
+    The packed counterpart of `generate_follows`.
+
+    INPUTS:
+        mask    - int, a hand packed with `encode_hand`
+        state   - RoundState of the round to date
+
+    RETURNS
+        list    - list of int card masks
+    """
+
+    if state.lead is None:
+        return generate_plays_mask(mask)
+
+    # every card ranked above the highest card of the top play
+    floor = 4 * (state.top_rank + 1)
+    above = mask >> floor << floor
+
+    if state.lead_kind > 1:
+        follows = []
+        sizes = KIND_SUBSETS_BY_SIZE[state.lead_kind]
+
+        while above:
+            shift = ((above & -above).bit_length() - 1) & ~3
+
+            for subset in sizes[(above >> shift) & 0xF]:
+                follows.append(subset << shift)
+
+            above &= ~(0xF << shift)
+
+        return follows
+
+    if not state.lead_straight and state.lead_length != 1:
+        # the lead is not a legal combination, so filter everything
+        return [play for play in generate_plays_mask(mask)
+                if state.is_valid(decode_hand(play))]
+
+    if state.on_suit:
+        suited = RANK_LANE << state.top_suit
+        above &= suited
+        mask &= suited
+
+    if state.lead_straight:
+        return [straight for straight in get_all_straights_mask(mask)
+                if straight >> floor]
+
+    follows = []
+
+    while above:
+        bit = above & -above
+        follows.append(bit)
+        above ^= bit
+
+    return follows
+
+
+def iter_plays(hand, rnd=None):
+    """
+    Lazily yields the plays from `hand` from the most to the least preferred,
+    i.e. in the order `sort_plays` leaves the list from `generate_plays` (or
+    from `generate_follows` when `rnd` is given). Plays are only built as
+    they are asked for, so a caller that stops at the first acceptable play
+    never builds the rest.
+
+    INPUTS:
+        hand    - A list of cards you currently hold
+        rnd     - optional, the round to date as a list of plays or a
+                  RoundState, to yield only the plays that can follow it
+
+    RETURNS
+        generator - of plays, each a list of cards
+    """
+
+    if rnd is not None and not isinstance(rnd, RoundState):
+        rnd = RoundState(rnd)
+
+    return (decode_hand(mask) for mask in
+            iter_plays_mask(encode_hand(hand), rnd))
+
+
+def iter_plays_mask(mask, state=None):
+    """
+    The packed counterpart of `iter_plays`.
+
+    Plays are ordered by length, then by top rank. Within a length the ranks
+    are walked upwards and, at each rank, the n-of-a-kinds are yielded before
+    the straights ending there (suit by suit), which is where the stable
+    `sort_plays` leaves them as `generate_plays` lists kinds first.
+
+    INPUTS:
+        mask    - int, a hand packed with `encode_hand`
+        state   - optional RoundState of the round to date
+
+    RETURNS
+        generator - of int card masks
+    """
+
+    singles = kinds = straights = True
+    suits = xrange(len(SUITS))
+    floor = 0
+
+    if state is not None and state.lead is not None:
+
+        if not state.lead_straight and state.lead_length != 1 and \
+                state.lead_kind <= 1:
+            # the lead is not a legal combination, so filter everything
+            for play in iter_plays_mask(mask):
+                if state.is_valid(decode_hand(play)):
+                    yield play
+            return
+
+        singles = state.lead_length == 1
+        kinds = state.lead_kind > 1
+        straights = state.lead_straight
+
+        # every card ranked above the highest card of the top play
+        floor = 4 * (state.top_rank + 1)
+
+        if state.on_suit:
+            mask &= RANK_LANE << state.top_suit
+            suits = (state.top_suit,)
+
+    above = mask >> floor << floor
+
+    if singles:
+        remaining = above
+
+        while remaining:
+            bit = remaining & -remaining
+            yield bit
+            remaining ^= bit
+
+    lanes = []
+    longest = 0
+
+    if straights:
+        for suit_index in suits:
+            lane = (mask >> suit_index) & RANK_LANE
+            runs = get_lane_runs(lane)
+
+            if runs:
+                lanes.append((suit_index, lane))
+                longest = max([longest] + [length for start, length in runs])
+
+    first_rank = floor // 4
+    sizes = xrange(2, 5) if kinds else ()
+
+    if kinds and state is not None and state.lead is not None:
+        sizes = (state.lead_kind,)
+
+    for length in xrange(2, max([longest] + list(sizes)) + 1):
+        subsets = KIND_SUBSETS_BY_SIZE[length] if length in sizes else None
+        run = RANK_RUNS[length] if 3 <= length <= longest else 0
+
+        for rank in xrange(first_rank, len(ORDERED_RANKS)):
+            shift = 4 * rank
+
+            if subsets is not None:
+                for subset in subsets[(above >> shift) & 0xF]:
+                    yield subset << shift
+
+            start = rank - length + 1
+
+            if run and start >= 0:
+                for suit_index, lane in lanes:
+                    if (lane >> (4 * start)) & run == run:
+                        yield run << (4 * start + suit_index)
+
+
 def is_valid_play(play, rnd):
     """
     Should return a Boolean value, evaluating whether the given play is
@@ -128,15 +363,22 @@ def is_valid_play(play, rnd):
     one can assume that the round is valid.
 
     INPUTS:
-        play    - which is a play (i.e. a list of cards)
+        play    - which is a play (i.e. a list of cards, or a Play)
         rnd     - the round to date, in the form of a list of plays in
                   sequential order (each of which is, in turn, a list of cards)
+                  or a RoundState
 
     RETURNS
         bool    - evaluating whether the given play is valid or not in the
                   context of the current round
     """
 
+    if isinstance(rnd, RoundState):
+        return rnd.is_valid(play)
+
+    if isinstance(play, Play):
+        play = play.names()
+
     # None (pass) cases
     if play is None and len(rnd) == 0:
         return False
@@ -161,137 +403,1627 @@ def is_valid_play(play, rnd):
     if is_play_straight(first_play) and not is_play_straight(play):
         return False
 
-    # simple case if the lead is a single card but play isn't
-    if len(first_play) == 1 and len(play) != 1:
-        return False
+    # simple case if the lead is a single card but play isn't
+    if len(first_play) == 1 and len(play) != 1:
+        return False
+
+    # n-of-a-kind case
+    if get_play_n_of_a_kind(first_play) > 1:
+
+        return get_rank_index_mask(encode_hand(play)) > \
+            get_rank_index_mask(encode_hand(last_play))
+    else:
+        # assume either a straight or single card
+
+        # False if any random 3 cards other than a straight
+        if len(play) >= 3 and not is_play_straight(play):
+            return False
+
+        # '[rank][suit]' e.g. '7H', leaving the caller's lists in their order
+        highest_played_card = max(play, key=CARD_RANK_INDEX.__getitem__)
+        highest_last_played_card = max(last_play,
+                                       key=CARD_RANK_INDEX.__getitem__)
+
+        if is_rank_higher(highest_played_card[0], highest_last_played_card[0]):
+            if is_round_on_suit(rnd):
+
+                if cmp(highest_played_card[1],
+                       highest_last_played_card[1]) != 0:
+
+                    return False
+
+            return True
+
+    return False
+
+
+def play(rnd, hand, discard, holding,
+         generate=generate_plays, valid=is_valid_play, endgame=None):
+    """This function is the game-playing agent, and returns the play in the
+    form of a list of cards or None.
+
+    'discard' represents the entire history of the game so far. It is a list,
+    each element of which represents a round in order of play in the game.
+    The first item is the first round, and the last item (discard[-1])
+    represents the current round (and is identical to 'rnd').
+
+    The function should return a list of cards representing the next play.
+    If there are no valid plays, or if a pass is chosen, the function
+    will return None.
+
+    When following with the default `valid`, only the plays that can beat
+    the top of the round are generated: lazily by `iter_plays` for the
+    default `generate`, stopping at the first valid play, or by
+    `generate.follows(hand, rnd)` if it has one (e.g. a HandIndex).
+
+    Plays of the same length and rank are tried in the order of SUITS (S, H,
+    C, D), the order `decode_hand` gives them, so a tie is broken towards the
+    spade, e.g. ['JS'] is led from ['JC', 'JS', 'KD'].
+
+    Given an `endgame` solver, the play is searched for exactly once at most
+    `endgame.threshold` cards are held in all, falling back to the rules
+    below when the solver cannot settle it.
+
+    INPUTS:
+        rnd     - a list of plays from the round to date, or a RoundState
+        hand    - a list of the current cards held by your player
+        discard - a list of the history of the game so far
+        holding - a 4-tuple made up of int values representing how many cards
+                  each of the players is holding, indexed by the player ID
+        generate- which defaults to generate_plays function
+        valid   - which defaults to is_valid_play function
+        endgame - optional endgame.EndgameSolver
+
+    RETURNS
+        list    - list of cards representing the next play.
+    """
+
+    def is_lead_play():
+        """
+        Returns a bool that indicates whether or not the play is a lead. A play
+        is the lead when rnd has no length.
+
+        RETURNS
+            bool    - True if play is lead otherwise False
+        """
+        return len(rnd) == 0
+
+    def filter_leaders(play):
+        """
+        A key filter function for plays to extract the lead plays.
+
+        A lead play is any straight not ending in a 2 or A, or any n-of-a-kind
+        that is less than
+
+        RETURNS
+            bool    - True if play is lead otherwise False
+        """
+
+        # the ranks are read without sorting the play, which may be shared
+        # with the caller or a cache
+        ranks = [CARD_RANK_INDEX[card] for card in play]
+
+        predicate = \
+            (
+                is_play_straight(play) and
+                max(ranks) < RANK_INDEX["A"]
+            ) or \
+            (
+                get_play_n_of_a_kind(play) > 1 and
+                min(ranks) < RANK_INDEX["J"]
+            )
+
+        return predicate
+
+    if endgame is not None and holding is not None and \
+            sum(holding) <= endgame.threshold:
+        solved = endgame.solve_play(rnd, hand, discard, holding)
+
+        if solved is not None:
+            return solved[1]
+
+    state = rnd
+
+    # check every candidate against one incremental view of the round
+    if valid is is_valid_play and not isinstance(rnd, RoundState):
+        state = RoundState(rnd)
+
+    if is_lead_play():
+        plays = generate(hand)
+
+        leaders = list(ifilter(lambda play: filter_leaders(play), plays))
+
+        # always lead with a straight where possible
+        if len(leaders) > 0:
+
+            leaders.sort(
+                key=lambda play:
+                (
+                    len(play),
+                    len(ORDERED_RANKS) -
+                    min(CARD_RANK_INDEX[card] for card in play)
+                ), reverse=True)
+
+            if TRACE is not None:
+                TRACE({'event': 'leaders', 'rnd': rnd, 'hand': hand,
+                       'plays': leaders})
+
+            return leaders[0]
+
+        sort_plays(plays)
+
+    elif valid is is_valid_play and generate is generate_plays:
+        # only the plays that can beat the top of the round, most preferred
+        # first, built one at a time until a valid one is found
+        plays = iter_plays(hand, state)
+
+    else:
+        if valid is is_valid_play and hasattr(generate, 'follows'):
+            plays = generate.follows(hand, state)
+        else:
+            plays = generate(hand)
+
+        sort_plays(plays)
+
+    if TRACE is not None:
+        plays = list(plays)
+        TRACE({'event': 'prefs', 'rnd': rnd, 'hand': hand, 'plays': plays})
+
+    for play in plays:
+
+        # never play multiple 2s. They are invaluable!
+        if get_play_n_of_a_kind(play) > 1 and play[0][0] == '2':
+            continue
+
+        if valid(play, state):
+            return play
+
+    return None
+
+
+def play_many(states, processes=None, chunksize=64):
+    """
+    Returns the decisions of `play` for a batch of game states, in order.
+
+    `play` only looks at the round and at the cards in hand, so states with
+    the same round and the same cards (in any order) are decided once and
+    share the decision. The distinct states are decided in this process, or
+    spread over a pool of `processes` workers for very large batches. The
+    hands and rounds given are not modified.
+
+    INPUTS:
+        states      - list of (rnd, hand, discard, holding) tuples, as passed
+                      to `play`
+        processes   - optional number of worker processes
+        chunksize   - distinct states sent to a worker at a time
+
+    RETURNS:
+        list    - one play (a list of cards) or None per state
+    """
+
+    keys = []
+    distinct = {}
+
+    for rnd, hand, discard, holding in states:
+        key = (tuple(play and tuple(play) for play in rnd), encode_hand(hand))
+        keys.append(key)
+
+        if key not in distinct:
+            distinct[key] = len(distinct)
+
+    # the rounds are rebuilt from the keys, so the caller's lists are left
+    # alone and only plain tuples are sent to the workers
+    work = [None] * len(distinct)
+
+    for key, index in distinct.iteritems():
+        work[index] = key
+
+    if processes is None or processes <= 1:
+        decisions = map(play_state, work)
+    else:
+        from multiprocessing import Pool
+
+        pool = Pool(processes)
+
+        try:
+            decisions = pool.map(play_state, work, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    return [decisions[distinct[key]] and list(decisions[distinct[key]])
+            for key in keys]
+
+
+def play_state(key):
+    """
+    Decides one state for `play_many`. Module level, so that it can be sent
+    to worker processes.
+
+    INPUTS:
+        key     - (round as a tuple of tuples of cards or None, packed hand)
+
+    RETURNS:
+        list    - the play, or None
+    """
+
+    plays, mask = key
+    rnd = [cards and list(cards) for cards in plays]
+
+    return play(rnd, decode_hand(mask), [rnd], None)
+
+
+def play_anytime(rnd, hand, discard, holding, budget=None, deadline=None,
+                 improver=None, generate=generate_plays):
+    """
+    A deadline-aware `play`. The heuristic's play is decided first, so there
+    is always a play to return, and is then replaced by each better play
+    `improver` finds until it finishes or the time runs out.
+
+    `improver` has an `improve(rnd, hand, discard, holding, deadline)`
+    method returning an iterator of successively better plays, such as a
+    search.SearchAgent or an endgame.EndgameSolver. Each should stop itself
+    at `deadline`, which is also checked between plays.
+
+    INPUTS:
+        rnd         - a list of plays from the round to date
+        hand        - a list of the current cards held by your player
+        discard     - a list of the history of the game so far
+        holding     - how many cards each of the players is holding
+        budget      - optional seconds from now to decide in
+        deadline    - optional default_timer() value to decide by, the
+                      earlier of the two being used when both are given
+        improver    - optional improver, see above
+        generate    - as for `play`
+
+    RETURNS:
+        tuple   - (play, report) where play is a list of cards or None and
+                  report is a dict of 'budget' (seconds allowed, None if
+                  unlimited), 'used' (seconds taken), 'fraction' (of the
+                  budget used, None if unlimited), 'improvements' (number
+                  of plays the improver replaced the heuristic's with) and
+                  'complete' (whether the improver finished in time)
+    """
+
+    start = default_timer()
+    allowed = None if deadline is None else deadline - start
+
+    if budget is not None and (allowed is None or budget < allowed):
+        allowed = budget
+        deadline = start + budget
+
+    decision = play(rnd, hand, discard, holding, generate)
+    improvements = 0
+    complete = improver is None
+
+    if improver is not None and (deadline is None or
+                                 default_timer() < deadline):
+        plays = improver.improve(rnd, hand, discard, holding, deadline)
+        complete = True
+
+        for better in plays:
+            decision = better
+            improvements += 1
+
+            if deadline is not None and default_timer() >= deadline:
+                complete = False
+                break
+
+    used = default_timer() - start
+
+    return decision, {
+        'budget': allowed,
+        'used': used,
+        'fraction': used / allowed if allowed else None,
+        'improvements': improvements,
+        'complete': complete,
+    }
+
+
+class AnytimeAgent(object):
+    """
+    An agent with the signature of `play` that decides each play with
+    `play_anytime` in a fixed budget, so that fast and slow agents can be
+    seated together with predictable move times, and keeps a tally of the
+    budget used.
+
+    ATTRIBUTES:
+        budget          - seconds per decision, or None for no limit
+        improver        - the improver handed to `play_anytime`, or None
+        generate        - as for `play`
+        decisions       - number of decisions made
+        used            - total seconds taken
+        allowed         - total seconds allowed, over decisions with a budget
+        improvements    - number of decisions the improver changed
+        longest         - the most seconds a decision took
+    """
+
+    def __init__(self, budget=0.05, improver=None, generate=generate_plays):
+        self.budget = budget
+        self.improver = improver
+        self.generate = generate
+        self.decisions = 0
+        self.used = 0.0
+        self.allowed = 0.0
+        self.improvements = 0
+        self.longest = 0.0
+
+    def __call__(self, rnd, hand, discard, holding):
+        decision, report = play_anytime(rnd, hand, discard, holding,
+                                        self.budget, None, self.improver,
+                                        self.generate)
+
+        self.decisions += 1
+        self.used += report['used']
+        self.longest = max(self.longest, report['used'])
+
+        if report['improvements']:
+            self.improvements += 1
+
+        if report['budget'] is not None:
+            self.allowed += report['budget']
+
+        return decision
+
+    def fraction_used(self):
+        """
+        RETURNS:
+            float   - share of the allowed time used so far, or None if no
+                      decision had a budget
+        """
+
+        return self.used / self.allowed if self.allowed else None
+
+
+class RoundState(object):
+    """
+    The round to date, kept up to date one play at a time so that the lead,
+    the most recent non-pass play and whether the round is 'on suit' never
+    have to be worked out again from the whole round.
+
+    It can be passed to `is_valid_play`, `get_last_play`, `is_round_on_suit`
+    and `play` in place of `rnd`, and behaves like the list of plays it was
+    built from for len(), indexing and iteration.
+
+    ATTRIBUTES:
+        plays           - the round as a list of plays and passes (None)
+        lead            - the opening play, or None before the round starts
+        lead_kind       - get_play_n_of_a_kind(lead)
+        lead_straight   - is_play_straight(lead)
+        lead_length     - number of cards in the lead
+        top             - the most recent non-pass play, or None
+        top_rank        - rank index of the highest card in top
+        top_suit        - suit index of the highest card in top
+        on_suit         - is_round_on_suit(plays)
+        followed        - True once a non-pass play has followed the lead
+        passes          - number of passes since the last non-pass play
+        top_id          - PlayCatalog ID of top, or None unless the lead and
+                          top are catalogued plays of the same type
+    """
+
+    def __init__(self, rnd=()):
+        self.plays = []
+        self.lead = None
+        self.lead_kind = 0
+        self.lead_straight = False
+        self.lead_length = 0
+        self.top = None
+        self.top_rank = -1
+        self.top_suit = -1
+        self.on_suit = False
+        self.followed = False
+        self.passes = 0
+        self.top_id = None
+
+        for play in rnd:
+            self.push(play)
+
+    def __len__(self):
+        return len(self.plays)
+
+    def __iter__(self):
+        return iter(self.plays)
+
+    def __getitem__(self, index):
+        return self.plays[index]
+
+    def push(self, play):
+        """
+        Adds the next play (or pass, None) to the round.
+
+        INPUTS:
+            play    - a list of cards, a Play or None
+
+        RETURNS:
+            None
+        """
+
+        if isinstance(play, Play):
+            play = play.names()
+
+        self.plays.append(play)
+
+        if play is None:
+            self.passes += 1
+            return
+
+        self.passes = 0
+
+        if self.lead is None:
+            self.lead = play
+            self.lead_kind = get_play_n_of_a_kind(play)
+            self.lead_straight = is_play_straight(play)
+            self.lead_length = len(play)
+        elif not self.followed:
+            # only the first follow decides whether the round is on suit
+            self.followed = True
+            self.on_suit = self.lead_kind <= 1 and play[0][1] == self.lead[0][1]
+
+        mask = encode_hand(play)
+        highest = mask.bit_length() - 1
+
+        self.top = play
+        self.top_rank = highest // 4
+        self.top_suit = highest % 4
+        self.top_id = None
+
+        if self.lead_kind or self.lead_straight:
+            catalog = PLAY_CATALOG or get_play_catalog()
+            top_id = catalog.ids.get(mask)
+
+            # the kind of a straight is 0, as is lead_kind for a straight lead
+            if top_id is not None and count_cards(mask) == len(play) and \
+                    catalog.kinds[top_id] == self.lead_kind:
+                self.top_id = top_id
+
+    def is_valid(self, play):
+        """
+        The same test as `is_valid_play(play, self.plays)`, using the cached
+        lead and top play.
+
+        INPUTS:
+            play    - a list of cards, a Play or None
+
+        RETURNS:
+            bool    - True if play can be made in this round
+        """
+
+        if self.lead is None:
+            return play is not None
+        elif play is None:
+            return True
+
+        if isinstance(play, Play):
+            if self.top_id is not None:
+                beats = PLAY_CATALOG.beats_on_suit if self.on_suit \
+                    else PLAY_CATALOG.beats
+
+                return beats[self.top_id] >> play.id & 1 == 1
+
+            play = play.names()
+
+        if self.top_id is not None and None not in play:
+            mask = encode_hand(play)
+            play_id = PLAY_CATALOG.ids.get(mask)
+
+            if play_id is not None and count_cards(mask) == len(play):
+                beats = PLAY_CATALOG.beats_on_suit if self.on_suit \
+                    else PLAY_CATALOG.beats
+
+                return beats[self.top_id] >> play_id & 1 == 1
+
+        if self.lead_kind > 1:
+            return get_play_n_of_a_kind(play) == self.lead_kind and \
+                get_rank_index_mask(encode_hand(play)) > self.top_rank
+
+        if self.lead_straight:
+            if not is_play_straight(play):
+                return False
+        elif self.lead_length == 1:
+            if len(play) != 1:
+                return False
+        else:
+            # the lead is not a legal combination, so skip the shortcuts
+            return is_valid_play(play, self.plays)
+
+        highest = encode_hand(play).bit_length() - 1
+
+        if highest // 4 <= self.top_rank:
+            return False
+
+        return not self.on_suit or highest % 4 == self.top_suit
+
+
+class UnseenTracker(object):
+    """
+    What one player has not yet seen of the deck, and what the play so far
+    says about the other hands, kept up to date one play at a time.
+
+    Plays are consumed with `push` and `end_round`, or with `fast_forward`,
+    which catches up with the game so far from wherever the tracker last
+    stopped, so calling it every turn only looks at the new plays.
+
+    Given the leader of the first round, the player making each play is
+    followed under the turn rules (players who have gone out are skipped,
+    and the last player to play leads the next round, or the next player
+    still holding cards) along with the cards each still holds. A player
+    who passes on a single is taken not to hold any card that would have
+    beaten it, as `play` always follows a single when it can.
+
+    ATTRIBUTES:
+        unseen      - mask of the cards neither played nor in the hand
+        rank_counts - rank_counts[rank index] is the number of unseen cards
+                      of that rank
+        holding     - number of cards held by each player
+        played      - played[pid] is the mask of the cards pid has played
+        excluded    - excluded[pid] is the mask of the cards pid is taken
+                      not to hold
+        out         - number of players who have gone out
+        pid         - player to make the next play, or None if unknown
+        last_player - player who made the top play of the round (its
+                      leader, before the first play), or None if unknown
+        round       - RoundState of the current round
+        rounds      - number of finished rounds
+    """
+
+    def __init__(self, hand=(), leader=None, players=4):
+        self.unseen = DECK_MASK & ~encode_hand(hand)
+        self.rank_counts = [count_cards((self.unseen >> (4 * rank)) & 0xF)
+                            for rank in xrange(len(ORDERED_RANKS))]
+        self.holding = [len(CARD_BITS) // players] * players
+        self.played = [0] * players
+        self.excluded = [0] * players
+        self.out = 0
+        self.pid = self.last_player = leader
+        self.round = RoundState()
+        self.rounds = 0
+
+    def twos(self):
+        """
+        RETURNS:
+            int     - number of unseen 2s
+        """
+
+        return self.rank_counts[RANK_INDEX['2']]
+
+    def aces(self):
+        """
+        RETURNS:
+            int     - number of unseen aces
+        """
+
+        return self.rank_counts[RANK_INDEX['A']]
+
+    def to_move(self):
+        """
+        RETURNS:
+            int     - the player to make the next play, skipping players who
+                      have gone out, or None if unknown or no one holds
+                      cards
+        """
+
+        pid = self.pid
+        players = len(self.holding)
+
+        if pid is None or self.out >= players:
+            return pid
+
+        # bounded, as the holdings of a corrupt game may all run out early
+        for step in xrange(players):
+            if self.holding[pid]:
+                return pid
+
+            pid = (pid + 1) % players
+
+        return None
+
+    def push(self, play):
+        """
+        Consumes the next play (or pass, None) of the current round.
+
+        INPUTS:
+            play    - a list of cards or None
+
+        RETURNS:
+            None
+        """
+
+        pid = self.to_move()
+
+        if play is None:
+            state = self.round
+
+            if pid is not None and state.lead_length == 1 and \
+                    state.top_id is not None:
+                floor = 4 * (state.top_rank + 1)
+                beaten = DECK_MASK >> floor << floor
+
+                if state.on_suit:
+                    beaten &= RANK_LANE << state.top_suit
+
+                self.excluded[pid] |= beaten
+        else:
+            mask = encode_hand(play)
+            seen = mask & self.unseen
+            self.unseen ^= seen
+
+            while seen:
+                bit = seen & -seen
+                self.rank_counts[(bit.bit_length() - 1) // 4] -= 1
+                seen ^= bit
+
+            if pid is not None:
+                self.holding[pid] -= len(play)
+                self.played[pid] |= mask
+                self.last_player = pid
+
+                if not self.holding[pid]:
+                    self.out += 1
+
+        self.round.push(play)
+
+        if pid is not None:
+            self.pid = (pid + 1) % len(self.holding)
+
+    def end_round(self):
+        """
+        Closes the current round and starts the next.
+
+        RETURNS:
+            None
+        """
+
+        self.rounds += 1
+        self.round = RoundState()
+        self.pid = self.last_player
+
+        # the round winner leads, or the next player if they have gone out
+        if self.pid is not None:
+            self.pid = self.last_player = self.to_move()
+
+    def fast_forward(self, discard):
+        """
+        Consumes the plays of `discard` not yet seen, where discard[-1] is
+        the current round.
+
+        INPUTS:
+            discard - a list of the history of the game so far
+
+        RETURNS:
+            None
+        """
+
+        for index in xrange(self.rounds, len(discard)):
+            for play in discard[index][len(self.round):]:
+                self.push(play)
+
+            if index < len(discard) - 1:
+                self.end_round()
+
+
+class HandIndex(object):
+    """
+    The plays of a hand, enumerated once and then kept up to date as cards
+    leave the hand. Removing a card only revisits the n-of-a-kind of its
+    rank and the straights of its suit, the other plays are left as they
+    are. Adding a card (e.g. a new deal) enumerates the hand again.
+
+    `generate` has the signature of `generate_plays` and returns the same
+    plays in the same order, so an index can be handed to `play` to be used
+    for every turn of a game:
+
+        play(rnd, hand, discard, holding, generate=index.generate)
+
+    An index is also callable, as a shorthand for `generate`.
+
+    ATTRIBUTES:
+        mask        - the indexed hand, packed with `encode_hand`
+        kinds       - kinds[rank index] lists the n-of-a-kind of that rank
+        straights   - straights[suit index] lists the straights of that suit
+
+    Each play is kept as a (mask, cards) pair, cards being a tuple.
+    """
+
+    def __init__(self, hand=()):
+        self.mask = 0
+        self.kinds = [[] for rank in ORDERED_RANKS]
+        self.straights = [[] for suit in SUITS]
+
+        self.rebuild(encode_hand(hand))
+
+    def __call__(self, hand):
+        return self.generate(hand)
+
+    def rebuild(self, mask):
+        """
+        Enumerates every play of the packed hand `mask` from scratch.
+
+        INPUTS:
+            mask    - int, a hand packed with `encode_hand`
+
+        RETURNS:
+            None
+        """
+
+        self.mask = mask
+        self.kinds = [[] for rank in ORDERED_RANKS]
+        self.straights = [[] for suit in SUITS]
+
+        for kind in get_all_n_of_a_kind_mask(mask):
+            self.kinds[get_rank_index_mask(kind)].append(
+                (kind, tuple(decode_hand(kind))))
+
+        for straight in get_all_straights_mask(mask):
+            self.straights[((straight & -straight).bit_length() - 1) % 4] \
+                .append((straight, tuple(decode_hand(straight))))
+
+    def remove(self, mask):
+        """
+        Drops the cards in `mask` from the hand, and every play using them.
+
+        INPUTS:
+            mask    - int, the cards to remove packed with `encode_hand`
+
+        RETURNS:
+            None
+        """
+
+        mask &= self.mask
+        self.mask ^= mask
+
+        ranks = set()
+        suits = set()
+
+        while mask:
+            bit = mask & -mask
+            ranks.add((bit.bit_length() - 1) // 4)
+            suits.add((bit.bit_length() - 1) % 4)
+            mask ^= bit
+
+        # only the plays sharing a rank or suit with a removed card can change
+        for rank_index in ranks:
+            self.kinds[rank_index] = [play for play in self.kinds[rank_index]
+                                      if play[0] & ~self.mask == 0]
+
+        for suit_index in suits:
+            self.straights[suit_index] = \
+                [play for play in self.straights[suit_index]
+                 if play[0] & ~self.mask == 0]
+
+    def update(self, hand):
+        """
+        Brings the index in line with `hand`, removing cards incrementally
+        or enumerating again if the hand holds cards the index has not seen.
+
+        INPUTS:
+            hand    - list of cards currently held
+
+        RETURNS:
+            None
+        """
+
+        mask = encode_hand(hand)
+
+        if mask & ~self.mask:
+            self.rebuild(mask)
+        elif mask != self.mask:
+            self.remove(self.mask & ~mask)
+
+    def generate(self, hand):
+        """
+        The same as `generate_plays(hand)`, answered from the index.
+
+        INPUTS:
+            hand    - list of cards currently held
+
+        RETURNS
+            list    - comprising of cards.
+        """
+
+        self.update(hand)
+
+        plays = [[card] for card in decode_hand(self.mask)]
+
+        for kinds in self.kinds:
+            plays += [list(cards) for mask, cards in kinds]
+
+        for straights in self.straights:
+            plays += [list(cards) for mask, cards in straights]
+
+        return plays
+
+    def follows(self, hand, rnd):
+        """
+        The same as `generate_follows(hand, rnd)`, answered from the index.
+
+        INPUTS:
+            hand    - list of cards currently held
+            rnd     - the round to date, as a list of plays or a RoundState
+
+        RETURNS
+            list    - comprising of cards.
+        """
+
+        if not isinstance(rnd, RoundState):
+            rnd = RoundState(rnd)
+
+        if rnd.lead is None or \
+                not (rnd.lead_kind > 1 or rnd.lead_straight or
+                     rnd.lead_length == 1):
+            return [play for play in self.generate(hand) if rnd.is_valid(play)]
+
+        self.update(hand)
+
+        floor = 4 * (rnd.top_rank + 1)
+
+        if rnd.lead_kind > 1:
+            return [list(cards)
+                    for kinds in self.kinds[rnd.top_rank + 1:]
+                    for mask, cards in kinds if len(cards) == rnd.lead_kind]
+
+        suits = [rnd.top_suit] if rnd.on_suit else xrange(len(SUITS))
+
+        if rnd.lead_straight:
+            return [list(cards)
+                    for suit_index in suits
+                    for mask, cards in self.straights[suit_index]
+                    if mask >> floor]
+
+        above = self.mask >> floor << floor
+
+        if rnd.on_suit:
+            above &= RANK_LANE << rnd.top_suit
+
+        return [[card] for card in decode_hand(above)]
+
+
+class PlayCatalog(object):
+    """
+    Every play that can be made from a full deck: 52 singles, 78 pairs, 52
+    triples, 13 four-of-a-kinds and 264 straights, 459 in all, each with an
+    integer ID. IDs run from the most to the least preferred play in the
+    order `sort_plays` leaves `generate_plays`, so the plays of a hand in
+    ascending ID order are the plays of `iter_plays`.
+
+    Sets of plays are kept as int bitsets over the IDs (bit i for ID i), so
+    the plays of a hand, and the plays that can follow the top of a round,
+    come from a few ANDs rather than from building and comparing cards.
+
+    Build it with `get_play_catalog`, which makes it once and shares it.
+
+    ATTRIBUTES:
+        masks           - masks[id] is the play packed with `encode_hand`
+        ids             - dict of card mask to ID
+        kinds           - kinds[id] is n for n-of-a-kind (1 for a single) or
+                          0 for a straight
+        tops            - tops[id] is the card id (rank index * 4 + suit
+                          index) of the highest card
+        beats           - beats[id] is the set of plays that can be made on
+                          top of play `id` in a round led by the same type of
+                          play: the same n-of-a-kind, or any straight, ranked
+                          higher
+        beats_on_suit   - the same, for a round that is on suit
+        touching        - touching[rank index][nibble] is the set of plays
+                          using any of the cards of that rank in `nibble`
+        everything      - the set of every play
+    """
+
+    def __init__(self):
+        self.masks = []
+
+        # walking lengths then ranks gives the order of `iter_plays_mask`
+        for length in xrange(1, len(ORDERED_RANKS) + 1):
+            for rank in xrange(len(ORDERED_RANKS)):
+                shift = 4 * rank
+
+                if length == 1:
+                    self.masks += [1 << (shift + suit_index)
+                                   for suit_index in xrange(len(SUITS))]
+                elif length <= 4:
+                    self.masks += [subset << shift for subset in
+                                   KIND_SUBSETS_BY_SIZE[length][0xF]]
+
+                start = rank - length + 1
+
+                if length >= 3 and start >= 0:
+                    self.masks += [RANK_RUNS[length] << (4 * start + suit_index)
+                                   for suit_index in xrange(len(SUITS))]
+
+        self.ids = dict((mask, i) for i, mask in enumerate(self.masks))
+        self.kinds = [get_n_of_a_kind_mask(mask) for mask in self.masks]
+        self.tops = [mask.bit_length() - 1 for mask in self.masks]
+        self.everything = (1 << len(self.masks)) - 1
+
+        self.touching = [[0] * 16 for rank in ORDERED_RANKS]
+
+        for i, mask in enumerate(self.masks):
+            for rank in xrange(len(ORDERED_RANKS)):
+                used = (mask >> (4 * rank)) & 0xF
+
+                if used:
+                    for nibble in xrange(16):
+                        if nibble & used:
+                            self.touching[rank][nibble] |= 1 << i
+
+        # plays of one type grouped by rank, and by rank and suit
+        ranked = defaultdict(int)
+        suited = defaultdict(int)
+
+        for i, (kind, top) in enumerate(zip(self.kinds, self.tops)):
+            ranked[kind, top // 4] |= 1 << i
+            suited[kind, top // 4, top % 4] |= 1 << i
+
+        self.beats = []
+        self.beats_on_suit = []
+
+        for kind, top in zip(self.kinds, self.tops):
+            higher = xrange(top // 4 + 1, len(ORDERED_RANKS))
+
+            # the groups are disjoint, so summing them is a union
+            self.beats.append(sum(ranked[kind, rank] for rank in higher))
+            self.beats_on_suit.append(
+                sum(suited[kind, rank, top % 4] for rank in higher))
+
+    def __len__(self):
+        return len(self.masks)
+
+    def plays(self, mask):
+        """
+        Returns the set of plays made only of cards in `mask`.
+
+        INPUTS:
+            mask    - int, a hand packed with `encode_hand`
+
+        RETURNS:
+            int     - bitset of play IDs
+        """
+
+        missing = ~mask
+        excluded = 0
+
+        for rank, touching in enumerate(self.touching):
+            excluded |= touching[(missing >> (4 * rank)) & 0xF]
+
+        return self.everything & ~excluded
+
+    def follows(self, mask, state):
+        """
+        Returns the set of plays made only of cards in `mask` that can be
+        made in the round `state`.
+
+        INPUTS:
+            mask    - int, a hand packed with `encode_hand`
+            state   - RoundState of the round to date
+
+        RETURNS:
+            int     - bitset of play IDs
+        """
+
+        plays = self.plays(mask)
+
+        if state.lead is None:
+            return plays
+
+        if state.top_id is None:
+            # the round is not made of catalogued plays, so test each one
+            follows = 0
+
+            for play_id in self.iter_ids(plays):
+                if state.is_valid(decode_hand(self.masks[play_id])):
+                    follows |= 1 << play_id
+
+            return follows
+
+        if state.on_suit:
+            return plays & self.beats_on_suit[state.top_id]
+
+        return plays & self.beats[state.top_id]
+
+    def iter_ids(self, plays):
+        """
+        Yields the IDs in a bitset of plays, most preferred first.
+
+        INPUTS:
+            plays   - int, bitset of play IDs
+
+        RETURNS:
+            generator - of int play IDs
+        """
+
+        while plays:
+            bit = plays & -plays
+            yield bit.bit_length() - 1
+            plays ^= bit
+
+    def get_id(self, play):
+        """
+        Returns the ID of a play given as a list of cards, or None if it is
+        not a legal combination (or repeats a card).
+
+        INPUTS:
+            play    - a list of cards
+
+        RETURNS:
+            int     - play ID or None
+        """
+
+        if play is None or None in play:
+            return None
+
+        mask = encode_hand(play)
+
+        if count_cards(mask) != len(play):
+            return None
+
+        return self.ids.get(mask)
+
+
+class Card(object):
+    """
+    An immutable playing card. There is one Card per card of the deck,
+    shared by every caller (see `get_card`), so cards compare and hash by
+    identity and their ordinals are worked out once.
+
+    ATTRIBUTES:
+        name    - the card as a string, e.g. '7H'
+        rank    - rank index in ORDERED_RANKS
+        suit    - suit index in SUITS
+        index   - rank * 4 + suit, the bit of the card in `encode_hand`
+        bit     - 1 << index
+    """
+
+    __slots__ = ('name', 'rank', 'suit', 'index', 'bit')
+
+    def __init__(self, name):
+        rank, suit, index = CARD_TABLE[name]
+
+        for attr, value in zip(self.__slots__,
+                               (name, rank, suit, index, 1 << index)):
+            object.__setattr__(self, attr, value)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Card is immutable")
+
+    def __reduce__(self):
+        # unpickled cards are the shared instances too
+        return get_card, (self.name,)
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return "Card({0!r})".format(self.name)
+
+
+class Play(object):
+    """
+    An immutable, hashable play. There is one Play per PlayCatalog ID,
+    shared by every caller (see `to_play`), carrying the properties the
+    rules look at so that they are never worked out again from the cards.
+    Plays can be used directly as dict keys and set members, and passed to
+    `is_valid_play` and RoundState; `names` gives the list of strings the
+    rest of the module works with.
+
+    ATTRIBUTES:
+        id      - the PlayCatalog ID
+        mask    - the play packed with `encode_hand`
+        cards   - tuple of Cards, lowest rank first
+        kind    - n for n-of-a-kind (1 for a single) or 0 for a straight
+        length  - number of cards
+        top     - the highest Card
+        rank    - rank index of the highest card
+        suit    - suit index of the highest card
+    """
+
+    __slots__ = ('id', 'mask', 'cards', 'kind', 'length', 'top', 'rank',
+                 'suit')
+
+    def __init__(self, play_id, catalog):
+        mask = catalog.masks[play_id]
+        cards = get_cards()
+        held = tuple(cards[index] for index in xrange(mask.bit_length())
+                     if mask >> index & 1)
+        top = held[-1]
+
+        for attr, value in zip(self.__slots__,
+                               (play_id, mask, held, catalog.kinds[play_id],
+                                len(held), top, top.rank, top.suit)):
+            object.__setattr__(self, attr, value)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Play is immutable")
+
+    def __reduce__(self):
+        return get_play, (self.id,)
+
+    def __hash__(self):
+        return self.id
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.cards)
+
+    def __repr__(self):
+        return "Play({0!r})".format(self.names())
+
+    def names(self):
+        """
+        RETURNS:
+            list    - the cards as strings, lowest rank first, as
+                      `decode_hand` gives them
+        """
+
+        return [card.name for card in self.cards]
+
+    def beats(self, other, on_suit=False):
+        """
+        Returns whether this play can be made on top of `other` in a round
+        led by the same type of play.
+
+        INPUTS:
+            other   - Play on top of the round
+            on_suit - whether the round is on suit
+
+        RETURNS:
+            bool
+        """
+
+        catalog = PLAY_CATALOG or get_play_catalog()
+        beats = catalog.beats_on_suit if on_suit else catalog.beats
+
+        return beats[other.id] >> self.id & 1 == 1
+
+
+class LRUCache(object):
+    """
+    A mapping bounded to `maxsize` entries, which evicts the least recently
+    used entry when full, and counts its hits, misses and evictions.
+
+    Entries are kept in a circular doubly linked list of [prev, next, key,
+    value] links, most recently used last, so that a hit only relinks one
+    entry.
+
+    ATTRIBUTES:
+        maxsize     - the most entries held at once
+        links       - dict of key to link
+        root        - sentinel link of the circular list
+        hits        - number of lookups answered from the cache
+        misses      - number of lookups not in the cache
+        evictions   - number of entries dropped to make room
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.links = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.links)
+
+    def get(self, key, default=None):
+        """
+        Returns the value for `key`, marking it as the most recently used.
+
+        INPUTS:
+            key     - the lookup key
+            default - returned when key is not cached
+
+        RETURNS:
+            the cached value or default
+        """
+
+        link = self.links.get(key)
+
+        if link is None:
+            self.misses += 1
+            return default
+
+        # unlink, then relink just before the root as the newest entry
+        prev, after = link[0], link[1]
+        prev[1], after[0] = after, prev
+
+        root = self.root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0], link[1] = last, root
+
+        self.hits += 1
+
+        return link[3]
+
+    def put(self, key, value):
+        """
+        Stores `value` for `key`, evicting the least recently used entry if
+        the cache is full.
+
+        INPUTS:
+            key     - the lookup key
+            value   - the value to cache, which should not be mutated later
+
+        RETURNS:
+            None
+        """
+
+        link = self.links.pop(key, None)
+
+        if link is not None:
+            link[0][1], link[1][0] = link[1], link[0]
+
+        root = self.root
+        last = root[0]
+        link = [last, root, key, value]
+        last[1] = root[0] = self.links[key] = link
+
+        if len(self.links) > self.maxsize:
+            oldest = root[1]
+            root[1], oldest[1][0] = oldest[1], root
+            del self.links[oldest[2]]
+            self.evictions += 1
+
+    def info(self):
+        """
+        RETURNS:
+            dict    - the counters and current size of the cache
+        """
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.links),
+            'maxsize': self.maxsize,
+        }
+
+
+def enable_cache(maxsize=4096):
+    """
+    Turns on memoisation of `generate_plays` and of the cards offered by
+    `swap_cards`, each in its own LRUCache of `maxsize` entries. Entries are
+    keyed on the packed hand, so the order of the cards does not matter.
+    Cached results are copied on the way out, so callers may mutate them.
+
+    INPUTS:
+        maxsize - the most hands remembered by each cache
+
+    RETURNS:
+        None
+    """
+
+    global PLAY_CACHE, SWAP_CACHE
+
+    PLAY_CACHE = LRUCache(maxsize)
+    SWAP_CACHE = LRUCache(maxsize)
+
+
+def disable_cache():
+    """
+    Turns off, and empties, the caches turned on by `enable_cache`.
+
+    RETURNS:
+        None
+    """
+
+    global PLAY_CACHE, SWAP_CACHE
+
+    PLAY_CACHE = None
+    SWAP_CACHE = None
+
+
+def cache_info():
+    """
+    RETURNS:
+        dict    - LRUCache.info() for 'generate_plays' and 'swap_cards', or
+                  an empty dict when caching is off
+    """
+
+    if PLAY_CACHE is None:
+        return {}
+
+    return {'generate_plays': PLAY_CACHE.info(),
+            'swap_cards': SWAP_CACHE.info()}
+
+
+def set_trace(sink):
+    """
+    Sends a record of every decision `play` makes to `sink`, or stops
+    tracing when `sink` is None. Each record is a dict with:
+
+        'event' - 'leaders' when leading with one of the preferred lead
+                  plays, otherwise 'prefs'
+        'rnd'   - the round passed to play
+        'hand'  - the hand passed to play
+        'plays' - the candidate plays, most preferred first
+
+    The lists are play's own, so a sink that keeps them should copy them.
+
+    e.g. set_trace(lambda record: sys.stderr.write(str(record) + '\n'))
+
+    INPUTS:
+        sink    - a function taking one dict, or None
+
+    RETURNS:
+        None
+    """
+
+    global TRACE
+
+    TRACE = sink
+
+
+def get_play_catalog():
+    """
+    Returns the PlayCatalog shared by the whole module, building it on the
+    first call.
+
+    RETURNS:
+        PlayCatalog
+    """
+
+    global PLAY_CATALOG
+
+    if PLAY_CATALOG is None:
+        PLAY_CATALOG = PlayCatalog()
+
+    return PLAY_CATALOG
+
+
+def get_beats_arrays():
+    """
+    Returns PlayCatalog.beats and beats_on_suit as numpy bool arrays, where
+    [top ID, play ID] is True if the play can be made on that top. They are
+    built on the first call, which is also the first import of numpy.
+
+    RETURNS:
+        tuple   - (beats, beats_on_suit) 2d numpy arrays
+    """
+
+    global BEATS_ARRAYS
+
+    if BEATS_ARRAYS is None:
+        import numpy
+
+        catalog = get_play_catalog()
+        kinds = numpy.array(catalog.kinds)
+        tops = numpy.array(catalog.tops)
+
+        # rows are the top of the round, columns the play made on it
+        same_kind = kinds[:, None] == kinds[None, :]
+        higher = tops[:, None] // 4 < tops[None, :] // 4
+        same_suit = tops[:, None] % 4 == tops[None, :] % 4
+
+        beats = same_kind & higher
+        BEATS_ARRAYS = (beats, beats & same_suit)
+
+    return BEATS_ARRAYS
+
+
+def get_cards():
+    """
+    Returns the Card of every card of the deck, built on the first call.
+
+    RETURNS:
+        tuple   - Cards indexed by their `index`
+    """
+
+    global CARDS
+
+    if CARDS is None:
+        CARDS = tuple(Card(BIT_CARDS[1 << index])
+                      for index in xrange(len(CARD_BITS)))
+
+    return CARDS
+
+
+def get_card(card):
+    """
+    Returns the shared Card for a card string.
+
+    INPUTS:
+        card    - a card, e.g. '7H', or a Card
+
+    RETURNS:
+        Card
+
+    RAISES:
+        KeyError if `card` is not a card
+    """
+
+    if isinstance(card, Card):
+        return card
+
+    return (CARDS or get_cards())[CARD_TABLE[card][2]]
+
+
+def get_play(play_id):
+    """
+    Returns the shared Play for a PlayCatalog ID, building every Play on
+    the first call.
+
+    INPUTS:
+        play_id - a PlayCatalog ID
+
+    RETURNS:
+        Play
+    """
+
+    global PLAYS
+
+    if PLAYS is None:
+        catalog = get_play_catalog()
+        PLAYS = tuple(Play(i, catalog) for i in xrange(len(catalog)))
+
+    return PLAYS[play_id]
+
+
+def to_play(play):
+    """
+    Returns the shared Play for a play in the string form used by the rest
+    of the module. The list given is not modified.
+
+    INPUTS:
+        play    - a list of cards (strings or Cards), a Play, or None
+
+    RETURNS:
+        Play    - or None for a pass
+
+    RAISES:
+        ValueError if the cards are not a legal combination
+    """
+
+    if play is None or isinstance(play, Play):
+        return play
+
+    mask = 0
+
+    for card in play:
+        bit = card.bit if isinstance(card, Card) else CARD_BITS.get(card, 0)
+
+        if not bit or mask & bit:
+            raise ValueError("{0} is not a play".format(play))
+
+        mask |= bit
+
+    play_id = (PLAY_CATALOG or get_play_catalog()).ids.get(mask)
+
+    if play_id is None:
+        raise ValueError("{0} is not a play".format(play))
 
-    # n-of-a-kind case
-    if get_play_n_of_a_kind(first_play) > 1:
+    return get_play(play_id)
 
-        played_rank = get_rank_dict(play).keys()[0]
-        last_played_rank = get_rank_dict(last_play).keys()[0]
 
-        return is_rank_higher(played_rank, last_played_rank)
-    else:
-        # assume either a straight or single card
+def from_play(play):
+    """
+    The inverse of `to_play`.
 
-        sort_cards(play)
-        sort_cards(last_play)
+    INPUTS:
+        play    - a Play, or None
 
-        # False if any random 3 cards other than a straight
-        if len(play) >= 3 and not is_play_straight(play):
-            return False
+    RETURNS:
+        list    - a new list of the cards as strings, or None for a pass
+    """
 
-        highest_played_card = play[-1]  # '[rank][suit]' e.g. '7H'
-        highest_last_played_card = last_play[-1]  # '[rank][suit]' e.g. '8H'
+    return None if play is None else play.names()
 
-        if is_rank_higher(highest_played_card[0], highest_last_played_card[0]):
-            if is_round_on_suit(rnd):
 
-                if cmp(highest_played_card[1],
-                       highest_last_played_card[1]) != 0:
+def encode_round(rnd):
+    """
+    Packs a round into the (top, on_suit) pair used by `is_valid_batch`.
 
-                    return False
+    INPUTS:
+        rnd     - the round to date, as a list of plays or a RoundState
 
-            return True
+    RETURNS:
+        tuple   - (PlayCatalog ID of the top play or -1 before the lead,
+                  is_round_on_suit(rnd))
+    """
 
-    return False
+    if not isinstance(rnd, RoundState):
+        rnd = RoundState(rnd)
 
+    if rnd.lead is None:
+        return -1, False
 
-def play(rnd, hand, discard, holding,
-         generate=generate_plays, valid=is_valid_play):
-    """This function is the game-playing agent, and returns the play in the
-    form of a list of cards or None.
+    if rnd.top_id is None:
+        raise ValueError("cannot encode round {0}".format(rnd.plays))
 
-    'discard' represents the entire history of the game so far. It is a list,
-    each element of which represents a round in order of play in the game.
-    The first item is the first round, and the last item (discard[-1])
-    represents the current round (and is identical to 'rnd').
+    return rnd.top_id, rnd.on_suit
 
-    The function should return a list of cards representing the next play.
-    If there are no valid plays, or if a pass is chosen, the function
-    will return None.
+
+def encode_batch(pairs):
+    """
+    Packs (play, rnd) pairs, as passed to `is_valid_play`, into the arrays
+    taken by `is_valid_batch`. Rounds passed more than once, e.g. as the
+    same RoundState, are only packed once.
+
+    Only plays and rounds made of catalogued plays can be packed, i.e. legal
+    combinations following a lead of the same type, otherwise a ValueError
+    is raised.
 
     INPUTS:
-        rnd     - a list of plays from the round to date
-        hand    - a list of the current cards held by your player
-        discard - a list of the history of the game so far
-        holding - a 4-tuple made up of int values representing how many cards
-                  each of the players is holding, indexed by the player ID
-        generate- which defaults to generate_plays function
-        valid   - which defaults to is_valid_play function
+        pairs   - list of (play, rnd) tuples
 
-    RETURNS
-        list    - list of cards representing the next play.
+    RETURNS:
+        tuple   - (plays, tops, on_suit) numpy arrays
     """
 
-    def is_lead_play():
-        """
-        Returns a bool that indicates whether or not the play is a lead. A play
-        is the lead when rnd has no length.
+    import numpy
 
-        RETURNS
-            bool    - True if play is lead otherwise False
-        """
-        return len(rnd) == 0
+    catalog = get_play_catalog()
+    rounds = {}
+    plays = []
+    tops = []
+    on_suit = []
 
-    def filter_leaders(play):
-        """
-        A key filter function for plays to extract the lead plays.
+    for play, rnd in pairs:
+        if play is None:
+            plays.append(-1)
+        else:
+            play_id = catalog.get_id(play)
 
-        A lead play is any straight not ending in a 2 or A, or any n-of-a-kind
-        that is less than
+            if play_id is None:
+                raise ValueError("cannot encode play {0}".format(play))
 
-        RETURNS
-            bool    - True if play is lead otherwise False
-        """
-        play.sort(key=SORT_FIRST_ELEMENT_BY_RANK)
+            plays.append(play_id)
 
-        predicate = \
-            (
-                is_play_straight(play) and
-                ORDERED_RANKS.index(play[-1][0]) < ORDERED_RANKS.index("A")
-            ) or \
-            (
-                get_play_n_of_a_kind(play) > 1 and
-                ORDERED_RANKS.index(play[0][0]) < ORDERED_RANKS.index("J")
-            )
+        if id(rnd) not in rounds:
+            rounds[id(rnd)] = (rnd, encode_round(rnd))
 
-        return predicate
+        top, suited = rounds[id(rnd)][1]
+        tops.append(top)
+        on_suit.append(suited)
 
-    plays = generate(hand)
+    return (numpy.array(plays, dtype=numpy.int16),
+            numpy.array(tops, dtype=numpy.int16),
+            numpy.array(on_suit, dtype=bool))
 
-    if is_lead_play():
 
-        leaders = list(ifilter(lambda play: filter_leaders(play), plays))
+def is_valid_batch(plays, tops, on_suit):
+    """
+    The vectorised counterpart of `is_valid_play`: element i of the result
+    is is_valid_play(play i, round i) for plays and rounds packed with
+    `encode_batch` (or `encode_round`). The arrays are broadcast together,
+    so, for example, every play of a hand can be checked against a single
+    round.
 
-        # always lead with a straight where possible
-        if len(leaders) > 0:
+    Needs numpy, which is only imported when this is first called.
 
-            leaders.sort(
-                key=lambda play:
-                (
-                    len(play),
-                    len(ORDERED_RANKS) - ORDERED_RANKS.index(play[0][0])
-                ), reverse=True)
+    INPUTS:
+        plays   - array of PlayCatalog IDs, -1 for a pass
+        tops    - array of top play IDs, -1 for a round not yet led
+        on_suit - array of bools, whether each round is on suit
 
-            # print "Leaders: ", leaders
-            return leaders[0]
+    RETURNS:
+        numpy.ndarray - array of bools
+    """
 
-    sort_plays(plays)
+    import numpy
 
-    print "Prefs: ", plays
+    beats, beats_on_suit = get_beats_arrays()
+    plays, tops, on_suit = numpy.broadcast_arrays(
+        numpy.asarray(plays), numpy.asarray(tops),
+        numpy.asarray(on_suit, dtype=bool))
 
-    for play in plays:
+    passes = plays < 0
+    led = tops >= 0
 
-        # never play multiple 2s. They are invaluable!
-        if get_play_n_of_a_kind(play) > 1 and play[0][0] == '2':
-            continue
+    # a pass needs a lead, and anything but a pass can lead
+    valid = passes == led
 
-        if valid(play, rnd):
-            return play
+    following = led & ~passes
+    rows = tops[following]
+    columns = plays[following]
 
-    return None
+    valid[following] = numpy.where(on_suit[following],
+                                   beats_on_suit[rows, columns],
+                                   beats[rows, columns])
+
+    return valid
 
 
 def get_last_play(rnd):
@@ -299,12 +2031,15 @@ def get_last_play(rnd):
     The most recent non-pass play.
 
     INPUTS
-        rnd     - list of plays
+        rnd     - list of plays or a RoundState
 
     OUTPUTS
         list    - Last valid non-pass play
     """
 
+    if isinstance(rnd, RoundState):
+        return rnd.top if rnd.top is not None else []
+
     plays_reversed = \
         list(ifilter(lambda play: play is not None, rnd[-1::-1]))
 
@@ -322,11 +2057,15 @@ def is_round_on_suit(rnd):
     INPUTS:
         rnd     - the round to date, in the form of a list of plays in
               sequential order (each of which is, in turn, a list of cards)
+              or a RoundState
 
     RETURNS:
         bool    - True if round is 'on_suit' otherwise False
     """
 
+    if isinstance(rnd, RoundState):
+        return rnd.on_suit
+
     if (
             rnd is None or
             len(rnd) < 2 or
@@ -384,25 +2123,42 @@ def is_play_straight(play):
         bool    - True if play is a straight otherwise False
     """
 
-    if play is None:
+    if play is None or None in play:
         return False
 
-    suit_dict = get_suit_dict(play)
+    mask = encode_hand(play)
 
-    # must be a flush i.e. all one suit
-    if len(suit_dict.keys()) != 1:
+    # a repeated card can never be part of a straight
+    if count_cards(mask) != len(play):
         return False
 
-    ranks = suit_dict.values()[0]
+    return is_straight_mask(mask)
+
 
-    # straight must have a minimum of 3 cards
-    if len(ranks) < 3:
+def is_straight_mask(mask):
+    """
+    Returns a boolean indicating whether or not the packed play `mask` is a
+    straight, i.e. three or more consecutive ranks of one suit.
+
+    INPUTS:
+        mask    - int, a play packed with `encode_hand`
+
+    RETURNS:
+        bool    - True if mask is a straight otherwise False
+    """
+
+    if not mask:
         return False
 
-    ranks.sort(key=SORT_FIRST_ELEMENT_BY_RANK)
-    straight = "".join(ranks)
+    lowest = (mask & -mask).bit_length() - 1
+    length = count_cards(mask)
+
+    # straight must have a minimum of 3 cards and cannot wrap past the '2'
+    if length < 3 or lowest // 4 + length > len(ORDERED_RANKS):
+        return False
 
-    return straight in ORDERED_RANKS
+    # shifting a single-suit run down to bit 0 leaves exactly the lane run
+    return mask >> lowest == RANK_RUNS[length]
 
 
 def is_rank_higher(test_rank, base_rank):
@@ -418,7 +2174,7 @@ def is_rank_higher(test_rank, base_rank):
         bool        - True if test_rank is higher otherwise False
     """
 
-    return ORDERED_RANKS.index(test_rank) > ORDERED_RANKS.index(base_rank)
+    return RANK_INDEX[test_rank] > RANK_INDEX[base_rank]
 
 
 def get_play_n_of_a_kind(play):
@@ -439,19 +2195,229 @@ def get_play_n_of_a_kind(play):
     """
 
     # if the rnd has fewer than two plays then it cannot be 'on suit'
-    if play is None:
+    if play is None or len(play) == 0 or None in play:
         return 0
 
-    rank_dict = get_rank_dict(play)
-
     # must have only rank to be n-of-a-kind
-    if not 0 < len(rank_dict.keys()) < 2:
+    if get_rank_index_mask(encode_hand(play)) < 0:
+        return 0
+
+    return len(play)
+
+
+def get_n_of_a_kind_mask(mask):
+    """
+    The packed counterpart of `get_play_n_of_a_kind`.
+
+    INPUTS:
+        mask    - int, a play packed with `encode_hand`
+
+    RETURNS:
+        int     - int that corresponds to the n-of-a-kind (0-4)
+    """
+
+    if get_rank_index_mask(mask) < 0:
         return 0
 
-    return len(rank_dict.values()[0])
+    return count_cards(mask)
+
+
+def get_rank_index_mask(mask):
+    """
+    Returns the index in ORDERED_RANKS shared by every card in `mask`, or -1
+    if the mask is empty or spans more than one rank.
+
+    INPUTS:
+        mask    - int, a play packed with `encode_hand`
+
+    RETURNS:
+        int     - rank index (0-12) or -1
+    """
+
+    if not mask:
+        return -1
 
+    rank_index = ((mask & -mask).bit_length() - 1) // 4
 
-def deal(players=4):
+    # every card must sit inside the lowest card's rank nibble
+    if mask >> (4 * rank_index) > 0xF:
+        return -1
+
+    return rank_index
+
+
+def encode_hand(hand):
+    """
+    Packs a list of cards into a single 52 bit int. Cards are laid out rank
+    major, so bit (rank index * 4 + suit index) is set for each card, where
+    the indices come from ORDERED_RANKS and SUITS.
+
+    e.g. ['3S'] -> 1, ['3H'] -> 2, ['4S'] -> 16
+
+    INPUTS:
+        hand    - list of cards (e.g. ['3D', 'JH', '2C'])
+
+    RETURNS:
+        int     - the packed hand
+    """
+
+    mask = 0
+
+    for card in hand:
+        mask |= CARD_BITS[card]
+
+    return mask
+
+
+def decode_hand(mask):
+    """
+    Unpacks an int built by `encode_hand` into a list of cards, sorted by
+    rank and then by the order of SUITS.
+
+    INPUTS:
+        mask    - int, the packed hand
+
+    RETURNS:
+        list    - list of cards
+    """
+
+    cards = []
+
+    while mask:
+        bit = mask & -mask
+        cards.append(BIT_CARDS[bit])
+        mask ^= bit
+
+    return cards
+
+
+def count_cards(mask):
+    """
+    Returns the number of cards in a packed hand.
+
+    INPUTS:
+        mask    - int, the packed hand
+
+    RETURNS:
+        int     - number of set bits
+    """
+
+    return bin(mask).count('1')
+
+
+def permute_suits(mask, perm):
+    """
+    Relabels the suits of a packed hand, moving every card of suit s to
+    suit perm[s] at the same rank.
+
+    INPUTS:
+        mask    - int, the packed hand
+        perm    - sequence of 4 distinct suit indices
+
+    RETURNS:
+        int     - the relabelled packed hand
+    """
+
+    permuted = 0
+
+    for suit, target in enumerate(perm):
+        permuted |= ((mask >> suit) & RANK_LANE) << target
+
+    return permuted
+
+
+def canonical_suits(masks):
+    """
+    Relabels the suits of a group of packed hands the same way, so that
+    every group equivalent under some relabelling of the suits comes out
+    the same. Only whether cards share a suit matters to the rules (for
+    straights and for a round being on suit), so the groups are equivalent
+    for any cache or search table.
+
+    The hands are packed side by side into one int, so that the cards of
+    each suit across all of them are a handful of shifts and ANDs away, and
+    the suits are ordered by those cards. Suits holding the same cards in
+    every hand are interchangeable.
+
+    INPUTS:
+        masks   - sequence of packed hands
+
+    RETURNS:
+        tuple   - (relabelled masks as a tuple, perm, inverse) where the
+                  masks were relabelled with `permute_suits(mask, perm)`
+                  and `permute_suits(mask, inverse)` undoes it
+    """
+
+    width = len(CARD_BITS)
+    packed = 0
+    lane = 0
+
+    for mask in reversed(masks):
+        packed = packed << width | mask
+        lane = lane << width | RANK_LANE
+
+    lanes = [(packed >> suit) & lane for suit in xrange(len(SUITS))]
+    inverse = tuple(sorted(xrange(len(SUITS)), key=lanes.__getitem__,
+                           reverse=True))
+    perm = [0] * len(SUITS)
+    packed = 0
+
+    for target, suit in enumerate(inverse):
+        perm[suit] = target
+        packed |= lanes[suit] << target
+
+    return (tuple((packed >> (width * index)) & DECK_MASK
+                  for index in xrange(len(masks))), tuple(perm), inverse)
+
+
+def canonical_state(hand, rnd=(), unseen=()):
+    """
+    The string form of `canonical_suits`, for a hand, the round to date and
+    the unseen cards. Two states with the same key differ only by the names
+    of their suits, and a play for one is translated to the other with
+    `permute_cards`.
+
+    INPUTS:
+        hand    - a list of cards
+        rnd     - the round to date, a list of plays or None
+        unseen  - a list of cards
+
+    RETURNS:
+        tuple   - (key, perm, inverse) where key is a hashable tuple of
+                  the relabelled hand, unseen cards and round, packed, with
+                  passes as None, and perm and inverse are as for
+                  `canonical_suits`
+    """
+
+    plays = [play for play in rnd if play is not None]
+    masks, perm, inverse = canonical_suits(
+        [encode_hand(hand), encode_hand(unseen)] +
+        [encode_hand(play) for play in plays])
+    played = iter(masks[2:])
+
+    return (masks[:2] + tuple(None if play is None else next(played)
+                              for play in rnd), perm, inverse)
+
+
+def permute_cards(cards, perm):
+    """
+    Relabels the suits of a list of cards, as `permute_suits`.
+
+    INPUTS:
+        cards   - a list of cards, or None
+        perm    - sequence of 4 distinct suit indices
+
+    RETURNS:
+        list    - the relabelled cards, lowest rank first, or None
+    """
+
+    if cards is None:
+        return None
+
+    return decode_hand(permute_suits(encode_hand(cards), perm))
+
+
+def deal(players=4, rng=None):
     """
     For internal testing.
 
@@ -462,11 +2428,13 @@ def deal(players=4):
 
     INPUTS:
         players - the number of players to deal to
+        rng     - optional random.Random used to shuffle, so that deals can
+                  be reproduced without touching the global random state
 
     RETURNS:
         list    - a tuple of lists.
     """
-    deck = get_deck(True)
+    deck = get_deck(True, rng)
     hands = list(list() for i in xrange(players))
     players = cycle(hands)
 
@@ -476,12 +2444,11 @@ def deal(players=4):
 
     for hand in hands:
         sort_cards(hand)
-        generate_plays(hand)
 
     return hands
 
 
-def get_deck(shouldShuffle=False):
+def get_deck(shouldShuffle=False, rng=None):
     """
     For internal testing.
 
@@ -491,6 +2458,8 @@ def get_deck(shouldShuffle=False):
     INPUTS:
         shouldShuffle   - boolean that determines whether or not the deck order
                           is randomised.
+        rng             - optional random.Random to shuffle with instead of
+                          the global random state
 
     RETURNS
         list            - list of strings exactly 52 in length.
@@ -500,7 +2469,7 @@ def get_deck(shouldShuffle=False):
     deck = [''.join(card) for card in deck]
 
     if shouldShuffle:
-        shuffle(deck)
+        (rng.shuffle if rng is not None else shuffle)(deck)
 
     return deck
 
@@ -510,8 +2479,8 @@ def sort_cards(hand):
     Will mutate the `hand` according to the Diafugo rule of
     value ordering, which, in ascending order, is: 34567890JQKA2
 
-    It uses `SORT_FIRST_ELEMENT_BY_RANK` constant function as its sort key,
-    which looks up the index of the rank in ORDERED_RANKS.
+    It uses the `CARD_RANK_INDEX` lookup table as its sort key, which maps
+    each card to the index of its rank in ORDERED_RANKS.
 
     It is wrapped in a function since it is used more than once, so it is
     easier to modify this function if a change is required.
@@ -523,7 +2492,7 @@ def sort_cards(hand):
         None
     """
 
-    hand.sort(key=SORT_FIRST_ELEMENT_BY_RANK)
+    hand.sort(key=CARD_RANK_INDEX.__getitem__)
 
 
 def sort_plays(plays, reversed=False):
@@ -540,7 +2509,7 @@ def sort_plays(plays, reversed=False):
 
     # STAGE 1
     # sort by length then by rank value low->high
-    plays.sort(key=lambda play: (len(play), ORDERED_RANKS.index(play[-1][0])),
+    plays.sort(key=lambda play: (len(play), CARD_RANK_INDEX[play[-1]]),
                reverse=reversed)
 
     # Stage 2
@@ -617,23 +2586,33 @@ def get_all_n_of_a_kind(hand):
     RETURNS:
         groups  - list of lists
     """
-    rank_dict = get_rank_dict(hand)
 
-    all_combinations = []
+    return [decode_hand(mask) for mask in
+            get_all_n_of_a_kind_mask(encode_hand(hand))]
+
+
+def get_all_n_of_a_kind_mask(mask):
+    """
+    The packed counterpart of `get_all_n_of_a_kind`. For each rank, from
+    lowest to highest, all the pairs are listed, then the triples and then
+    the four-of-a-kind.
 
-    for rank in rank_dict.keys():
+    INPUTS:
+        mask    - int, a hand packed with `encode_hand`
 
-        # need to combine the ranks and suits
-        cards = [rank + suit for suit in rank_dict[rank]]
+    RETURNS:
+        list    - list of int card masks
+    """
 
-        if len(cards) >= 2:  # two or more get all 2-of-a-kind
-            all_combinations += [list(card) for card in combinations(cards, 2)]
+    all_combinations = []
+    shift = 0
 
-        if len(cards) >= 3:  # three or more get all 3-of-a-kind
-            all_combinations += [list(card) for card in combinations(cards, 3)]
+    while mask >> shift:
+        # KIND_SUBSETS holds every 2, 3 and 4 card subset of a rank nibble
+        for subset in KIND_SUBSETS[(mask >> shift) & 0xF]:
+            all_combinations.append(subset << shift)
 
-        if len(cards) == 4:  # 4-of-a-kind
-            all_combinations += [cards]
+        shift += 4
 
     return all_combinations
 
@@ -645,6 +2624,9 @@ def get_all_straights(hand):
 
     e.g. [['3D', '4D', '5D'], ['7C', '8C', '9C', '0C']]
 
+    The straights are listed suit by suit in the order of SUITS, then by
+    length and then by lowest rank, as `get_all_straights_mask` lists them.
+
     INPUTS:
         hand    - list of cards (e.g. ['3D', '5S', '7C'])
 
@@ -652,76 +2634,164 @@ def get_all_straights(hand):
         groups  - list of lists
     """
 
-    def get_straight_possibilities(ranks):
-        """
-        Returns the potential straight combinations in lists where
-        the minimum length of a straight must be 3.
-
-        Combinations is used over Permutations to reduce the overhead of
-        possible_straights. To overcome the possibility that a combination
-        may not be ordered, the resulting straight combination is sorted in the
-        body of `find_all_straights`
+    return [decode_hand(mask) for mask in
+            get_all_straights_mask(encode_hand(hand))]
 
-        INPUTS:
 
-            ranks      - list of ranks e.g. ['3', '4', '5', 'J', 'Q', 'K']
+def get_all_straights_mask(mask):
+    """
+    The packed counterpart of `get_all_straights`. Straights are listed suit
+    by suit in the order of SUITS, then by length and then by lowest rank.
 
-        RETURNS:
-            iterator   - iterator of all valid and invalid straight combinations
+    Rather than testing candidates, the maximal runs of consecutive ranks are
+    found for each suit and every sub-run of 3 or more cards is emitted, so
+    the work done is proportional to the number of straights returned.
 
-        """
-        straight_range = range(3, len(ranks) + 1)
+    INPUTS:
+        mask    - int, a hand packed with `encode_hand`
 
-        return chain.from_iterable(
-            combinations(
-                ranks, straight_length) for straight_length in straight_range)
+    RETURNS:
+        list    - list of int card masks
+    """
 
     all_straights = []
 
     # no possibility of a straight if there are less than 3 cards.
-    if len(hand) < 3:
+    if count_cards(mask) < 3:
         return all_straights
 
-    suit_dict = get_suit_dict(hand)  # suit as key, rank as value e.g. {'H':[0]}
+    for suit_index in xrange(len(SUITS)):
 
-    for suit in suit_dict:
+        # shift the suit down so that each rank occupies the lowest nibble bit
+        lane = (mask >> suit_index) & RANK_LANE
+        runs = get_lane_runs(lane)
 
-        ranks = suit_dict[suit]
-
-        if len(ranks) < 3:
+        if not runs:
             continue
 
-        # `s` is a straight_possibility
-        # i.e. a tuple of ranks in the straight powerset
-        for s in get_straight_possibilities(ranks):
-
-            # sort the sequence as it could be jumbled
-            s = list(s)
-            s.sort(key=SORT_FIRST_ELEMENT_BY_RANK)
+        longest = max(length for start, length in runs)
 
-            straight = "".join(s)
+        for length in xrange(3, longest + 1):
+            straight = RANK_RUNS[length]
 
-            if straight in ORDERED_RANKS:
-                all_straights.append(
-                    ["".join(card) for card in product(straight, suit)])
+            for start, run_length in runs:
+                for shift in xrange(start, start + run_length - length + 1):
+                    all_straights.append(straight << (4 * shift + suit_index))
 
     return all_straights
 
 
+def get_lane_runs(lane):
+    """
+    Returns the maximal runs of consecutive ranks, of at least 3 cards, in a
+    single suit lane (see RANK_LANE), from lowest to highest.
+
+    e.g. ['3H', '4H', '5H', '9H', '0H', 'JH', 'QH'] in the 'H' lane gives
+         [(0, 3), (6, 4)]
+
+    INPUTS:
+        lane    - int, a packed hand holding only lowest nibble bits
+
+    RETURNS:
+        list    - list of (rank index, length) tuples
+    """
+
+    runs = []
+
+    while lane:
+        start = ((lane & -lane).bit_length() - 1) // 4
+
+        # the first rank missing above `start` ends the run
+        gaps = ~(lane >> (4 * start)) & RANK_LANE
+        length = ((gaps & -gaps).bit_length() - 1) // 4 if gaps \
+            else len(ORDERED_RANKS)
+
+        if length >= 3:
+            runs.append((start, length))
+
+        lane &= ~(RANK_RUNS[length] << (4 * start))
+
+    return runs
+
+
 # CONSTANTS
 
 SUITS = 'SHCD'
 ORDERED_RANKS = '34567890JQKA2'
+RANK_INDEX = dict((rank, r) for r, rank in enumerate(ORDERED_RANKS))
 SORT_FIRST_ELEMENT_BY_RANK = \
-    lambda string: ORDERED_RANKS.index(string[0])  # e.g. ['2H']
+    lambda string: RANK_INDEX[string[0]]  # e.g. ['2H']
+
+# CARD_TABLE maps each of the 52 cards to (rank index, suit index, card id).
+# Card ids are rank major, i.e. rank index * 4 + suit index.
+CARD_TABLE = dict((rank + suit, (r, s, 4 * r + s))
+                  for r, rank in enumerate(ORDERED_RANKS)
+                  for s, suit in enumerate(SUITS))
+CARD_RANK_INDEX = dict((card, entry[0]) for card, entry in CARD_TABLE.items())
+
+# Packed hands: bit (card id) is set for each card held
+CARD_BITS = dict((card, 1 << entry[2]) for card, entry in CARD_TABLE.items())
+BIT_CARDS = dict((bit, card) for card, bit in CARD_BITS.items())
+DECK_MASK = (1 << len(CARD_BITS)) - 1
+
+# lowest bit of every rank nibble, i.e. one suit across all the ranks
+RANK_LANE = sum(1 << (4 * r) for r in xrange(len(ORDERED_RANKS)))
+
+# RANK_RUNS[n] is a run of n consecutive ranks in the lowest suit
+RANK_RUNS = [RANK_LANE & ((1 << (4 * n)) - 1)
+             for n in xrange(len(ORDERED_RANKS) + 1)]
+
+# KIND_SUBSETS[nibble] lists the 2, 3 and 4 card subsets of a rank nibble
+KIND_SUBSETS = [[sum(1 << s for s in subset)
+                 for n in xrange(2, 5)
+                 for subset in combinations(
+                     [s for s in xrange(len(SUITS)) if nibble >> s & 1], n)]
+                for nibble in xrange(16)]
+
+# KIND_SUBSETS_BY_SIZE[n][nibble] keeps only the n card subsets
+KIND_SUBSETS_BY_SIZE = [[[subset for subset in KIND_SUBSETS[nibble]
+                          if bin(subset).count('1') == n]
+                         for nibble in xrange(16)]
+                        for n in xrange(5)]
+
+# opt-in memoisation, see enable_cache
+PLAY_CACHE = None
+SWAP_CACHE = None
+
+# opt-in decision tracing, see set_trace
+TRACE = None
+
+# every play of the deck, built on first use by get_play_catalog
+PLAY_CATALOG = None
+
+# numpy copies of PLAY_CATALOG.beats, built on first use by get_beats_arrays
+BEATS_ARRAYS = None
+
+# the shared Card and Play objects, built on first use by get_cards and
+# get_play
+CARDS = None
+PLAYS = None
 
 # Internal Testing
 
-d = deal()
-for i in range(len(d)):
-    hand = d[i]
-    plays = generate_plays(hand)
-    sort_plays(plays)
+
+def main():
+    """
+    For internal testing.
+
+    Deals a game and prints the plays of each hand in order of preference.
+
+    RETURNS:
+        None
+    """
+
+    for hand in deal():
+        plays = generate_plays(hand)
+        sort_plays(plays)
+
+        print hand
+        print "    ", plays
+
 
 # print get_all_straights(['3H', '4H', '5H', 'JH', 'QH', 'KH'])
 # print get_all_straights(["2H", "AH", "KH", "QH", "JH", "0H", "9H"])
@@ -789,3 +2859,7 @@ for i in range(len(d)):
 #                     [['9S'], ['JH']])  # False
 # print is_valid_play(["6D"],
 #                     [['3S', '4S', '5S'], None])  # False
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,668 @@
+# coding=utf-8
+"""*****************************************************************************
+
+Daifugo Benchmarks
+
+Timings for the hot functions in bcrowley. Run directly:
+
+    python benchmarks.py [--suite-only] [--save-baseline] [--tolerance 0.25]
+
+The comparisons time current functions against the versions they replaced.
+The suite times every public function over fixed, seeded corpora and checks
+the results against the stored baseline, benchmarks_baseline.json.
+
+*****************************************************************************"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from functools import partial
+from itertools import chain, combinations, product
+from random import Random
+from timeit import Timer, default_timer
+
+import bcrowley
+import simulator
+from corpora import long_rounds
+
+
+def time_call(func, args, number=1000, repeat=3):
+    """
+    Returns the best per-call time of `func(*args)` over `repeat` runs of
+    `number` calls each.
+
+    INPUTS:
+        func    - the function to time
+        args    - tuple of arguments passed to func on each call
+        number  - calls per run
+        repeat  - number of runs, the fastest is kept
+
+    RETURNS:
+        float   - seconds per call
+    """
+
+    timer = Timer(lambda: func(*args))
+
+    return min(timer.repeat(repeat, number)) / number
+
+
+def report(name, baseline, candidate):
+    """
+    Prints a one line comparison of two per-call timings.
+
+    INPUTS:
+        name        - label for the benchmark
+        baseline    - seconds per call of the reference implementation
+        candidate   - seconds per call of the current implementation
+
+    RETURNS:
+        None
+    """
+
+    print "{0:<32} {1:>10.2f}us {2:>10.2f}us {3:>8.1f}x".format(
+        name, baseline * 1e6, candidate * 1e6, baseline / candidate)
+
+
+def legacy_get_all_straights(hand):
+    """
+    The original combinations based `bcrowley.get_all_straights`, kept as the
+    reference for both the output and the timing of the run based version.
+
+    INPUTS:
+        hand    - list of cards (e.g. ['3D', '5S', '7C'])
+
+    RETURNS:
+        groups  - list of lists
+    """
+
+    all_straights = []
+
+    if len(hand) < 3:
+        return all_straights
+
+    suit_dict = bcrowley.get_suit_dict(hand)
+
+    for suit in suit_dict:
+
+        ranks = suit_dict[suit]
+
+        if len(ranks) < 3:
+            continue
+
+        possibilities = chain.from_iterable(
+            combinations(ranks, length) for length in xrange(3, len(ranks) + 1))
+
+        for s in possibilities:
+            s = list(s)
+            s.sort(key=bcrowley.SORT_FIRST_ELEMENT_BY_RANK)
+
+            straight = "".join(s)
+
+            if straight in bcrowley.ORDERED_RANKS:
+                all_straights.append(
+                    ["".join(card) for card in product(straight, suit)])
+
+    return all_straights
+
+
+def legacy_sort_cards(hand):
+    """
+    The original `bcrowley.sort_cards`, which searched ORDERED_RANKS for the
+    rank of every card.
+
+    INPUTS:
+        hand   - list of cards to be sorted
+
+    RETURNS
+        None
+    """
+
+    hand.sort(key=lambda card: bcrowley.ORDERED_RANKS.index(card[0]))
+
+
+def legacy_sort_plays(plays, reversed=False):
+    """
+    The original `bcrowley.sort_plays`, which searched ORDERED_RANKS for the
+    rank of the highest card of every play.
+
+    INPUTS:
+        plays   - list of plays to be sorted
+
+    RETURNS
+        None
+    """
+
+    plays.sort(
+        key=lambda play: (len(play), bcrowley.ORDERED_RANKS.index(play[-1][0])),
+        reverse=reversed)
+
+
+def random_hands(count=100, size=13, seed=0):
+    """
+    Returns `count` hands dealt from a freshly shuffled deck, reproducible
+    for a given `seed`.
+
+    INPUTS:
+        count   - number of hands
+        size    - cards in each hand
+        seed    - seed for the random number generator
+
+    RETURNS:
+        list    - list of hands
+    """
+
+    rng = Random(seed)
+    deck = bcrowley.get_deck()
+
+    return [rng.sample(deck, size) for i in xrange(count)]
+
+
+def full_suit_hands():
+    """
+    Returns the worst case hands for straight enumeration: one per suit, each
+    holding all 13 ranks of that suit.
+
+    RETURNS:
+        list    - list of 4 hands
+    """
+
+    return [[rank + suit for rank in bcrowley.ORDERED_RANKS]
+            for suit in bcrowley.SUITS]
+
+
+def bench_straights():
+    """
+    Compares `get_all_straights` with the legacy combinations version on
+    full-suit hands, after checking that both return the same straights.
+
+    RETURNS:
+        None
+    """
+
+    for hand in full_suit_hands():
+        legacy = legacy_get_all_straights(hand)
+        current = bcrowley.get_all_straights(hand)
+
+        assert sorted(legacy) == sorted(current), hand
+
+        report("get_all_straights (" + hand[0][1] + " suit)",
+               time_call(legacy_get_all_straights, (hand,), number=10),
+               time_call(bcrowley.get_all_straights, (hand,)))
+
+
+def bench_sorting():
+    """
+    Compares `sort_cards` and `sort_plays` with the legacy ORDERED_RANKS.index
+    versions over a corpus of random 13 card hands and their plays.
+
+    RETURNS:
+        None
+    """
+
+    hands = random_hands()
+    plays = [bcrowley.generate_plays(list(hand)) for hand in hands]
+
+    def sort_all(sort, items):
+        for item in items:
+            sort(list(item))
+
+    for hand in hands:
+        expected, actual = list(hand), list(hand)
+        legacy_sort_cards(expected)
+        bcrowley.sort_cards(actual)
+
+        assert expected == actual, hand
+
+    report("sort_cards (100 hands)",
+           time_call(sort_all, (legacy_sort_cards, hands), number=100),
+           time_call(sort_all, (bcrowley.sort_cards, hands), number=100))
+    report("sort_plays (100 hands)",
+           time_call(sort_all, (legacy_sort_plays, plays), number=100),
+           time_call(sort_all, (bcrowley.sort_plays, plays), number=100))
+
+
+def bench_cache(games=200, maxsize=4096):
+    """
+    Records every hand passed to `generate_plays` during seeded self-play,
+    then compares replaying that stream of calls with and without
+    `bcrowley.enable_cache`, and prints the cache counters.
+
+    INPUTS:
+        games   - number of self-play games to record
+        maxsize - size of each LRU cache
+
+    RETURNS:
+        None
+    """
+
+    hands = []
+
+    def recording_generate(hand):
+        hands.append(list(hand))
+        return bcrowley.generate_plays(hand)
+
+    agents = [partial(bcrowley.play, generate=recording_generate)] * 4
+    simulator.simulate(games, agents, rng=Random(0))
+
+    def replay():
+        for hand in hands:
+            bcrowley.generate_plays(list(hand))
+
+    bcrowley.disable_cache()
+    uncached = time_call(replay, (), number=1)
+
+    bcrowley.enable_cache(maxsize)
+    cached = time_call(replay, (), number=1, repeat=1)
+    info = bcrowley.cache_info()
+    bcrowley.disable_cache()
+
+    report("generate_plays (self-play, cached)",
+           uncached / len(hands), cached / len(hands))
+
+    for name in sorted(info):
+        print "  {0}: {1}".format(name, info[name])
+
+
+def bench_import(runs=5):
+    """
+    Times a fresh interpreter importing bcrowley against one that imports
+    nothing, and checks that the import prints nothing. Importing must stay
+    free of side effects, as every worker process pays for it.
+
+    INPUTS:
+        runs    - interpreters started for each case, the fastest is kept
+
+    RETURNS:
+        None
+    """
+
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def start(code):
+        best = None
+
+        for i in xrange(runs):
+            timer = Timer(lambda: subprocess.check_output(
+                [sys.executable, '-c', code], cwd=here))
+            taken = timer.timeit(1)
+            best = taken if best is None else min(best, taken)
+
+        return best
+
+    output = subprocess.check_output(
+        [sys.executable, '-c', 'import bcrowley'], cwd=here)
+
+    assert output == '', "importing bcrowley wrote to stdout"
+
+    report("import bcrowley (vs bare python)", start('pass'), start('import bcrowley'))
+
+
+def bench_trace(games=50):
+    """
+    Compares `play` with and without a trace sink over every decision of a
+    few seeded self-play games, to show what tracing costs per decision.
+
+    INPUTS:
+        games   - number of self-play games to record decisions from
+
+    RETURNS:
+        None
+    """
+
+    decisions = []
+
+    def recording_play(rnd, hand, discard, holding):
+        decisions.append((list(rnd), list(hand), discard, holding))
+        return bcrowley.play(rnd, hand, discard, holding)
+
+    simulator.simulate(games, [recording_play] * 4, rng=Random(0))
+
+    def replay():
+        for rnd, hand, discard, holding in decisions:
+            bcrowley.play(rnd, list(hand), discard, holding)
+
+    records = []
+
+    bcrowley.set_trace(None)
+    untraced = time_call(replay, (), number=1)
+
+    bcrowley.set_trace(records.append)
+    traced = time_call(replay, (), number=1)
+    bcrowley.set_trace(None)
+
+    # untraced play is the reference, so a speedup below 1 is the slowdown
+    report("play (tracing overhead)",
+           untraced / len(decisions), traced / len(decisions))
+    print "  overhead: {0:.2f}us per decision ({1:+.0%})".format(
+        (traced - untraced) / len(decisions) * 1e6, traced / untraced - 1)
+
+
+def bench_batch(count=500):
+    """
+    Compares calling `is_valid_play` in a loop with one `is_valid_batch`
+    call over the same (play, round) pairs, and checks they agree. Skipped
+    when numpy is not installed.
+
+    INPUTS:
+        count   - number of rounds to check a candidate play against
+
+    RETURNS:
+        None
+    """
+
+    try:
+        import numpy
+    except ImportError:
+        print "is_valid_batch skipped, numpy is not installed"
+        return
+
+    pairs = [(play, bcrowley.RoundState(rnd))
+             for play, rnd in long_rounds(count, length=8, seed=0)]
+    plays, tops, on_suit = bcrowley.encode_batch(pairs)
+
+    def loop():
+        return [bcrowley.is_valid_play(play, rnd) for play, rnd in pairs]
+
+    assert list(bcrowley.is_valid_batch(plays, tops, on_suit)) == loop()
+
+    report("is_valid_play (batch vs loop)",
+           time_call(loop, (), number=10) / count,
+           time_call(bcrowley.is_valid_batch, (plays, tops, on_suit),
+                     number=10) / count)
+
+
+# Suite
+#
+# Every public function is timed call by call over fixed, seeded corpora,
+# and the results are compared with BASELINE_FILE.
+
+BASELINE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'benchmarks_baseline.json')
+
+
+def pair_heavy_hands(count=100, seed=0):
+    """
+    Returns `count` 13 card hands made mostly of pairs, triples and
+    four-of-a-kind, reproducible for a given `seed`.
+
+    INPUTS:
+        count   - number of hands
+        seed    - seed for the random number generator
+
+    RETURNS:
+        list    - list of hands
+    """
+
+    rng = Random(seed)
+    hands = []
+
+    for i in xrange(count):
+        ranks = list(bcrowley.ORDERED_RANKS)
+        rng.shuffle(ranks)
+        hand = []
+
+        for rank in ranks:
+            suits = rng.sample(bcrowley.SUITS, rng.randint(2, 4))
+            hand += [rank + suit for suit in suits][:13 - len(hand)]
+
+            if len(hand) == 13:
+                break
+
+        hands.append(hand)
+
+    return hands
+
+
+def self_play_decisions(games=20, seed=0):
+    """
+    Returns the arguments of every call to `bcrowley.play` made during
+    `games` seeded self-play games.
+
+    INPUTS:
+        games   - number of games to record
+        seed    - seed for the deals
+
+    RETURNS:
+        list    - list of (rnd, hand, discard, holding) tuples
+    """
+
+    decisions = []
+
+    def recording_play(rnd, hand, discard, holding):
+        decisions.append((list(rnd), list(hand),
+                          [list(r) for r in discard], holding))
+        return bcrowley.play(rnd, hand, discard, holding)
+
+    simulator.simulate(games, [recording_play] * 4, rng=Random(seed))
+
+    return decisions
+
+
+def suite_cases():
+    """
+    Builds the benchmark suite from its corpora:
+
+        random      - random 13 card hands
+        full_suit   - every rank of one suit, the worst case for straights
+        pairs       - hands made mostly of n-of-a-kind
+        long_rounds - 40 play rounds, mostly passes, with a candidate play
+        self_play   - every decision of seeded self-play games
+
+    RETURNS:
+        list    - list of (name, function, list of argument tuples)
+    """
+
+    random13 = random_hands(200, seed=1)
+    full_suit = full_suit_hands()
+    pairs = pair_heavy_hands(200, seed=2)
+    rounds = long_rounds(50, seed=3)
+    decisions = self_play_decisions(20, seed=4)
+    holding = (13, 13, 13, 13)
+
+    return [
+        ('generate_plays/random', bcrowley.generate_plays,
+         [(hand,) for hand in random13]),
+        ('generate_plays/full_suit', bcrowley.generate_plays,
+         [(hand,) for hand in full_suit]),
+        ('generate_plays/pairs', bcrowley.generate_plays,
+         [(hand,) for hand in pairs]),
+        ('PlayCatalog.plays/random', bcrowley.get_play_catalog().plays,
+         [(bcrowley.encode_hand(hand),) for hand in random13]),
+        ('get_all_straights/random', bcrowley.get_all_straights,
+         [(hand,) for hand in random13]),
+        ('get_all_straights/full_suit', bcrowley.get_all_straights,
+         [(hand,) for hand in full_suit]),
+        ('get_all_n_of_a_kind/random', bcrowley.get_all_n_of_a_kind,
+         [(hand,) for hand in random13]),
+        ('get_all_n_of_a_kind/pairs', bcrowley.get_all_n_of_a_kind,
+         [(hand,) for hand in pairs]),
+        ('is_play_straight/long_rounds', bcrowley.is_play_straight,
+         [(play,) for play, rnd in rounds]),
+        ('get_play_n_of_a_kind/long_rounds', bcrowley.get_play_n_of_a_kind,
+         [(play,) for play, rnd in rounds]),
+        ('get_last_play/long_rounds', bcrowley.get_last_play,
+         [(rnd,) for play, rnd in rounds]),
+        ('is_round_on_suit/long_rounds', bcrowley.is_round_on_suit,
+         [(rnd,) for play, rnd in rounds]),
+        ('is_valid_play/long_rounds', bcrowley.is_valid_play, rounds),
+        ('generate_follows/long_rounds', bcrowley.generate_follows,
+         [(hand, rnd) for (play, rnd), hand in zip(rounds, random13)]),
+        ('sort_cards/random', bcrowley.sort_cards,
+         [(hand,) for hand in random13]),
+        ('sort_plays/random', bcrowley.sort_plays,
+         [(bcrowley.generate_plays(list(hand)),) for hand in random13]),
+        ('swap_cards/random', bcrowley.swap_cards,
+         [(hand, pid) for hand in random13[:50] for pid in xrange(4)]),
+        ('swap_cards/pairs', bcrowley.swap_cards,
+         [(hand, pid) for hand in pairs[:50] for pid in xrange(4)]),
+        ('play/self_play', bcrowley.play, decisions),
+        ('play_many/self_play', bcrowley.play_many,
+         [(decisions[start:start + 100],)
+          for start in xrange(0, len(decisions), 100)]),
+        ('play/long_rounds', bcrowley.play,
+         [(rnd, hand, [rnd], holding)
+          for (play, rnd), hand in zip(rounds, random13)]),
+    ]
+
+
+def measure(func, corpus, passes=3):
+    """
+    Calls `func` once for each argument tuple in `corpus`, `passes` times
+    over, timing every call.
+
+    The functions under test may reorder the lists they are given, which
+    leaves later passes with the same cards in a different order.
+
+    INPUTS:
+        func    - the function to time
+        corpus  - list of argument tuples
+        passes  - times to go through the corpus
+
+    RETURNS:
+        dict    - 'calls', 'ops' (calls per second) and the 'p50', 'p90'
+                  and 'p99' call times in microseconds
+    """
+
+    samples = []
+    clock = default_timer
+
+    for i in xrange(passes):
+        for args in corpus:
+            start = clock()
+            func(*args)
+            samples.append(clock() - start)
+
+    samples.sort()
+
+    def percentile(fraction):
+        return samples[int(fraction * (len(samples) - 1))] * 1e6
+
+    return {
+        'calls': len(samples),
+        'ops': len(samples) / sum(samples),
+        'p50': percentile(0.5),
+        'p90': percentile(0.9),
+        'p99': percentile(0.99),
+    }
+
+
+def run_suite(baseline=None, tolerance=0.25):
+    """
+    Runs every suite case and prints its throughput and percentiles. When
+    `baseline` is given, each case is compared with it and flagged as a
+    regression if its throughput has dropped by more than `tolerance`.
+
+    INPUTS:
+        baseline    - dict of case name to `measure` results, or None
+        tolerance   - fraction of baseline throughput that may be lost
+
+    RETURNS:
+        tuple       - (dict of case name to results, list of regressions)
+    """
+
+    results = {}
+    regressions = []
+
+    print "{0:<34} {1:>11} {2:>9} {3:>9} {4:>9} {5:>9}".format(
+        "case", "ops/s", "p50 us", "p90 us", "p99 us", "vs base")
+
+    for name, func, corpus in suite_cases():
+        result = results[name] = measure(func, corpus)
+        change = ""
+
+        if baseline and name in baseline:
+            ratio = result['ops'] / baseline[name]['ops']
+            change = "{0:.2f}x".format(ratio)
+
+            if ratio < 1 - tolerance:
+                regressions.append(name)
+                change += " SLOWER"
+
+        print "{0:<34} {1:>11.0f} {2:>9.2f} {3:>9.2f} {4:>9.2f} {5:>9}".format(
+            name, result['ops'], result['p50'], result['p90'],
+            result['p99'], change)
+
+    return results, regressions
+
+
+def load_baseline(path=BASELINE_FILE):
+    """
+    RETURNS:
+        dict    - the stored suite results, or None if there are none
+    """
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as baseline:
+        return json.load(baseline)
+
+
+def save_baseline(results, path=BASELINE_FILE):
+    """
+    Stores suite results as the baseline for later runs.
+
+    INPUTS:
+        results - dict of case name to `measure` results
+        path    - file to write
+
+    RETURNS:
+        None
+    """
+
+    with open(path, 'w') as baseline:
+        json.dump(results, baseline, indent=2, sort_keys=True)
+        baseline.write('\n')
+
+
+def main(argv=None):
+    """
+    Runs the comparison benchmarks and the suite. With --save-baseline the
+    suite results replace the stored baseline, otherwise they are compared
+    with it and the exit status is 1 if any case regressed.
+
+    INPUTS:
+        argv    - command line arguments, defaults to sys.argv[1:]
+
+    RETURNS:
+        int     - exit status
+    """
+
+    parser = argparse.ArgumentParser(description="Daifugo benchmarks")
+    parser.add_argument('--suite-only', action='store_true',
+                        help="skip the comparisons with legacy versions")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store the suite results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="throughput that may be lost before a case is "
+                             "reported as a regression (default 0.25)")
+    options = parser.parse_args(argv)
+
+    if not options.suite_only:
+        print "{0:<32} {1:>12} {2:>12} {3:>9}".format(
+            "benchmark", "baseline", "current", "speedup")
+
+        bench_straights()
+        bench_sorting()
+        bench_cache()
+        bench_import()
+        bench_trace()
+        bench_batch()
+        print
+
+    baseline = None if options.save_baseline else load_baseline()
+    results, regressions = run_suite(baseline, options.tolerance)
+
+    if options.save_baseline:
+        save_baseline(results)
+        print "baseline saved to", BASELINE_FILE
+    elif baseline is None:
+        print "no baseline, store one with --save-baseline"
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+# coding=utf-8
+"""*****************************************************************************
+
+Daifugo Corpora
+
+Seeded data shared by the tests and the benchmarks. It only needs bcrowley,
+so the tests can build their inputs without importing the benchmarking or
+simulation code.
+
+*****************************************************************************"""
+
+from random import Random
+
+import bcrowley
+
+
+def long_rounds(count=50, length=40, seed=0):
+    """
+    Returns `count` (play, rnd) pairs where each rnd is a legal round of
+    `length` plays, mostly passes, and play is a candidate to follow it
+    that is legal about half of the time.
+
+    INPUTS:
+        count   - number of rounds
+        length  - plays and passes in each round
+        seed    - seed for the random number generator
+
+    RETURNS:
+        list    - list of (play, rnd) tuples
+    """
+
+    rng = Random(seed)
+    plays = bcrowley.generate_plays(bcrowley.get_deck())
+    rounds = []
+
+    for i in xrange(count):
+        state = bcrowley.RoundState([rng.choice(plays)])
+
+        while len(state) < length:
+            follows = [] if rng.random() < 0.7 else \
+                [play for play in plays if state.is_valid(play)]
+
+            state.push(rng.choice(follows) if follows else None)
+
+        follows = [play for play in plays if state.is_valid(play)]
+        play = rng.choice(follows if follows and rng.random() < 0.5
+                          else plays)
+
+        rounds.append((list(play), [p and list(p) for p in state]))
+
+    return rounds
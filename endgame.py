@@ -0,0 +1,426 @@
+# coding=utf-8
+"""*****************************************************************************
+
+Daifugo Endgame Solver
+
+Once only two players hold cards, the unseen cards are all in the other
+player's hand, and the rest of the game can be searched exactly. The solver
+plays out every line of play with alpha-beta search over packed hands and
+PlayCatalog IDs, under the rules of `simulator.play_round`, and makes the
+move with the best finishing place against any reply.
+
+Positions are remembered in a transposition table, an LRUCache keyed on the
+hands, the round and the player to move, so that lines reaching the same
+position by different orders of play are searched once. Optionally the suits of each
+position are relabelled with `bcrowley.canonical_suits` first, so positions
+that differ only by the names of their suits, from one decision or game to
+the next, share an entry. Such positions turn out to be rare, as the hands
+are known card for card, so this is off by default. Each search is
+bounded by a number of nodes and a time limit, and gives up (leaving the
+move to `bcrowley.play`) when either runs out.
+
+The solver is an agent with the signature of `bcrowley.play`, and can also
+be handed to `bcrowley.play` itself:
+
+    bcrowley.play(rnd, hand, discard, holding, endgame=EndgameSolver())
+
+Run directly to play the solver in seat 0 against the heuristic:
+
+    python endgame.py [games] [threshold]
+
+*****************************************************************************"""
+
+import sys
+from timeit import default_timer
+
+import bcrowley
+from search import GameFollower, get_policy_tables
+
+
+class SearchLimitReached(Exception):
+    """
+    Raised inside `EndgameSolver.solve` when the node or time limit runs
+    out before the position is solved.
+    """
+
+
+class EndgameSolver(GameFollower):
+    """
+    An agent with the signature of `bcrowley.play` that solves the endgame
+    exactly, see the module docstring, and otherwise plays as
+    `bcrowley.play`. The game is followed as described for GameFollower.
+
+    With more than two players holding cards, `solve` assumes the other
+    players all play against the player to move (a paranoid search), but
+    `solve_play` only searches positions whose hands are all known.
+
+    ATTRIBUTES:
+        threshold   - the most cards held in all for the endgame to be
+                      searched
+        max_nodes   - positions searched per decision, or None for no limit
+        time_limit  - seconds per decision, or None for no limit
+        table       - the transposition table, a bcrowley.LRUCache of
+                      state to (lower bound, upper bound, best move), kept
+                      from one decision to the next
+        symmetric   - whether the states are keyed with their suits
+                      relabelled, see the module docstring, in which case
+                      the best moves are stored relabelled too
+        nodes       - number of positions searched for the last decision
+        place       - finishing place the last decision was solved to, 0
+                      being first out, or None if it was not solved
+    """
+
+    def __init__(self, threshold=20, max_nodes=200000, time_limit=0.25,
+                 table_size=1 << 18, symmetric=False):
+        GameFollower.__init__(self)
+
+        self.threshold = threshold
+        self.max_nodes = max_nodes
+        self.time_limit = time_limit
+        self.table = bcrowley.LRUCache(table_size)
+        self.symmetric = symmetric
+        self.nodes = 0
+        self.place = None
+
+    def __call__(self, rnd, hand, discard, holding):
+        return self.play(rnd, hand, discard, holding)
+
+    def play(self, rnd, hand, discard, holding):
+        """
+        Returns the play to make, as `bcrowley.play`.
+
+        INPUTS:
+            rnd     - a list of plays from the round to date
+            hand    - a list of the current cards held by your player
+            discard - a list of the history of the game so far
+            holding - how many cards each of the players is holding
+
+        RETURNS:
+            list    - list of cards representing the next play, or None
+        """
+
+        solved = self.solve_play(rnd, hand, discard, holding)
+
+        if solved is None:
+            return bcrowley.play(rnd, hand, discard, holding)
+
+        return solved[1]
+
+    def improve(self, rnd, hand, discard, holding, deadline=None):
+        """
+        Yields the solved play, for `bcrowley.play_anytime`, if the decision
+        is an endgame that is solved by `deadline`.
+
+        INPUTS:
+            as `solve_play`
+
+        RETURNS:
+            generator - of at most one play, a list of cards or None
+        """
+
+        solved = self.solve_play(rnd, hand, discard, holding, deadline)
+
+        if solved is not None:
+            yield solved[1]
+
+    def solve_play(self, rnd, hand, discard, holding, deadline=None):
+        """
+        Solves the decision if it is an endgame: at most `threshold` cards
+        are held in all, and only one other player holds any, so that the
+        unseen cards are their hand.
+
+        INPUTS:
+            as `play`, and
+            deadline    - default_timer() value to give up at, defaults to
+                          `time_limit` seconds from now
+
+        RETURNS:
+            tuple   - (finishing place, play to make), or None if the
+                      decision is not an endgame or could not be solved
+                      within the limits
+        """
+
+        self.nodes = 0
+        self.place = None
+
+        if sum(holding) > self.threshold or \
+                sum(1 for count in holding if count) != 2:
+            return None
+
+        position = self.position(rnd, hand, discard, holding)
+
+        if position is None:
+            return None
+
+        me = position['me']
+        hands = [0] * len(holding)
+        hands[me] = position['hand']
+        other = next(pid for pid, count in enumerate(holding)
+                     if count and pid != me)
+        hands[other] = position['unseen']
+
+        try:
+            self.place, move = self.solve(
+                hands, me, position['top'], position['on_suit'],
+                position['followed'], position['passes'],
+                position['last_player'], position['moves'], deadline)
+        except SearchLimitReached:
+            return None
+
+        if move < 0:
+            return self.place, None
+
+        masks = get_policy_tables()[0].masks
+
+        return self.place, bcrowley.decode_hand(masks[move])
+
+    def solve(self, hands, me, top, on_suit, followed, passes, last_player,
+              moves=None, deadline=None):
+        """
+        Searches the game from player `me`'s turn to the end, with every
+        hand known, and returns the best finishing place `me` can be sure
+        of and the move that makes sure of it.
+
+        INPUTS:
+            hands       - list of packed hands, not modified
+            me          - player to move
+            top         - PlayCatalog ID of the top of the round, or -1
+            on_suit     - whether the round is on suit
+            followed    - whether a non-pass play has followed the lead
+            passes      - passes since the last non-pass play
+            last_player - player who made the top play (the leader, if none)
+            moves       - optional legal moves of `me`, PlayCatalog IDs or -1
+                          for a pass, tried in this order
+            deadline    - default_timer() value to give up at, defaults to
+                          `time_limit` seconds from now
+
+        RETURNS:
+            tuple   - (finishing place of `me`, 0 being first out, the move
+                      as a PlayCatalog ID or -1 to pass)
+
+        RAISES:
+            SearchLimitReached when the node or time limit runs out
+        """
+
+        catalog = get_policy_tables()[0]
+        masks = catalog.masks
+        ids = catalog.ids
+        kinds = catalog.kinds
+        tops = catalog.tops
+        beats = catalog.beats
+        beats_on_suit = catalog.beats_on_suit
+        players = len(hands)
+        table = self.table
+        symmetric = self.symmetric
+        canonical_suits = bcrowley.canonical_suits
+        permute_suits = bcrowley.permute_suits
+        max_nodes = self.max_nodes
+        self.nodes = 0
+
+        if deadline is None and self.time_limit is not None:
+            deadline = default_timer() + self.time_limit
+
+        # longest plays first, as a hand that sheds its cards fastest tends
+        # to win, which makes for early cutoffs
+        sizes = [-bcrowley.count_cards(mask) for mask in masks]
+        hand_moves = {}
+
+        def get_moves(hand, top, on_suit):
+            moves = hand_moves.get(hand)
+
+            if moves is None:
+                moves = hand_moves[hand] = sorted(
+                    catalog.iter_ids(catalog.plays(hand)),
+                    key=sizes.__getitem__)
+
+            if top < 0:
+                return list(moves)
+
+            plays = beats_on_suit[top] if on_suit else beats[top]
+
+            return [move for move in moves if plays >> move & 1] + [-1]
+
+        def make_move(state, move):
+            # the state after `move`, or the finishing place of `me` if the
+            # move ends the game for them
+            hands, pid, top, on_suit, followed, passes, last_player, me = state
+
+            if move < 0:
+                passes += 1
+            else:
+                if top >= 0 and not followed:
+                    # only the first follow decides whether it is on suit
+                    followed = True
+                    on_suit = kinds[top] <= 1 and \
+                        tops[move] % 4 == tops[top] % 4
+
+                top = move
+                last_player = pid
+                passes = 0
+                hand = hands[pid] & ~masks[move]
+                hands = hands[:pid] + (hand,) + hands[pid + 1:]
+
+                if not hand:
+                    out = hands.count(0)
+
+                    if pid == me:
+                        return out - 1
+
+                    if out == players - 1:
+                        return out
+
+            out = hands.count(0)
+
+            # everyone still in the game has passed on the last play
+            if passes >= players - out - (1 if hands[last_player] else 0):
+                pid = last_player
+
+                while not hands[pid]:
+                    pid = (pid + 1) % players
+
+                return hands, pid, -1, False, False, 0, pid, me
+
+            pid = (pid + 1) % players
+
+            while not hands[pid]:
+                pid = (pid + 1) % players
+
+            return hands, pid, top, on_suit, followed, passes, last_player, me
+
+        def search(state, alpha, beta):
+            # the finishing place of `me` with best play from `state`, or a
+            # bound on it outside (alpha, beta)
+            self.nodes += 1
+
+            if max_nodes is not None and self.nodes > max_nodes or \
+                    deadline is not None and not self.nodes & 0xFF and \
+                    default_timer() > deadline:
+                raise SearchLimitReached()
+
+            if symmetric:
+                # the same state with its suits relabelled, the top play
+                # relabelled along with the hands
+                hands, pid, top = state[:3]
+
+                if top < 0:
+                    relabelled, perm, inverse = canonical_suits(hands)
+                else:
+                    relabelled, perm, inverse = canonical_suits(
+                        hands + (masks[top],))
+                    top = ids[relabelled[-1]]
+                    relabelled = relabelled[:-1]
+
+                key = (relabelled, pid, top) + state[3:]
+            else:
+                key = state
+
+            # no place is better than the number of players already out
+            lower, upper, best = table.get(key) or \
+                (state[0].count(0), players - 1, None)
+
+            if symmetric and best is not None and best >= 0:
+                best = ids[permute_suits(masks[best], inverse)]
+
+            if lower >= beta or lower == upper:
+                return lower
+
+            if upper <= alpha:
+                return upper
+
+            alpha = max(alpha, lower)
+            beta = min(beta, upper)
+            low, high = alpha, beta
+
+            hands, pid, top, on_suit = state[:4]
+            moves = get_moves(hands[pid], top, on_suit)
+            minimising = pid == me
+
+            # the best move the last time this state was searched first
+            if best is not None:
+                moves.remove(best)
+                moves.insert(0, best)
+
+            value = players if minimising else -1
+
+            for move in moves:
+                child = make_move(state, move)
+
+                if not isinstance(child, int):
+                    child = search(child, low, high)
+
+                if minimising:
+                    if child < value:
+                        value, best = child, move
+                        high = min(high, value)
+                elif child > value:
+                    value, best = child, move
+                    low = max(low, value)
+
+                if low >= high:
+                    break
+
+            if value <= alpha:
+                upper = value
+            elif value >= beta:
+                lower = value
+            else:
+                lower = upper = value
+
+            if symmetric and best >= 0:
+                best = ids[permute_suits(masks[best], perm)]
+
+            table.put(key, (lower, upper, best))
+
+            return value
+
+        hands = tuple(hands)
+
+        if top < 0:
+            on_suit = followed = False
+            passes = 0
+            last_player = me
+
+        # `me` is part of the state as the places are theirs
+        state = (hands, me, top, on_suit, followed, passes, last_player, me)
+
+        if moves is None:
+            moves = get_moves(hands[me], top, on_suit)
+
+        floor = hands.count(0)
+        place = players
+        best = moves[0]
+
+        for move in moves:
+            child = make_move(state, move)
+
+            if not isinstance(child, int):
+                child = search(child, -1, place)
+
+            if child < place:
+                place, best = child, move
+
+                if place == floor:
+                    break
+
+        return place, best
+
+
+if __name__ == "__main__":
+    from random import Random
+
+    import simulator
+
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    threshold = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    agents = simulator.default_agents()
+    agents[0] = solver = EndgameSolver(threshold)
+
+    stats = simulator.simulate(games, agents, rng=Random(0))
+
+    print stats.summary()
+    print "win rates:      ", stats.win_rates()
+    print "mean positions: ", stats.mean_positions()
+    print "table:          ", len(solver.table), "entries,", \
+        solver.table.hits, "hits,", solver.table.misses, "misses,", \
+        solver.table.evictions, "evictions"
@@ -0,0 +1,505 @@
+# coding=utf-8
+"""*****************************************************************************
+
+Daifugo Game Logs
+
+A compact binary format for recording games. A log is an 8 byte header
+followed by fixed width 4 byte records, one per play:
+
+    play    - unsigned short, the PlayCatalog ID of the play, or PASS
+    pid     - unsigned byte, the player who made it
+    flags   - unsigned byte, GAME_START on the first record of a game and
+              ROUND_START on the first play of each round
+
+A game may begin with one DEAL record per card, the play field holding the
+card's bit index (see `bcrowley.encode_hand`) and the pid its holder after
+the swap phase, so that the hands can be rebuilt too.
+
+Logs are appended to a game at a time by a GameLogWriter, and read through
+a memory map by a GameLogReader, which only touches the records asked for,
+so a log of any size can be walked or indexed into without loading it.
+
+Run directly to log self-play games and read them back:
+
+    python gamelog.py [games] [path]
+
+*****************************************************************************"""
+
+import mmap
+import os
+import struct
+import sys
+
+import bcrowley
+
+
+HEADER = struct.Struct('<4sHH')
+RECORD = struct.Struct('<HBB')
+
+MAGIC = 'DFGL'
+VERSION = 1
+
+# the play field of a pass
+PASS = 0xFFFF
+
+GAME_START = 1
+ROUND_START = 2
+DEAL = 4
+
+
+def encode_game(discard, first, hands=None):
+    """
+    Packs a game into records. The player of each play is worked out from
+    the leader of the first round, under the turn rules followed by
+    `bcrowley.UnseenTracker`.
+
+    INPUTS:
+        discard - the game, a list of rounds each a list of plays or None
+        first   - player ID that led the first round
+        hands   - optional hands of the players after the swap phase
+
+    RETURNS:
+        str     - the records of the game
+
+    RAISES:
+        ValueError if a play is not a legal combination of cards
+    """
+
+    catalog = bcrowley.get_play_catalog()
+    tracker = bcrowley.UnseenTracker(leader=first,
+                                     players=len(hands) if hands else 4)
+    records = []
+    flags = GAME_START
+
+    if hands:
+        for pid, hand in enumerate(hands):
+            for card in hand:
+                records.append(RECORD.pack(
+                    bcrowley.CARD_TABLE[card][2], pid, flags | DEAL))
+                flags = 0
+
+    for index, rnd in enumerate(discard):
+        if index:
+            tracker.end_round()
+
+        flags |= ROUND_START
+
+        for play in rnd:
+            if play is None:
+                play_id = PASS
+            else:
+                play_id = catalog.get_id(play)
+
+                if play_id is None:
+                    raise ValueError("cannot log {0}".format(play))
+
+            records.append(RECORD.pack(play_id, tracker.to_move(), flags))
+            tracker.push(play)
+            flags = 0
+
+    return ''.join(records)
+
+
+def decode_game(records, players=4):
+    """
+    Rebuilds a game, or the start of one, from its records.
+
+    INPUTS:
+        records - iterable of (play, pid, flags) tuples, from the game's
+                  first record
+        players - number of players, when the game has no DEAL records
+
+    RETURNS:
+        tuple   - (hands, discard, pids) where hands are the dealt hands or
+                  None, discard the rounds as lists of plays (a list of
+                  cards, in the order of `bcrowley.decode_hand`, or None)
+                  and pids[round][play] the player of each play
+    """
+
+    cards = get_play_cards()
+    hands = None
+    discard = []
+    pids = []
+
+    for play_id, pid, flags in records:
+        if flags & DEAL:
+            if hands is None:
+                hands = [[] for i in xrange(players)]
+
+            while pid >= len(hands):
+                hands.append([])
+
+            hands[pid].append(bcrowley.BIT_CARDS[1 << play_id])
+            continue
+
+        if flags & ROUND_START or not discard:
+            discard.append([])
+            pids.append([])
+
+        discard[-1].append(None if play_id == PASS else list(cards[play_id]))
+        pids[-1].append(pid)
+
+    return hands, discard, pids
+
+
+def get_play_cards():
+    """
+    Returns the cards of every PlayCatalog ID, built on the first call.
+
+    RETURNS:
+        list    - list of tuples of cards, indexed by play ID
+    """
+
+    global PLAY_CARDS
+
+    if PLAY_CARDS is None:
+        PLAY_CARDS = [tuple(bcrowley.decode_hand(mask))
+                      for mask in bcrowley.get_play_catalog().masks]
+
+    return PLAY_CARDS
+
+
+class GameLogWriter(object):
+    """
+    Appends games to a log, writing the header first if the log is new.
+    Each game is packed and written in one go, through the file's buffer,
+    so games can be streamed to a log as they finish. Call `close` when
+    done.
+
+    ATTRIBUTES:
+        path    - the log file
+        file    - the log opened for appending
+        games   - number of games written
+        records - number of records written
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        self.games = 0
+        self.records = 0
+
+        self.file.seek(0, os.SEEK_END)
+
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        else:
+            with open(path, 'rb') as existing:
+                check_header(existing.read(HEADER.size), path)
+
+    def write_game(self, discard, first, hands=None):
+        """
+        Appends a game to the log.
+
+        INPUTS:
+            as `encode_game`
+
+        RETURNS:
+            None
+        """
+
+        data = encode_game(discard, first, hands)
+
+        self.file.write(data)
+        self.games += 1
+        self.records += len(data) // RECORD.size
+
+    def flush(self):
+        """
+        Writes out the buffered games.
+
+        RETURNS:
+            None
+        """
+
+        self.file.flush()
+
+    def close(self):
+        """
+        Writes out the buffered games and closes the log.
+
+        RETURNS:
+            None
+        """
+
+        self.file.close()
+
+
+class GameLogReader(object):
+    """
+    Reads a log through a read-only memory map. Records are unpacked one at
+    a time as they are asked for, by position or in order, and the games
+    and decisions around them are rebuilt on demand.
+
+    ATTRIBUTES:
+        path    - the log file
+        file    - the log opened for reading
+        map     - mmap of the log, or '' for a log with no records
+        count   - number of records
+        starts  - record index of the start of every game, once
+                  `game_starts` has been called
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+
+        check_header(self.file.read(HEADER.size), path)
+
+        if size > HEADER.size:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        else:
+            self.map = ''
+
+        self.count = (size - HEADER.size) // RECORD.size
+        self.starts = None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+
+        if not 0 <= index < self.count:
+            raise IndexError("record index out of range")
+
+        return RECORD.unpack_from(self.map, HEADER.size + index * RECORD.size)
+
+    def __iter__(self):
+        return self.iter_records()
+
+    def iter_records(self, start=0, stop=None):
+        """
+        Yields the records from index `start` up to `stop`.
+
+        INPUTS:
+            start   - index of the first record
+            stop    - index past the last record, defaults to the end
+
+        RETURNS:
+            generator - of (play, pid, flags) tuples
+        """
+
+        stop = self.count if stop is None else min(stop, self.count)
+        unpack_from = RECORD.unpack_from
+        data = self.map
+
+        for offset in xrange(HEADER.size + start * RECORD.size,
+                             HEADER.size + stop * RECORD.size, RECORD.size):
+            yield unpack_from(data, offset)
+
+    def game_start(self, index):
+        """
+        Returns the index of the first record of the game holding record
+        `index`, found by reading back from it.
+
+        INPUTS:
+            index   - a record index
+
+        RETURNS:
+            int
+        """
+
+        while index > 0 and not self[index][2] & GAME_START:
+            index -= 1
+
+        return index
+
+    def game_starts(self):
+        """
+        Returns the index of the first record of every game, found by one
+        pass over the log on the first call, with numpy when it is
+        installed.
+
+        RETURNS:
+            list    - record indices, a numpy array if numpy is installed
+        """
+
+        if self.starts is None:
+            try:
+                import numpy
+            except ImportError:
+                numpy = None
+
+            if numpy is None or not self.count:
+                self.starts = [index for index, record in enumerate(self)
+                               if record[2] & GAME_START]
+            else:
+                flags = numpy.frombuffer(
+                    self.map, numpy.uint8, self.count * RECORD.size,
+                    HEADER.size)[3::RECORD.size]
+                self.starts = numpy.flatnonzero(flags & GAME_START)
+
+        return self.starts
+
+    def games(self):
+        """
+        Yields the record range of every game, in one pass over the log.
+
+        RETURNS:
+            generator - of (start, stop) tuples
+        """
+
+        start = None
+
+        for index, record in enumerate(self):
+            if record[2] & GAME_START:
+                if start is not None:
+                    yield start, index
+
+                start = index
+
+        if start is not None:
+            yield start, self.count
+
+    def game(self, start, stop=None):
+        """
+        Rebuilds the game starting at record `start`.
+
+        INPUTS:
+            start   - index of the game's first record
+            stop    - index past the game's last record, or None to read
+                      up to the next game
+
+        RETURNS:
+            tuple   - (hands, discard, pids), see `decode_game`
+        """
+
+        return decode_game(self.iter_game(start, stop))
+
+    def iter_game(self, start, stop=None):
+        """
+        Yields the records of the game starting at record `start`.
+
+        INPUTS:
+            as `game`
+
+        RETURNS:
+            generator - of (play, pid, flags) tuples
+        """
+
+        for index, record in enumerate(self.iter_records(start, stop)):
+            if index and record[2] & GAME_START:
+                return
+
+            yield record
+
+    def decision(self, index):
+        """
+        Rebuilds the arguments `bcrowley.play` was called with for the play
+        at record `index`.
+
+        INPUTS:
+            index   - index of a play record
+
+        RETURNS:
+            tuple   - (rnd, hand, discard, holding, pid) where hand is None
+                      if the game has no DEAL records, and discard[-1] is
+                      rnd
+
+        RAISES:
+            ValueError if the record is a DEAL record
+        """
+
+        play_id, pid, flags = self[index]
+
+        if flags & DEAL:
+            raise ValueError("record {0} is not a play".format(index))
+
+        start = self.game_start(index)
+        hands, discard, pids = self.game(start, index + 1)
+
+        # the play itself is left out, leaving its round empty if it led
+        discard[-1].pop()
+        pids[-1].pop()
+
+        players = len(hands) if hands else 4
+        holding = [len(hand) for hand in hands] if hands \
+            else [len(bcrowley.CARD_BITS) // players] * players
+        played = [0] * players
+
+        for rnd, rnd_pids in zip(discard, pids):
+            for play, player in zip(rnd, rnd_pids):
+                if play is not None:
+                    holding[player] -= len(play)
+                    played[player] |= bcrowley.encode_hand(play)
+
+        hand = None
+
+        if hands:
+            hand = bcrowley.decode_hand(
+                bcrowley.encode_hand(hands[pid]) & ~played[pid])
+
+        return discard[-1], hand, discard, tuple(holding), pid
+
+    def close(self):
+        """
+        Unmaps and closes the log.
+
+        RETURNS:
+            None
+        """
+
+        if self.map:
+            self.map.close()
+
+        self.file.close()
+
+
+def check_header(header, path):
+    """
+    Raises a ValueError unless `header` is the header of a game log of this
+    version.
+
+    INPUTS:
+        header  - the first HEADER.size bytes of the file
+        path    - the file, used in the error message
+
+    RETURNS:
+        None
+    """
+
+    if len(header) != HEADER.size:
+        raise ValueError("{0} is not a game log".format(path))
+
+    magic, version, size = HEADER.unpack(header)
+
+    if magic != MAGIC or size != RECORD.size:
+        raise ValueError("{0} is not a game log".format(path))
+
+    if version != VERSION:
+        raise ValueError(
+            "{0} is a version {1} game log, not {2}".format(
+                path, version, VERSION))
+
+
+PLAY_CARDS = None
+
+
+if __name__ == "__main__":
+    from random import Random
+    from timeit import default_timer
+
+    import simulator
+
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    path = sys.argv[2] if len(sys.argv) > 2 else 'games.dfgl'
+
+    writer = GameLogWriter(path)
+    stats = simulator.simulate(games, log=writer, rng=Random(0))
+    writer.close()
+
+    print stats.summary()
+
+    reader = GameLogReader(path)
+    start = default_timer()
+    rebuilt = sum(1 for start, stop in reader.games()
+                  if reader.game(start, stop))
+
+    print "{0} records, {1} bytes, {2} games rebuilt in {3:.2f}s".format(
+        len(reader), os.path.getsize(path), rebuilt, default_timer() - start)
+
+    reader.close()
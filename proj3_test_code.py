@@ -181,8 +181,11 @@ def as_setset(seq):
 # (i.e. not by another module)
 if __name__ == "__main__":
     for fn_name in tests: 
-        # if submission implements the given function
-        if hasattr(submission, fn_name):
+        # if submission implements the given function; names of the form
+        # 'module.function' are looked up in that module instead
+        module, _, name = fn_name.rpartition('.')
+
+        if hasattr(__import__(module) if module else submission, name):
             test(fn_name)
         else:
             print "No implementation for '{0}'".format(fn_name)
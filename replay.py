@@ -0,0 +1,465 @@
+# coding=utf-8
+"""*****************************************************************************
+
+Daifugo Replay
+
+Re-checks recorded games (see gamelog) against the rules. Each log is read
+once, in order, and every game is followed play by play with an
+UnseenTracker, whose RoundState answers whether each play could be made in
+constant time instead of going back over the whole round. Each play is
+checked for:
+
+    - being a legal play on the round so far
+    - being made by the player whose turn it is
+    - being made from cards the player holds, when the deal is recorded
+    - the first round being led by the holder of `simulator.FIRST_LEAD`,
+      when the deal is recorded
+    - rounds ending, and the game ending, exactly when everyone still
+      holding cards has passed, or only one player holds cards
+
+A log, or a directory of logs, can be replayed across a pool of worker
+processes; large logs are cut into ranges of whole games first.
+
+    python replay.py path [processes]
+
+*****************************************************************************"""
+
+import os
+import sys
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+
+import bcrowley
+import gamelog
+from simulator import FIRST_LEAD
+
+
+class ReplayReport(object):
+    """
+    Running totals for replayed games. Reports from separate logs or
+    ranges, e.g. from worker processes, are combined with `merge`.
+
+    ATTRIBUTES:
+        logs        - number of logs (or ranges of logs) replayed
+        games       - number of games replayed
+        plays       - number of plays and passes checked
+        violations  - list of dicts, one per broken rule, with 'path',
+                      'record' (index in the log), 'game' (index of the
+                      game's first record), 'round', 'play' (index in the
+                      round), 'pid' and 'message'
+        elapsed     - total wall clock seconds spent replaying
+    """
+
+    def __init__(self):
+        self.logs = 0
+        self.games = 0
+        self.plays = 0
+        self.violations = []
+        self.elapsed = 0.0
+
+    def merge(self, other):
+        """
+        Adds the totals of `other` into these totals. `elapsed` is left
+        alone, as logs that were replayed in parallel overlap in wall clock
+        time.
+
+        INPUTS:
+            other   - ReplayReport
+
+        RETURNS:
+            None
+        """
+
+        self.logs += other.logs
+        self.games += other.games
+        self.plays += other.plays
+        self.violations += other.violations
+
+    def summary(self):
+        """
+        RETURNS:
+            str     - a human readable report of the totals and throughput
+        """
+
+        rate = self.plays / self.elapsed if self.elapsed else 0.0
+
+        return (
+            "{0} logs, {1} games, {2} plays in {3:.2f}s ({4:.0f} plays/s), "
+            "{5} violations".format(self.logs, self.games, self.plays,
+                                    self.elapsed, rate, len(self.violations)))
+
+
+class GameChecker(object):
+    """
+    Follows one recorded game, checking each record as it comes.
+
+    ATTRIBUTES:
+        path        - the log, used in violations
+        start       - index of the game's first record
+        violations  - list the violations are appended to
+        tracker     - UnseenTracker following the game, once play starts
+        dealt       - mask of the cards dealt so far
+        held        - held[pid] is the mask of the cards pid holds, or None
+                      if the deal is not recorded
+        rounds      - number of rounds started
+        over        - whether the current round is over
+        plays       - number of plays and passes checked
+    """
+
+    def __init__(self, path, start, violations):
+        self.path = path
+        self.start = start
+        self.violations = violations
+        self.tracker = None
+        self.dealt = 0
+        self.held = None
+        self.rounds = 0
+        self.over = False
+        self.plays = 0
+
+    def report(self, index, pid, message):
+        """
+        Records a violation at record `index`.
+
+        INPUTS:
+            index   - the record index in the log
+            pid     - the player of the record
+            message - str describing the broken rule
+
+        RETURNS:
+            None
+        """
+
+        tracker = self.tracker
+
+        self.violations.append({
+            'path': self.path,
+            'record': index,
+            'game': self.start,
+            'round': max(self.rounds - 1, 0),
+            'play': len(tracker.round) if tracker is not None else 0,
+            'pid': pid,
+            'message': message,
+        })
+
+    def deal(self, index, card, pid):
+        """
+        Checks a DEAL record.
+
+        INPUTS:
+            index   - the record index in the log
+            card    - the bit index of the card
+            pid     - the player dealt the card
+
+        RETURNS:
+            None
+        """
+
+        bit = 1 << card
+
+        if self.held is None:
+            self.held = [0] * 4
+
+        while pid >= len(self.held):
+            self.held.append(0)
+
+        if card >= len(bcrowley.CARD_BITS) or self.dealt & bit:
+            self.report(index, pid, "card {0} dealt twice or unknown".format(
+                card))
+            return
+
+        self.dealt |= bit
+        self.held[pid] |= bit
+
+    def push(self, index, play_id, pid, flags):
+        """
+        Checks a play record.
+
+        INPUTS:
+            index   - the record index in the log
+            play_id - the play field of the record
+            pid     - the player of the record
+            flags   - the flags of the record
+
+        RETURNS:
+            None
+        """
+
+        catalog = bcrowley.get_play_catalog()
+        tracker = self.tracker
+        self.plays += 1
+
+        if tracker is None:
+            held = self.held
+            tracker = self.tracker = bcrowley.UnseenTracker(
+                leader=pid, players=len(held) if held else 4)
+
+            if held is not None:
+                tracker.holding = [bcrowley.count_cards(mask)
+                                   for mask in held]
+                first = bcrowley.CARD_BITS[FIRST_LEAD]
+
+                if self.dealt & first and not held[pid] & first:
+                    self.report(index, pid, "first round not led by the "
+                                "holder of {0}".format(FIRST_LEAD))
+
+        elif flags & gamelog.ROUND_START:
+            if not self.over:
+                self.report(index, pid, "round ended early")
+
+            tracker.end_round()
+            self.over = False
+
+        elif self.over:
+            self.report(index, pid, "play after the round ended")
+
+        if flags & gamelog.ROUND_START:
+            self.rounds += 1
+
+        if tracker.out >= len(tracker.holding) - 1 or \
+                sum(1 for held in tracker.holding if held > 0) <= 1:
+            self.report(index, pid, "play after the game ended")
+            return
+
+        expected = tracker.to_move()
+
+        if pid != expected:
+            self.report(index, pid, "out of turn, player {0} to play".format(
+                expected))
+
+        if play_id == gamelog.PASS:
+            play = None
+        elif play_id >= len(catalog):
+            self.report(index, pid, "unknown play {0}".format(play_id))
+            return
+        else:
+            play = bcrowley.decode_hand(catalog.masks[play_id])
+
+        if not tracker.round.is_valid(play):
+            self.report(index, pid, "{0} cannot be played on {1}".format(
+                play, tracker.round.plays))
+
+        if play is not None and self.held is not None:
+            mask = catalog.masks[play_id]
+
+            if pid >= len(self.held) or mask & ~self.held[pid]:
+                self.report(index, pid, "{0} is not held".format(play))
+            else:
+                self.held[pid] &= ~mask
+
+        tracker.push(play)
+
+        # everyone still in the game has passed on the last play, see
+        # simulator.play_round
+        active = len(tracker.holding) - tracker.out
+        last_player = tracker.last_player
+
+        self.over = active <= 1 or tracker.round.passes >= active - \
+            (1 if tracker.holding[last_player] else 0)
+
+    def finish(self, index):
+        """
+        Checks that the game was played to the end.
+
+        INPUTS:
+            index   - the index of the game's last record
+
+        RETURNS:
+            None
+        """
+
+        tracker = self.tracker
+
+        if tracker is None:
+            self.report(index, None, "game without plays")
+            return
+
+        holding = sum(1 for held in tracker.holding if held > 0)
+
+        if holding > 1:
+            self.report(index, None, "game ended with {0} players holding "
+                        "cards".format(holding))
+
+
+def replay_log(path, start=0, stop=None):
+    """
+    Replays the games of a log, or of a range of its records, in one pass.
+
+    INPUTS:
+        path    - the log file
+        start   - index of the first record, the start of a game
+        stop    - index past the last record, the start of a game or None
+                  for the end of the log
+
+    RETURNS:
+        ReplayReport
+    """
+
+    report = ReplayReport()
+    begun = default_timer()
+    reader = gamelog.GameLogReader(path)
+    game = None
+    last = start
+
+    try:
+        for index, (play_id, pid, flags) in enumerate(
+                reader.iter_records(start, stop), start):
+            if flags & gamelog.GAME_START or game is None:
+                if game is not None:
+                    game.finish(last)
+                    report.plays += game.plays
+
+                game = GameChecker(path, index, report.violations)
+                report.games += 1
+
+                if not flags & gamelog.GAME_START:
+                    game.report(index, pid, "record outside a game")
+
+            if flags & gamelog.DEAL:
+                if game.tracker is not None:
+                    game.report(index, pid, "card dealt during play")
+                else:
+                    game.deal(index, play_id, pid)
+            else:
+                game.push(index, play_id, pid, flags)
+
+            last = index
+
+        if game is not None:
+            game.finish(last)
+            report.plays += game.plays
+    finally:
+        reader.close()
+
+    report.logs = 1
+    report.elapsed = default_timer() - begun
+
+    return report
+
+
+def replay_task(task):
+    """
+    Replays one (path, start, stop) range. Module level, so that it can be
+    run by the workers of a pool.
+
+    INPUTS:
+        task    - (path, start, stop) tuple, see `replay_log`
+
+    RETURNS:
+        ReplayReport
+    """
+
+    return replay_log(*task)
+
+
+def split_log(path, chunk=1 << 20):
+    """
+    Cuts a log into ranges of about `chunk` records, each made of whole
+    games.
+
+    INPUTS:
+        path    - the log file
+        chunk   - records per range
+
+    RETURNS:
+        list    - list of (path, start, stop) tuples
+    """
+
+    reader = gamelog.GameLogReader(path)
+
+    try:
+        bounds = [0]
+
+        for offset in xrange(chunk, len(reader), chunk):
+            start = reader.game_start(offset)
+
+            if start > bounds[-1]:
+                bounds.append(start)
+
+        bounds.append(len(reader))
+    finally:
+        reader.close()
+
+    return [(path, start, stop) for start, stop in zip(bounds, bounds[1:])]
+
+
+def find_logs(path, extension='.dfgl'):
+    """
+    Returns the logs to replay for `path`: the file itself, or the files
+    ending in `extension` in the directory, in name order.
+
+    INPUTS:
+        path        - a log file or a directory
+        extension   - the ending of the log files in a directory
+
+    RETURNS:
+        list    - list of file paths
+    """
+
+    if not os.path.isdir(path):
+        return [path]
+
+    return [os.path.join(path, name) for name in sorted(os.listdir(path))
+            if name.endswith(extension)]
+
+
+def replay(path, processes=None, chunk=1 << 20):
+    """
+    Replays every log of `path` (see `find_logs`) across `processes` worker
+    processes and returns the merged report, with the violations in log
+    and record order.
+
+    INPUTS:
+        path        - a log file or a directory of logs
+        processes   - number of workers, defaults to the number of cores.
+                      With 1, the logs are replayed in this process.
+        chunk       - records per task, see `split_log`
+
+    RETURNS:
+        ReplayReport
+    """
+
+    if processes is None:
+        processes = cpu_count()
+
+    tasks = [task for log in find_logs(path)
+             for task in split_log(log, chunk)]
+
+    report = ReplayReport()
+    start = default_timer()
+
+    if processes == 1:
+        for task in tasks:
+            report.merge(replay_task(task))
+    else:
+        pool = Pool(processes)
+
+        try:
+            for part in pool.imap_unordered(replay_task, tasks):
+                report.merge(part)
+        finally:
+            pool.close()
+            pool.join()
+
+    report.violations.sort(key=lambda violation: (violation['path'],
+                                                  violation['record']))
+    report.elapsed = default_timer() - start
+
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "usage: python replay.py path [processes]"
+        sys.exit(2)
+
+    results = replay(sys.argv[1],
+                     int(sys.argv[2]) if len(sys.argv) > 2 else None)
+
+    for violation in results.violations:
+        print "{path}:{record}: game {game}, round {round}, play {play}, " \
+            "player {pid}: {message}".format(**violation)
+
+    print results.summary()
+
+    sys.exit(1 if results.violations else 0)
@@ -0,0 +1,915 @@
+# coding=utf-8
+"""*****************************************************************************
+
+Daifugo Search Agent
+
+An information set Monte Carlo agent with the signature of `bcrowley.play`.
+At each decision the hidden hands of the other players are dealt at random
+from the unseen cards, as many times as the budget allows, keeping to the
+number of cards each player holds. In every deal each legal move is played
+out to the end of the game, with the heuristic of `bcrowley.play` choosing
+the moves of all four players, and the move with the best mean finishing
+place is made.
+
+Rollouts work on packed hands and PlayCatalog IDs, so a game is played out
+with integer operations on a handful of locals rather than lists of cards.
+
+Deals can be played out across a persistent pool of worker processes with
+a ParallelSampler.
+
+The agent can also search within a per-move budget, replacing the
+heuristic's play whenever a better one takes the lead:
+
+    bcrowley.play_anytime(rnd, hand, discard, holding, budget=0.05,
+                          improver=SearchAgent())
+
+Run directly to play the search agent in seat 0 against the heuristic:
+
+    python search.py [games] [time limit] [processes]
+
+*****************************************************************************"""
+
+import sys
+from multiprocessing import Pool, cpu_count
+from operator import add
+from Queue import Empty, Queue
+from random import Random
+from timeit import default_timer
+
+import bcrowley
+from simulator import FIRST_LEAD
+
+
+def get_policy_tables():
+    """
+    Returns the PlayCatalog with the bitsets used by `heuristic_move`, built
+    on the first call.
+
+    RETURNS:
+        tuple   - (catalog, leaders, multiple_twos, lead_scores) where
+                  leaders is the set of plays `bcrowley.play` prefers to
+                  lead with, multiple_twos the set of n-of-a-kind of 2s it
+                  never plays, and lead_scores[id] orders the leaders as
+                  `bcrowley.play` does, highest first
+    """
+
+    global POLICY_TABLES
+
+    if POLICY_TABLES is None:
+        catalog = bcrowley.get_play_catalog()
+        leaders = multiple_twos = 0
+        lead_scores = []
+
+        for play_id, mask in enumerate(catalog.masks):
+            kind = catalog.kinds[play_id]
+            top_rank = catalog.tops[play_id] // 4
+            low_rank = ((mask & -mask).bit_length() - 1) // 4
+
+            # see filter_leaders in bcrowley.play
+            if (kind == 0 and top_rank < bcrowley.RANK_INDEX['A']) or \
+                    (kind > 1 and top_rank < bcrowley.RANK_INDEX['J']):
+                leaders |= 1 << play_id
+
+            if kind > 1 and top_rank == bcrowley.RANK_INDEX['2']:
+                multiple_twos |= 1 << play_id
+
+            # longest first, then lowest
+            lead_scores.append(bcrowley.count_cards(mask) * 16 +
+                               len(bcrowley.ORDERED_RANKS) - low_rank)
+
+        POLICY_TABLES = (catalog, leaders, multiple_twos, lead_scores)
+
+    return POLICY_TABLES
+
+
+def heuristic_move(hand, top, on_suit):
+    """
+    The choice `bcrowley.play` makes, worked out on a packed hand.
+
+    INPUTS:
+        hand    - int, the hand packed with `bcrowley.encode_hand`
+        top     - PlayCatalog ID of the top of the round, or -1 to lead
+        on_suit - whether the round is on suit
+
+    RETURNS:
+        int     - PlayCatalog ID of the play, or -1 to pass
+    """
+
+    catalog, leaders, multiple_twos, lead_scores = get_policy_tables()
+    plays = catalog.plays(hand)
+
+    if top < 0:
+        leading = plays & leaders
+
+        if not leading:
+            plays &= ~multiple_twos
+            return (plays & -plays).bit_length() - 1
+
+        best = -1
+        best_score = -1
+
+        # ascending IDs, so ties go to the most preferred play
+        while leading:
+            bit = leading & -leading
+            play_id = bit.bit_length() - 1
+
+            if lead_scores[play_id] > best_score:
+                best = play_id
+                best_score = lead_scores[play_id]
+
+            leading ^= bit
+
+        return best
+
+    beats = catalog.beats_on_suit if on_suit else catalog.beats
+    plays &= beats[top] & ~multiple_twos
+
+    return (plays & -plays).bit_length() - 1
+
+
+def rollout(hands, pid, me, top, lead, on_suit, followed, passes, last_player,
+            first=None, deadline=None):
+    """
+    Plays the game out from player `pid`'s turn with `heuristic_move`, under
+    the rules of `simulator.play_round`, until player `me` goes out or is
+    the last left holding cards, or the deadline passes.
+
+    INPUTS:
+        hands       - list of packed hands, mutated
+        pid         - player to move
+        me          - player whose finishing place is returned
+        top         - PlayCatalog ID of the top of the round, or -1
+        lead        - PlayCatalog ID of the lead of the round, or -1
+        on_suit     - whether the round is on suit
+        followed    - whether a non-pass play has followed the lead
+        passes      - passes since the last non-pass play
+        last_player - player who made the top play (the leader, if none)
+        first       - optional move for `pid` to make instead of the
+                      heuristic's, a PlayCatalog ID or -1 to pass
+        deadline    - optional default_timer() value to give up at, checked
+                      every ROLLOUT_CHECK turns
+
+    RETURNS:
+        int     - finishing place of `me`, 0 being first out, or None if
+                  the deadline passed first
+    """
+
+    catalog, leaders, multiple_twos, lead_scores = get_policy_tables()
+    masks = catalog.masks
+    kinds = catalog.kinds
+    tops = catalog.tops
+    players = len(hands)
+    out = sum(1 for hand in hands if not hand)
+    turns = 0
+
+    while True:
+        if deadline is not None:
+            turns += 1
+
+            if not turns % ROLLOUT_CHECK and default_timer() >= deadline:
+                return None
+
+        hand = hands[pid]
+
+        if hand:
+            if first is not None:
+                move = first
+                first = None
+            else:
+                move = heuristic_move(hand, top, on_suit)
+
+            if move < 0:
+                passes += 1
+            else:
+                if top < 0:
+                    lead = move
+                elif not followed:
+                    # only the first follow decides whether it is on suit
+                    followed = True
+                    on_suit = kinds[lead] <= 1 and \
+                        tops[move] % 4 == tops[lead] % 4
+
+                top = move
+                last_player = pid
+                passes = 0
+                hand &= ~masks[move]
+                hands[pid] = hand
+
+                if not hand:
+                    if pid == me:
+                        return out
+
+                    out += 1
+
+                    if out == players - 1:
+                        return out
+
+            # everyone still in the game has passed on the last play
+            if passes >= players - out - (1 if hands[last_player] else 0):
+                pid = last_player
+
+                while not hands[pid]:
+                    pid = (pid + 1) % players
+
+                top = lead = -1
+                on_suit = followed = False
+                passes = 0
+                continue
+
+        pid = (pid + 1) % players
+
+
+def get_seatings(hand, players=4):
+    """
+    Returns an UnseenTracker for each player that could have led the first
+    round, to be fast-forwarded through the game and kept while they fit
+    it (see `seating_fits`).
+
+    INPUTS:
+        hand    - the cards of the player the trackers are for
+        players - number of players
+
+    RETURNS:
+        list    - list of (first leader, UnseenTracker) tuples
+    """
+
+    return [(first, bcrowley.UnseenTracker(hand, first, players))
+            for first in xrange(players)]
+
+
+def seating_fits(first, tracker, holding, hand):
+    """
+    Returns whether a tracker fast-forwarded through the game, from `first`
+    leading the first round, agrees with `holding` and with the player to
+    move holding `hand`. The first leader must be the player who held
+    FIRST_LEAD.
+
+    INPUTS:
+        first   - the first leader the tracker started from
+        tracker - UnseenTracker
+        holding - number of cards held by each player
+        hand    - the cards of the player to move
+
+    RETURNS:
+        bool
+    """
+
+    me = tracker.to_move()
+
+    if tracker.holding != list(holding) or \
+            tracker.out >= len(holding) - 1 or tracker.holding[me] != len(hand):
+        return False
+
+    if FIRST_LEAD in hand:
+        holder = me
+    else:
+        bit = bcrowley.CARD_BITS[FIRST_LEAD]
+        holder = next((pid for pid, played in enumerate(tracker.played)
+                       if played & bit), None)
+
+    return holder == first or (holder is None and first != me)
+
+
+def infer_seats(discard, holding, hand):
+    """
+    Works out who made each play of the game so far, by replaying `discard`
+    from each possible first leader until the cards played by each player
+    agree with `holding`. When several first leaders fit, the seatings are
+    rotations of each other that the game so far cannot tell apart.
+
+    INPUTS:
+        discard     - the game so far, discard[-1] being the current round
+        holding     - number of cards held by each player
+        hand        - the cards of the player to move
+
+    RETURNS:
+        tuple   - (player to move, player who made the top play of the
+                  current round, or its leader), or None if no first
+                  leader fits
+    """
+
+    for first, tracker in get_seatings(hand, len(holding)):
+        tracker.fast_forward(discard)
+
+        if seating_fits(first, tracker, holding, hand):
+            return tracker.to_move(), tracker.last_player
+
+    return None
+
+
+def sample_hands(me, hand, unseen, holding, rng, excluded=None):
+    """
+    Deals the unseen cards at random to the other players, giving each the
+    number of cards they hold and, where it can, none of the cards they are
+    taken not to hold.
+
+    INPUTS:
+        me          - the player whose hand is known
+        hand        - int, the known hand, packed
+        unseen      - list of single card bits not in `hand` nor played
+        holding     - number of cards held by each player
+        rng         - random.Random
+        excluded    - optional list of the card mask each player is taken
+                      not to hold, see UnseenTracker
+
+    RETURNS:
+        list    - packed hand of every player
+    """
+
+    rng.shuffle(unseen)
+
+    if excluded is not None and any(excluded):
+        for attempt in xrange(3):
+            hands = deal_constrained(me, hand, unseen, holding, excluded, rng)
+
+            if hands is not None:
+                return hands
+
+    hands = []
+    dealt = 0
+
+    for pid, count in enumerate(holding):
+        if pid == me:
+            hands.append(hand)
+        else:
+            # the bits are distinct, so their sum is their union
+            hands.append(sum(unseen[dealt:dealt + count]))
+            dealt += count
+
+    return hands
+
+
+def deal_constrained(me, hand, unseen, holding, excluded, rng):
+    """
+    Deals for `sample_hands` when some cards are excluded from some hands.
+    The cards with the fewest possible holders are dealt first, each to one
+    of its possible holders at random, weighted by the room left in their
+    hands. A deal that runs out of holders for a card is abandoned.
+
+    INPUTS:
+        as `sample_hands`, with `unseen` already shuffled
+
+    RETURNS:
+        list    - packed hand of every player, or None
+    """
+
+    room = [0 if pid == me else count for pid, count in enumerate(holding)]
+    hands = [0] * len(holding)
+    hands[me] = hand
+
+    holders = [[pid for pid, mask in enumerate(excluded)
+                if room[pid] and not mask & card] for card in unseen]
+
+    for index in sorted(xrange(len(unseen)), key=lambda i: len(holders[i])):
+        choices = [pid for pid in holders[index] if room[pid]]
+
+        if not choices:
+            return None
+
+        pick = rng.randrange(sum(room[pid] for pid in choices))
+
+        for pid in choices:
+            pick -= room[pid]
+
+            if pick < 0:
+                break
+
+        hands[pid] |= unseen[index]
+        room[pid] -= 1
+
+    return hands
+
+
+def play_out_deal(hands, me, moves, args, totals, deadline=None):
+    """
+    Plays out every move on one deal, adding the finishing place of `me` for
+    each to `totals`. If the deadline passes before every move is played
+    out, the deal is dropped and `totals` is left alone, so that the moves
+    are always compared on the same deals.
+
+    INPUTS:
+        hands       - packed hand of every player, not modified
+        me          - the player to move
+        moves       - PlayCatalog IDs of the moves, -1 for a pass
+        args        - the round, as the arguments of `rollout` after `me`
+        totals      - list of the running total for each move, added to
+        deadline    - optional default_timer() value to give up at
+
+    RETURNS:
+        bool    - whether the deal was played out
+    """
+
+    places = []
+
+    for move in moves:
+        if deadline is not None and default_timer() >= deadline:
+            return False
+
+        place = rollout(list(hands), me, me, *args, first=move,
+                        deadline=deadline)
+
+        if place is None:
+            return False
+
+        places.append(place)
+
+    for index, place in enumerate(places):
+        totals[index] += place
+
+    return True
+
+
+def pack_position(position):
+    """
+    Packs a position from `SearchAgent.position` into a tuple of ints, the
+    form sent to worker processes.
+
+    INPUTS:
+        position    - dict
+
+    RETURNS:
+        tuple   - (me, hand, unseen, holding, excluded, moves, args), where
+                  hand, unseen and excluded are card masks and args is the
+                  round as the arguments of `rollout` after `me`
+    """
+
+    return (position['me'], position['hand'], position['unseen'],
+            position['holding'], position['excluded'],
+            tuple(position['moves']),
+            (position['top'], position['lead'], position['on_suit'],
+             position['followed'], position['passes'],
+             position['last_player']))
+
+
+def play_out_deals(task):
+    """
+    Plays out `count` deals of a packed position. Module level, so that it
+    can be run by the workers of a ParallelSampler.
+
+    INPUTS:
+        task    - (token, seed, count, packed position) tuple
+
+    RETURNS:
+        tuple   - (token, count, totals), totals holding the sum of the
+                  finishing places for each move, or the exception raised
+                  in their place, as a pool has no other way to send it back
+    """
+
+    token, seed, count, packed = task
+
+    try:
+        me, hand, unseen, holding, excluded, moves, args = packed
+        rng = Random(seed)
+        cards = get_card_bits(unseen)
+        totals = [0] * len(moves)
+
+        for i in xrange(count):
+            play_out_deal(sample_hands(me, hand, cards, holding, rng,
+                                       excluded), me, moves, args, totals)
+    except Exception as error:
+        return token, count, error
+
+    return token, count, totals
+
+
+def get_card_bits(mask):
+    """
+    RETURNS:
+        list    - the single card bits of `mask`, lowest first
+    """
+
+    return [1 << card for card in xrange(mask.bit_length()) if mask >> card & 1]
+
+
+class ParallelSampler(object):
+    """
+    Plays out the deals of a SearchAgent on a persistent pool of worker
+    processes. Only the packed position (masks, counts and IDs, see
+    `pack_position`) is sent, in tasks of `batch` deals, and the totals are
+    added up as the tasks come back, so a deadline can stop the sampling at
+    any point. Tasks still running at the deadline are ignored when they
+    come back.
+
+    The pool lives as long as the sampler, call `close` when done.
+
+    ATTRIBUTES:
+        processes   - number of worker processes
+        batch       - deals played out per task
+        pool        - the multiprocessing Pool
+        results     - Queue the finished tasks are put on
+        token       - number of the current evaluation, to tell its tasks
+                      from those of earlier ones
+    """
+
+    def __init__(self, processes=None, batch=4):
+        self.processes = processes or cpu_count()
+        self.batch = batch
+        self.pool = Pool(self.processes)
+        self.results = Queue()
+        self.token = 0
+
+    def evaluate(self, position, deadline=None, rollouts=None, rng=None):
+        """
+        Plays out every move of `position` over sampled deals until the
+        deadline passes or `rollouts` games have been played out.
+
+        INPUTS:
+            position    - dict from `SearchAgent.position`
+            deadline    - default_timer() value to stop at, or None
+            rollouts    - games to play out, or None
+            rng         - random.Random to seed the workers from
+
+        RETURNS:
+            tuple   - (mean finishing place for each move, deals played)
+
+        RAISES:
+            the exception of a worker that failed to play out its deals
+        """
+
+        if deadline is None and rollouts is None:
+            raise ValueError("a deadline or a number of rollouts is needed")
+
+        rng = rng or Random()
+        packed = pack_position(position)
+        moves = packed[5]
+        limit = None if rollouts is None else max(1, rollouts // len(moves))
+
+        self.token += 1
+        totals = [0] * len(moves)
+        deals = queued = running = 0
+
+        while True:
+            # keep every worker busy, with one task waiting behind each
+            while running < 2 * self.processes and \
+                    (limit is None or queued < limit) and \
+                    (deadline is None or default_timer() < deadline):
+                count = self.batch if limit is None \
+                    else min(self.batch, limit - queued)
+
+                self.pool.apply_async(
+                    play_out_deals,
+                    ((self.token, rng.getrandbits(32), count, packed),),
+                    callback=self.results.put)
+
+                queued += count
+                running += 1
+
+            if not running:
+                break
+
+            timeout = None
+
+            if deadline is not None:
+                timeout = deadline - default_timer()
+
+                if timeout <= 0:
+                    break
+
+            try:
+                token, count, batch_totals = self.results.get(timeout=timeout)
+            except Empty:
+                break
+
+            if token != self.token:
+                continue
+
+            if isinstance(batch_totals, Exception):
+                raise batch_totals
+
+            running -= 1
+            deals += count
+            totals = map(add, totals, batch_totals)
+
+        return [total / float(max(deals, 1)) for total in totals], deals
+
+    def close(self):
+        """
+        Stops the worker processes.
+
+        RETURNS:
+            None
+        """
+
+        self.pool.close()
+        self.pool.join()
+
+
+class GameFollower(object):
+    """
+    Follows a game from the `discard` passed to each decision of an agent
+    with the signature of `bcrowley.play`, working out whose turn it is,
+    who made each play and which cards are unseen.
+
+    The seatings that fit the game (see `get_seatings`) are kept from one
+    decision to the next and only fast-forwarded through the new plays,
+    until a new game (a new `discard` list) starts, or the agent is asked
+    to play for another hand.
+
+    ATTRIBUTES:
+        discard     - the game the seatings are for
+        seatings    - list of (first leader, UnseenTracker) still fitting
+    """
+
+    def __init__(self):
+        self.discard = None
+        self.seatings = []
+
+    def tracker(self, discard, holding, hand):
+        """
+        Returns the UnseenTracker of a seating that fits the game so far.
+
+        INPUTS:
+            as `bcrowley.play`
+
+        RETURNS:
+            UnseenTracker, or None if no seating fits
+        """
+
+        mask = bcrowley.encode_hand(hand)
+
+        # the trackers are for one hand, whose cards they never count unseen
+        if discard is not self.discard or not self.seatings or \
+                mask & self.seatings[0][1].unseen or \
+                len(discard) < self.seatings[0][1].rounds:
+            self.discard = discard
+            self.seatings = get_seatings(hand, len(holding))
+
+        for first, tracker in self.seatings:
+            tracker.fast_forward(discard)
+
+        self.seatings = [(first, tracker) for first, tracker in self.seatings
+                         if seating_fits(first, tracker, holding, hand)]
+
+        return self.seatings[0][1] if self.seatings else None
+
+    def position(self, rnd, hand, discard, holding):
+        """
+        Packs the decision into the form taken by `SearchAgent.search`,
+        `pack_position` and `endgame.EndgameSolver`.
+
+        INPUTS:
+            as `bcrowley.play`
+
+        RETURNS:
+            dict    - 'me', 'hand' and 'unseen' (card masks), 'holding',
+                      'excluded' (see UnseenTracker), 'moves' (the legal
+                      moves, the heuristic's first, -1 for a pass) and the
+                      round as the arguments of `rollout`; or None if the
+                      game cannot be followed
+        """
+
+        tracker = self.tracker(discard or [rnd], holding, hand)
+
+        if tracker is None or len(tracker.round) != len(rnd):
+            return None
+
+        state = tracker.round
+
+        if state.lead is not None and state.top_id is None:
+            return None
+
+        me = tracker.to_move()
+        catalog = get_policy_tables()[0]
+        mask = bcrowley.encode_hand(hand)
+        unseen = tracker.unseen
+
+        if bcrowley.count_cards(unseen) != sum(holding) - holding[me]:
+            return None
+
+        top = -1 if state.top_id is None else state.top_id
+        legal = catalog.follows(mask, state)
+        moves = list(catalog.iter_ids(legal))
+
+        if top >= 0:
+            moves.append(-1)
+
+        heuristic = heuristic_move(mask, top, state.on_suit)
+        moves.remove(heuristic)
+        moves.insert(0, heuristic)
+
+        return {
+            'me': me,
+            'hand': mask,
+            'unseen': unseen,
+            'holding': tuple(holding),
+            'excluded': tuple(excluded & unseen
+                              for excluded in tracker.excluded),
+            'moves': moves,
+            'top': top,
+            'lead': -1 if state.lead is None else catalog.get_id(state.lead),
+            'on_suit': state.on_suit,
+            'followed': state.followed,
+            'passes': state.passes,
+            'last_player': tracker.last_player,
+        }
+
+
+class SearchAgent(GameFollower):
+    """
+    An agent with the signature of `bcrowley.play` that searches for its
+    move, see the module docstring. It falls back to `bcrowley.play` when
+    the game so far cannot be followed, e.g. a round led with a play that
+    is not a legal combination.
+
+    Samples are taken until `time_limit` seconds have passed or `rollouts`
+    games have been played out, whichever comes first. Every sample plays
+    out each legal move, so moves are compared on the same deals. With a
+    ParallelSampler the deals are played out by its workers instead. The
+    game is followed as described for GameFollower.
+
+    ATTRIBUTES:
+        time_limit  - seconds per decision, or None for no limit
+        rollouts    - games played out per decision, or None for no limit
+        rng         - random.Random used for the deals
+        sampler     - optional ParallelSampler
+        samples     - number of deals sampled for the last decision
+    """
+
+    def __init__(self, time_limit=0.05, rollouts=None, seed=None,
+                 sampler=None):
+        if time_limit is None and rollouts is None:
+            raise ValueError("a time limit or a number of rollouts is needed")
+
+        self.time_limit = time_limit
+        self.rollouts = rollouts
+        self.rng = Random(seed)
+        self.sampler = sampler
+        self.samples = 0
+
+        GameFollower.__init__(self)
+
+    def __call__(self, rnd, hand, discard, holding):
+        return self.play(rnd, hand, discard, holding)
+
+    def play(self, rnd, hand, discard, holding):
+        """
+        Returns the play to make, as `bcrowley.play`.
+
+        INPUTS:
+            rnd     - a list of plays from the round to date
+            hand    - a list of the current cards held by your player
+            discard - a list of the history of the game so far
+            holding - how many cards each of the players is holding
+
+        RETURNS:
+            list    - list of cards representing the next play, or None
+        """
+
+        # following the game counts towards the time limit too
+        deadline = None if self.time_limit is None \
+            else default_timer() + self.time_limit
+
+        self.samples = 0
+        position = self.position(rnd, hand, discard, holding)
+
+        if position is None:
+            return bcrowley.play(rnd, hand, discard, holding)
+
+        moves = position['moves']
+
+        if len(moves) > 1:
+            means = self.search(position, deadline)
+            best = min(xrange(len(moves)), key=means.__getitem__)
+        else:
+            best = 0
+
+        return self.decode(moves[best])
+
+    def improve(self, rnd, hand, discard, holding, deadline=None):
+        """
+        Searches for the play to make as `play` does, yielding the best
+        play so far each time it changes, for `bcrowley.play_anytime`.
+        Nothing is yielded if the heuristic's play stays the best, or if
+        the game so far cannot be followed.
+
+        INPUTS:
+            as `play`, and
+            deadline    - default_timer() value to stop at, defaults to
+                          `time_limit` seconds from now
+
+        RETURNS:
+            generator - of plays, lists of cards or None
+        """
+
+        if deadline is None and self.time_limit is not None:
+            deadline = default_timer() + self.time_limit
+
+        self.samples = 0
+        position = self.position(rnd, hand, discard, holding)
+
+        if position is None or len(position['moves']) < 2:
+            return
+
+        moves = position['moves']
+        best = 0
+
+        for totals in self.iter_search(position, deadline):
+            leader = min(xrange(len(moves)), key=totals.__getitem__)
+
+            if leader != best:
+                best = leader
+                yield self.decode(moves[best])
+
+    def decode(self, move):
+        """
+        RETURNS:
+            list    - the cards of a PlayCatalog ID, or None for -1
+        """
+
+        if move < 0:
+            return None
+
+        return bcrowley.decode_hand(get_policy_tables()[0].masks[move])
+
+    def search(self, position, deadline=None):
+        """
+        Plays out every move of `position` over sampled deals until the
+        budget runs out.
+
+        INPUTS:
+            position    - dict from `position`
+            deadline    - default_timer() value to stop at, defaults to
+                          `time_limit` seconds from now
+
+        RETURNS:
+            list    - mean finishing place for each of position['moves']
+        """
+
+        totals = [0] * len(position['moves'])
+
+        for totals in self.iter_search(position, deadline):
+            pass
+
+        samples = max(self.samples, 1)
+
+        return [total / float(samples) for total in totals]
+
+    def iter_search(self, position, deadline=None):
+        """
+        Plays out every move of `position` over sampled deals, as `search`,
+        yielding the running totals after each deal (or once, from the
+        sampler). Every move is played out on the same deals, so the move
+        with the lowest total is the best so far.
+
+        INPUTS:
+            as `search`
+
+        RETURNS:
+            generator - of lists of the total finishing place of each move
+        """
+
+        if deadline is None and self.time_limit is not None:
+            deadline = default_timer() + self.time_limit
+
+        if self.sampler is not None:
+            means, self.samples = self.sampler.evaluate(
+                position, deadline, self.rollouts, self.rng)
+
+            yield [mean * self.samples for mean in means]
+            return
+
+        me, hand, unseen, holding, excluded, moves, args = \
+            pack_position(position)
+        cards = get_card_bits(unseen)
+        totals = [0] * len(moves)
+        played = 0
+
+        while (self.rollouts is None or played < self.rollouts) and \
+                (deadline is None or default_timer() < deadline):
+
+            hands = sample_hands(me, hand, cards, holding, self.rng, excluded)
+
+            if not play_out_deal(hands, me, moves, args, totals, deadline):
+                break
+
+            played += len(moves)
+            self.samples += 1
+
+            yield totals
+
+
+POLICY_TABLES = None
+
+# turns of a rollout between checks of the deadline
+ROLLOUT_CHECK = 16
+
+
+if __name__ == "__main__":
+    import simulator
+
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    limit = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    sampler = ParallelSampler(int(sys.argv[3])) if len(sys.argv) > 3 \
+        else None
+
+    agents = simulator.default_agents()
+    agents[0] = SearchAgent(time_limit=limit, seed=0, sampler=sampler)
+
+    stats = simulator.simulate(games, agents, rng=Random(0))
+
+    if sampler is not None:
+        sampler.close()
+
+    print stats.summary()
+    print "win rates:      ", stats.win_rates()
+    print "mean positions: ", stats.mean_positions()
@@ -0,0 +1,917 @@
+# coding=utf-8
+"""*****************************************************************************
+
+Daifugo Game Server
+
+Hosts many tables at once on one event loop. Every table plays the deal,
+swap and round loop of `simulator.simulate_game` as a state machine that
+waits on one decision at a time, so no thread is tied to a game.
+
+Each seat is either a local agent, any function with the signature of
+`bcrowley.play`, or REMOTE, a client connected over a local TCP socket.
+Local decisions run on a bounded executor (a pool of `workers` threads by
+default, or any object with the `apply_async` of a multiprocessing Pool),
+with at most `max_pending` decisions handed to it at once; the rest wait
+their turn, first come first served, as do the decisions of a seat whose
+last decision is still running. A decision that is not made within
+`move_timeout` seconds, that is not a legal move, or whose agent raises, is
+replaced with the choice of `bcrowley.play` and the late answer is dropped.
+
+Remote clients speak newline delimited JSON:
+
+    client: {"join": table name or null}
+    server: {"table": name, "seat": pid}
+    server: {"turn": n, "rnd": ..., "hand": ..., "discard": ...,
+             "holding": ...}
+    client: {"turn": n, "play": list of cards or null}
+    server: {"result": {"order": ..., "cards_left": ..., "rounds": ...}}
+
+Any other message is answered with {"error": reason}.
+
+`run_client` plays a seat with a local agent. Run directly to time a
+number of self-play tables:
+
+    python server.py [tables] [games per table] [workers]
+
+*****************************************************************************"""
+
+import asynchat
+import asyncore
+import json
+import os
+import socket
+import sys
+import traceback
+from collections import deque
+from heapq import heappop, heappush
+from multiprocessing.pool import ThreadPool
+from Queue import Empty, Queue
+from random import Random
+from threading import Lock
+from timeit import default_timer
+
+import bcrowley
+from simulator import FIRST_LEAD, SimulationStats, check_play, swap_phase
+
+
+# a seat played by a client connected to the server
+REMOTE = 'remote'
+
+
+class ServerStats(SimulationStats):
+    """
+    SimulationStats for a server, where decision_time and max_decision are
+    the latency of each decision from the moment it is asked for, including
+    any time spent waiting for the executor.
+
+    ATTRIBUTES:
+        as SimulationStats, and
+        timeouts        - decisions replaced for taking too long
+        invalid         - decisions replaced for not being legal moves
+        errors          - decisions replaced for their agent raising
+        queued          - decisions that waited for a free executor slot
+        queue_time      - total seconds decisions waited for a slot
+        max_pending     - most decisions handed to the executor at once
+        tables          - number of tables finished
+    """
+
+    def __init__(self, players=4):
+        SimulationStats.__init__(self, players)
+
+        self.timeouts = 0
+        self.invalid = 0
+        self.errors = 0
+        self.queued = 0
+        self.queue_time = 0.0
+        self.max_pending = 0
+        self.tables = 0
+
+    def summary(self):
+        """
+        RETURNS:
+            str     - a human readable report of throughput, latency and
+                      replaced decisions
+        """
+
+        return (
+            "{0}\n{1} tables, {2:.1f} decisions/s, {3} timeouts, {4} invalid, "
+            "{5} errors, {6} queued ({7:.1f}us mean wait), "
+            "{8} most pending".format(
+                SimulationStats.summary(self), self.tables,
+                self.decisions / self.elapsed if self.elapsed else 0.0,
+                self.timeouts, self.invalid, self.errors, self.queued,
+                self.queue_time / self.queued * 1e6 if self.queued else 0.0,
+                self.max_pending))
+
+
+class Table(object):
+    """
+    One table: the game in progress, advanced one decision at a time under
+    the rules of `simulator.play_round`.
+
+    ATTRIBUTES:
+        name        - the table's name
+        seats       - agent function or REMOTE for each player
+        games       - games still to be played at the table
+        rng         - random.Random used for the deals
+        swap        - function with the signature of `bcrowley.swap_cards`
+        clients     - Client of each REMOTE seat, once joined
+        hands       - the hands of the game in progress
+        discard     - the game so far
+        views       - views[pid] is the copy of the game shown to the seat,
+                      see `decision`
+        busy        - player IDs whose agent is running on the executor
+        state       - RoundState of the current round
+        order       - player IDs that have gone out
+        pid         - player to move
+        last_player - player who made the top play of the round
+        passes      - passes since the last non-pass play
+        token       - number of the decision asked for, to tell its answer
+                      from late answers to earlier ones
+        asked       - default_timer() when the decision was asked for
+        results     - the results of the games played at the table
+    """
+
+    def __init__(self, name, seats, games=1, rng=None,
+                 swap=bcrowley.swap_cards):
+        self.name = name
+        self.seats = list(seats)
+        self.games = games
+        self.rng = rng or Random()
+        self.swap = swap
+        self.clients = {}
+        self.hands = None
+        self.discard = None
+        self.views = None
+        self.busy = set()
+        self.state = None
+        self.order = None
+        self.pid = None
+        self.last_player = None
+        self.passes = 0
+        self.token = 0
+        self.asked = 0.0
+        self.results = []
+
+    def is_ready(self):
+        """
+        RETURNS:
+            bool    - whether every REMOTE seat has a client
+        """
+
+        return all(seat is not REMOTE or pid in self.clients
+                   for pid, seat in enumerate(self.seats))
+
+    def start_game(self):
+        """
+        Deals, performs the swap phase and sets up the first round.
+
+        RETURNS:
+            None
+        """
+
+        self.hands = bcrowley.deal(len(self.seats), self.rng)
+        swap_phase(self.hands, self.swap)
+
+        self.discard = [[]]
+        self.views = [[] for seat in self.seats]
+        self.state = bcrowley.RoundState()
+        self.order = []
+        self.pid = self.last_player = next(
+            pid for pid, hand in enumerate(self.hands) if FIRST_LEAD in hand)
+        self.passes = 0
+
+    def decision(self):
+        """
+        Brings the view of the game of the player to move up to date, only
+        copying the plays made since they last moved, so that agents
+        following the game (see `search.GameFollower`) get the same discard
+        list for the whole game and need only catch up on the new plays.
+        The view is never touched while the seat's agent is running, as a
+        seat is not asked again until its last decision is back, see
+        `GameServer.ask`.
+
+        RETURNS:
+            tuple   - the arguments of `bcrowley.play` for the player to
+                      move, the hand a copy
+        """
+
+        discard = self.discard
+        view = self.views[self.pid]
+
+        if view:
+            rnd = view[-1]
+            rnd.extend(discard[len(view) - 1][len(rnd):])
+
+        view.extend(list(rnd) for rnd in discard[len(view):])
+
+        return (view[-1], list(self.hands[self.pid]), view,
+                tuple(len(hand) for hand in self.hands))
+
+    def fallback(self):
+        """
+        RETURNS:
+            list    - the play `bcrowley.play` makes for the player to move,
+                      or None, on a copy of the game, as the seat's agent
+                      may still be running on its view
+        """
+
+        discard = [list(rnd) for rnd in self.discard]
+
+        return bcrowley.play(discard[-1], list(self.hands[self.pid]), discard,
+                             tuple(len(hand) for hand in self.hands))
+
+    def apply(self, play):
+        """
+        Makes `play` for the player to move and moves the game on.
+
+        INPUTS:
+            play    - list of cards or None
+
+        RETURNS:
+            dict    - the result, as `simulator.simulate_game`, if the game
+                      is over, otherwise None
+
+        RAISES:
+            ValueError if the play is not a legal move, leaving the table
+            as it was
+        """
+
+        pid = self.pid
+        hands = self.hands
+        players = len(hands)
+
+        try:
+            check_play(play, self.state, hands[pid], pid)
+        except (KeyError, TypeError):
+            raise ValueError(
+                "player {0} cannot play {1}".format(pid, play))
+
+        self.discard[-1].append(play)
+        self.state.push(play)
+
+        if play is None:
+            self.passes += 1
+        else:
+            for card in play:
+                hands[pid].remove(card)
+
+            self.last_player = pid
+            self.passes = 0
+
+            if not hands[pid]:
+                self.order.append(pid)
+
+        active = players - len(self.order)
+
+        if active <= 1:
+            order = self.order + [other for other in xrange(players)
+                                  if other not in self.order]
+
+            return {
+                'order': order,
+                'cards_left': tuple(len(hand) for hand in hands),
+                'rounds': len(self.discard),
+            }
+
+        # everyone still in the game has passed on the last play
+        if self.passes >= active - (0 if self.last_player in self.order
+                                    else 1):
+            pid = self.last_player
+
+            # the round winner leads, or the next player if they have gone
+            while not hands[pid]:
+                pid = (pid + 1) % players
+
+            self.discard.append([])
+            self.state = bcrowley.RoundState()
+            self.last_player = pid
+            self.passes = 0
+        else:
+            pid = (pid + 1) % players
+
+            while not hands[pid]:
+                pid = (pid + 1) % players
+
+        self.pid = pid
+
+        return None
+
+
+class Client(asynchat.async_chat):
+    """
+    A connection from a remote player, reading and writing one JSON message
+    per line.
+
+    ATTRIBUTES:
+        server  - the GameServer
+        buffer  - the part of the current line read so far
+        table   - the Table of the client's seat, once seated
+        seat    - the client's player ID, once seated
+    """
+
+    def __init__(self, server, sock, map):
+        asynchat.async_chat.__init__(self, sock, map)
+
+        self.server = server
+        self.buffer = []
+        self.table = None
+        self.seat = None
+        self.set_terminator('\n')
+
+    def collect_incoming_data(self, data):
+        self.buffer.append(data)
+
+    def found_terminator(self):
+        line = ''.join(self.buffer)
+        self.buffer = []
+
+        try:
+            message = json.loads(line)
+        except ValueError:
+            self.send_message({'error': 'not JSON'})
+            return
+
+        if not isinstance(message, dict):
+            self.send_message({'error': 'not a JSON object'})
+        elif 'join' in message:
+            self.server.join(self, message['join'])
+        elif 'turn' in message and self.table is not None:
+            play = message.get('play')
+
+            if play is not None and (
+                    not isinstance(play, list) or
+                    not all(isinstance(card, basestring) for card in play)):
+                self.send_message({'error': 'not a list of cards or null'})
+                return
+
+            self.server.answer(self.table, message['turn'], play and [
+                card.encode('utf-8') for card in play])
+        else:
+            self.send_message({'error': 'unknown message'})
+
+    def send_message(self, message):
+        """
+        Queues a message for the client.
+
+        INPUTS:
+            message - JSON serialisable dict
+
+        RETURNS:
+            None
+        """
+
+        self.push(json.dumps(message) + '\n')
+
+    def handle_close(self):
+        self.server.leave(self)
+        self.close()
+
+
+class Listener(asyncore.dispatcher):
+    """
+    Accepts remote players on the server's socket.
+
+    ATTRIBUTES:
+        server  - the GameServer
+    """
+
+    def __init__(self, server, address):
+        asyncore.dispatcher.__init__(self, map=server.map)
+
+        self.server = server
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(address)
+        self.listen(64)
+
+    def handle_accept(self):
+        pair = self.accept()
+
+        if pair is not None:
+            Client(self.server, pair[0], self.server.map)
+
+
+class Waker(asyncore.file_dispatcher):
+    """
+    The read end of a pipe written to by executor threads, so that a
+    finished decision wakes the event loop.
+    """
+
+    def handle_read(self):
+        self.recv(4096)
+
+    def writable(self):
+        return False
+
+
+class GameServer(object):
+    """
+    Runs tables on one asyncore event loop, see the module docstring.
+
+    ATTRIBUTES:
+        executor        - the executor local decisions run on
+        max_pending     - most decisions handed to the executor at once
+        move_timeout    - seconds allowed per decision, or None
+        stats           - ServerStats
+        map             - the asyncore socket map of the server
+        tables          - dict of name to Table
+        running         - tables with a game in progress
+        pending         - decisions handed to the executor and not back
+        waiting         - deque of (table, token, asked) decisions waiting
+                          for a free executor slot, or for their seat's last
+                          decision to come back
+        deadlines       - heap of (deadline, token, table) for timeouts
+        results         - Queue of (table, token, play, error, seat)
+                          answers, seat being the player ID the executor
+                          ran the agent of, or None, and error the
+                          traceback of an agent that raised, or None
+        address         - the address remote players connect to, or None
+        listener        - the Listener, if there is an address
+        waker           - the Waker of the loop, written to via wake_fd
+        wake_lock       - Lock held to write to or close wake_fd
+        owns_executor   - whether the executor was made by the server
+    """
+
+    def __init__(self, workers=4, executor=None, max_pending=None,
+                 move_timeout=1.0, address=None):
+        self.executor = executor or ThreadPool(workers)
+        self.owns_executor = executor is None
+        self.max_pending = max_pending or 2 * workers
+        self.move_timeout = move_timeout
+        self.stats = ServerStats()
+        self.map = {}
+        self.tables = {}
+        self.running = set()
+        self.pending = 0
+        self.waiting = deque()
+        self.deadlines = []
+        self.results = Queue()
+        self.address = None
+        self.listener = None
+
+        read, self.wake_fd = os.pipe()
+        self.wake_lock = Lock()
+        self.waker = Waker(read, self.map)
+        os.close(read)
+
+        if address is not None:
+            self.listener = Listener(self, address)
+            self.address = self.listener.socket.getsockname()
+
+    def add_table(self, seats, games=1, name=None, rng=None):
+        """
+        Adds a table, which starts as soon as its REMOTE seats are taken.
+
+        INPUTS:
+            seats   - agent function or REMOTE for each player
+            games   - number of games to play at the table
+            name    - the table's name, defaults to its number
+            rng     - optional random.Random used for the deals
+
+        RETURNS:
+            Table
+        """
+
+        if name is None:
+            name = str(len(self.tables))
+
+        table = self.tables[name] = Table(name, seats, games, rng)
+
+        if table.is_ready():
+            self.begin(table)
+
+        return table
+
+    def join(self, client, name=None):
+        """
+        Seats a remote player at the named table, or at any table with a
+        free REMOTE seat.
+
+        INPUTS:
+            client  - Client
+            name    - optional table name
+
+        RETURNS:
+            None
+        """
+
+        tables = [self.tables[name]] if name in self.tables \
+            else sorted(self.tables.values(), key=lambda table: table.name)
+
+        for table in tables:
+            for pid, seat in enumerate(table.seats):
+                if seat is REMOTE and pid not in table.clients and \
+                        table.games:
+                    table.clients[pid] = client
+                    client.table = table
+                    client.seat = pid
+                    client.send_message({'table': table.name, 'seat': pid})
+
+                    if table.is_ready():
+                        self.begin(table)
+
+                    return
+
+        client.send_message({'error': 'no free seat'})
+        client.close_when_done()
+
+    def leave(self, client):
+        """
+        Frees the seat of a client that disconnected. Its decisions are made
+        by `bcrowley.play` as they time out, or at once if there is no
+        `move_timeout`, until another client joins.
+
+        INPUTS:
+            client  - Client
+
+        RETURNS:
+            None
+        """
+
+        table = client.table
+
+        if table is not None:
+            table.clients.pop(client.seat, None)
+            client.table = None
+
+            # the decision the client was sent would never be answered
+            if self.move_timeout is None and table in self.running and \
+                    table.pid == client.seat:
+                self.ask(table)
+
+    def begin(self, table):
+        """
+        Starts the next game at a table.
+
+        RETURNS:
+            None
+        """
+
+        self.running.add(table)
+        table.start_game()
+        self.ask(table)
+
+    def ask(self, table):
+        """
+        Asks the seat to move at a table for its decision.
+
+        RETURNS:
+            None
+        """
+
+        table.token += 1
+        table.asked = default_timer()
+
+        if self.move_timeout is not None:
+            heappush(self.deadlines, (table.asked + self.move_timeout,
+                                      table.token, table))
+
+        seat = table.seats[table.pid]
+
+        if seat is REMOTE:
+            client = table.clients.get(table.pid)
+
+            if client is not None:
+                rnd, hand, discard, holding = table.decision()
+                client.send_message({'turn': table.token, 'rnd': rnd,
+                                     'hand': hand, 'discard': discard,
+                                     'holding': holding})
+            elif self.move_timeout is None:
+                # no one to wait for, made on the next pass of the loop
+                self.results.put((table, table.token, table.fallback(),
+                                  None, None))
+                self.wake()
+        elif self.pending < self.max_pending and not self.waiting and \
+                table.pid not in table.busy:
+            self.submit(table, table.token)
+        else:
+            self.stats.queued += 1
+            self.waiting.append((table, table.token, table.asked))
+
+    def submit(self, table, token):
+        """
+        Hands a local decision to the executor.
+
+        RETURNS:
+            None
+        """
+
+        pid = table.pid
+        agent = table.seats[pid]
+        results = self.results
+        wake = self.wake
+
+        def done(answer):
+            results.put((table, token) + answer + (pid,))
+            wake()
+
+        table.busy.add(pid)
+        self.pending += 1
+        self.stats.max_pending = max(self.stats.max_pending, self.pending)
+        self.executor.apply_async(decide, (agent,) + table.decision(),
+                                  callback=done)
+
+    def wake(self):
+        """
+        Wakes the event loop, from any thread, unless the server is closed.
+        Decisions still running when it closes finish quietly.
+
+        RETURNS:
+            None
+        """
+
+        with self.wake_lock:
+            if self.wake_fd is not None:
+                os.write(self.wake_fd, 'x')
+
+    def answer(self, table, token, play):
+        """
+        Makes the play answering decision `token` at a table, unless the
+        decision has already been made. An illegal play is replaced with
+        the choice of `bcrowley.play`.
+
+        INPUTS:
+            table   - Table
+            token   - the decision answered
+            play    - list of cards or None
+
+        RETURNS:
+            None
+        """
+
+        if token != table.token or table not in self.running:
+            return
+
+        taken = default_timer() - table.asked
+        stats = self.stats
+
+        stats.decisions += 1
+        stats.decision_time += taken
+        stats.max_decision = max(stats.max_decision, taken)
+
+        # the decision is made, later answers to it are dropped
+        table.token += 1
+
+        try:
+            result = table.apply(play)
+        except ValueError:
+            stats.invalid += 1
+            result = table.apply(table.fallback())
+
+        if result is None:
+            self.ask(table)
+            return
+
+        stats.record(result)
+        table.results.append(result)
+        table.games -= 1
+
+        for client in table.clients.values():
+            client.send_message({'result': result})
+
+        if table.games:
+            self.begin(table)
+            return
+
+        self.running.discard(table)
+        stats.tables += 1
+
+        for client in table.clients.values():
+            client.close_when_done()
+
+    def fail(self, table, token, error):
+        """
+        Reports an agent that raised, and replaces its decision, unless the
+        decision has already been made.
+
+        INPUTS:
+            table   - Table
+            token   - the decision the agent was making
+            error   - the traceback of the exception
+
+        RETURNS:
+            None
+        """
+
+        self.stats.errors += 1
+        sys.stderr.write("agent at table {0} raised on decision {1}:\n"
+                         "{2}".format(table.name, token, error))
+
+        if token == table.token and table in self.running:
+            self.answer(table, token, table.fallback())
+
+    def expire(self, now):
+        """
+        Replaces the decisions whose deadline has passed.
+
+        INPUTS:
+            now     - default_timer() value
+
+        RETURNS:
+            None
+        """
+
+        deadlines = self.deadlines
+
+        while deadlines and deadlines[0][0] <= now:
+            deadline, token, table = heappop(deadlines)
+
+            if token == table.token and table in self.running:
+                self.stats.timeouts += 1
+                self.answer(table, token, table.fallback())
+
+    def drain(self):
+        """
+        Makes the plays sent back by the executor, and hands waiting
+        decisions to the slots they free, in the order they were asked for,
+        passing over those whose seat is still busy.
+
+        RETURNS:
+            None
+        """
+
+        while True:
+            try:
+                table, token, answer, error, seat = \
+                    self.results.get_nowait()
+            except Empty:
+                break
+
+            if seat is not None:
+                self.pending -= 1
+                table.busy.discard(seat)
+
+            if error is not None:
+                self.fail(table, token, error)
+            else:
+                self.answer(table, token, answer)
+
+        if not self.waiting or self.pending >= self.max_pending:
+            return
+
+        waiting = deque()
+
+        while self.waiting:
+            table, token, asked = self.waiting.popleft()
+
+            # dropped if it timed out while waiting
+            if token != table.token or table not in self.running:
+                continue
+
+            if self.pending < self.max_pending and \
+                    table.pid not in table.busy:
+                self.stats.queue_time += default_timer() - asked
+                self.submit(table, token)
+            else:
+                waiting.append((table, token, asked))
+
+        self.waiting = waiting
+
+    def serve(self, duration=None):
+        """
+        Runs the event loop until every table has played its games and
+        every client has been sent its results, or for `duration` seconds.
+
+        INPUTS:
+            duration    - optional seconds to run for
+
+        RETURNS:
+            ServerStats
+        """
+
+        start = default_timer()
+        stop = None if duration is None else start + duration
+
+        while True:
+            now = default_timer()
+
+            if stop is not None and now >= stop:
+                break
+
+            # done once the last results have been sent to the clients
+            if stop is None and not self.running and \
+                    not any(table.games for table in self.tables.values()) \
+                    and not any(isinstance(dispatcher, Client)
+                                for dispatcher in self.map.values()):
+                break
+
+            timeout = 1.0
+
+            if self.deadlines:
+                timeout = min(timeout, self.deadlines[0][0] - now)
+
+            if stop is not None:
+                timeout = min(timeout, stop - now)
+
+            asyncore.loop(max(timeout, 0.0), map=self.map, count=1)
+
+            self.drain()
+            self.expire(default_timer())
+            self.drain()
+
+        self.stats.elapsed += default_timer() - start
+
+        return self.stats
+
+    def close(self):
+        """
+        Stops the executor if the server made it, and closes the sockets.
+
+        RETURNS:
+            None
+        """
+
+        if self.owns_executor:
+            self.executor.close()
+            self.executor.join()
+
+        asyncore.close_all(self.map)
+
+        with self.wake_lock:
+            os.close(self.wake_fd)
+            self.wake_fd = None
+
+
+def decide(agent, rnd, hand, discard, holding):
+    """
+    Runs one local decision on the executor. Module level, so that it can
+    be sent to the workers of a process pool. The traceback of an agent
+    that raises is sent back as text, which any pool can pickle.
+
+    INPUTS:
+        agent   - function with the signature of `bcrowley.play`
+        others  - as `bcrowley.play`
+
+    RETURNS:
+        tuple   - (play, None), or (None, traceback) if the agent raised
+    """
+
+    try:
+        return agent(rnd, hand, discard, holding), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def run_client(address, agent=bcrowley.play, table=None):
+    """
+    Plays a REMOTE seat with a local agent until the table's games are
+    over or the server closes the connection.
+
+    INPUTS:
+        address - (host, port) of the server
+        agent   - function with the signature of `bcrowley.play`
+        table   - optional name of the table to join
+
+    RETURNS:
+        list    - the results of the games played
+    """
+
+    connection = socket.create_connection(address)
+    stream = connection.makefile('r+b')
+    results = []
+
+    try:
+        stream.write(json.dumps({'join': table}) + '\n')
+        stream.flush()
+
+        seat = json.loads(stream.readline() or 'null')
+
+        if not seat or 'seat' not in seat:
+            return results
+
+        for line in iter(stream.readline, ''):
+            message = json.loads(line)
+
+            if 'turn' in message:
+                discard = message['discard']
+                play = agent(discard[-1], message['hand'], discard,
+                             message['holding'])
+                stream.write(json.dumps({'turn': message['turn'],
+                                         'play': play}) + '\n')
+                stream.flush()
+            elif 'result' in message:
+                results.append(message['result'])
+    finally:
+        stream.close()
+        connection.close()
+
+    return results
+
+
+if __name__ == "__main__":
+    import simulator
+
+    tables = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    games = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    server = GameServer(workers)
+
+    for index in xrange(tables):
+        server.add_table(simulator.default_agents(), games, rng=Random(index))
+
+    print server.serve().summary()
+    print "mean positions: ", server.stats.mean_positions()
+
+    server.close()
@@ -0,0 +1,390 @@
+# coding=utf-8
+"""*****************************************************************************
+
+Daifugo Simulator
+
+Runs complete games between four agents. An agent is any function with the
+signature of `bcrowley.play`:
+
+    agent(rnd, hand, discard, holding) -> list of cards or None
+
+Run directly to time self-play with the default agent:
+
+    python simulator.py [games]
+
+*****************************************************************************"""
+
+import sys
+from functools import partial
+from timeit import default_timer
+
+import bcrowley
+
+
+# (giver, receiver) for the swap phase, following `bcrowley.swap_cards`
+SWAPS = ((0, 3), (1, 2), (2, 1), (3, 0))
+
+# the holder of this card leads the first round
+FIRST_LEAD = '3D'
+
+
+class SimulationStats(object):
+    """
+    Running totals for a batch of simulated games. Totals from separate
+    batches, e.g. from worker processes, are combined with `merge`.
+
+    ATTRIBUTES:
+        games           - number of games completed
+        decisions       - number of agent calls
+        decision_time   - total seconds spent inside agents
+        max_decision    - slowest single agent call in seconds
+        elapsed         - total wall clock seconds spent simulating
+        positions       - positions[pid][place] counts how often each player
+                          finished in each place, 0 being first out
+        cards_left      - total cards still held at the end, per player
+        rounds          - total rounds played
+    """
+
+    def __init__(self, players=4):
+        self.games = 0
+        self.decisions = 0
+        self.decision_time = 0.0
+        self.max_decision = 0.0
+        self.elapsed = 0.0
+        self.positions = [[0] * players for i in xrange(players)]
+        self.cards_left = [0] * players
+        self.rounds = 0
+
+    def record(self, result):
+        """
+        Adds a finished game, as returned by `simulate_game`, to the totals.
+
+        INPUTS:
+            result  - dict with 'order', 'cards_left' and 'rounds'
+
+        RETURNS:
+            None
+        """
+
+        self.games += 1
+        self.rounds += result['rounds']
+
+        for place, pid in enumerate(result['order']):
+            self.positions[pid][place] += 1
+
+        for pid, cards in enumerate(result['cards_left']):
+            self.cards_left[pid] += cards
+
+    def merge(self, other):
+        """
+        Adds the totals of `other` into these totals. `elapsed` is left
+        alone, as batches that ran in parallel overlap in wall clock time.
+
+        INPUTS:
+            other   - SimulationStats
+
+        RETURNS:
+            None
+        """
+
+        self.games += other.games
+        self.decisions += other.decisions
+        self.decision_time += other.decision_time
+        self.max_decision = max(self.max_decision, other.max_decision)
+        self.rounds += other.rounds
+
+        for pid, places in enumerate(other.positions):
+            for place, count in enumerate(places):
+                self.positions[pid][place] += count
+
+        for pid, cards in enumerate(other.cards_left):
+            self.cards_left[pid] += cards
+
+    def win_rates(self):
+        """
+        RETURNS:
+            list    - fraction of games each player went out first
+        """
+
+        return [places[0] / float(self.games) if self.games else 0.0
+                for places in self.positions]
+
+    def mean_positions(self):
+        """
+        RETURNS:
+            list    - mean finishing place of each player, 0 being first out
+        """
+
+        return [sum(place * count for place, count in enumerate(places)) /
+                float(self.games) if self.games else 0.0
+                for places in self.positions]
+
+    def mean_cards_left(self):
+        """
+        RETURNS:
+            list    - mean cards held at the end of the game by each player
+        """
+
+        return [cards / float(self.games) if self.games else 0.0
+                for cards in self.cards_left]
+
+    def games_per_second(self):
+        """
+        RETURNS:
+            float   - games completed per wall clock second
+        """
+
+        return self.games / self.elapsed if self.elapsed else 0.0
+
+    def mean_decision(self):
+        """
+        RETURNS:
+            float   - mean seconds per agent call
+        """
+
+        return self.decision_time / self.decisions if self.decisions else 0.0
+
+    def summary(self):
+        """
+        RETURNS:
+            str     - a human readable report of throughput and latency
+        """
+
+        return (
+            "{0} games in {1:.2f}s ({2:.1f} games/s), {3} decisions, "
+            "{4:.1f}us mean / {5:.1f}us max per decision".format(
+                self.games, self.elapsed, self.games_per_second(),
+                self.decisions, self.mean_decision() * 1e6,
+                self.max_decision * 1e6))
+
+
+def default_agents(players=4):
+    """
+    Returns `bcrowley.play` for every seat, each with its own HandIndex so
+    that the plays of a hand are carried over from turn to turn.
+
+    INPUTS:
+        players - number of seats
+
+    RETURNS:
+        list    - list of agent functions
+    """
+
+    return [partial(bcrowley.play, generate=bcrowley.HandIndex())
+            for pid in xrange(players)]
+
+
+def simulate_game(agents, swap=bcrowley.swap_cards, hands=None, stats=None,
+                  rng=None, log=None):
+    """
+    Plays a single game and returns how it finished.
+
+    The game is dealt (unless `hands` is given), the swap phase is performed
+    and rounds are played until only one player holds cards. Players take
+    turns in pid order. A round ends when every other player still holding
+    cards passes in succession after the last play, and the last player to
+    play leads the next round (or the next player still holding cards if
+    they have gone out).
+
+    INPUTS:
+        agents  - list of 4 agent functions, indexed by player ID
+        swap    - function with the signature of `bcrowley.swap_cards`
+        hands   - optional list of 4 hands, otherwise `bcrowley.deal()`
+        stats   - optional SimulationStats to accumulate decision timings
+        rng     - optional random.Random used for the deal
+        log     - optional gamelog.GameLogWriter the game is written to
+
+    RETURNS:
+        dict    - 'order': player IDs in finishing order,
+                  'cards_left': cards held by each player at the end,
+                  'rounds': number of rounds played
+    """
+
+    if hands is None:
+        hands = bcrowley.deal(rng=rng)
+
+    swap_phase(hands, swap)
+
+    players = len(hands)
+    discard = []
+    order = []
+    leader = next(pid for pid in xrange(players) if FIRST_LEAD in hands[pid])
+
+    if log is not None:
+        dealt = [list(hand) for hand in hands]
+        first = leader
+
+    while players - len(order) > 1:
+        rnd = []
+        discard.append(rnd)
+
+        leader = play_round(agents, hands, discard, order, leader, stats)
+
+    order += [pid for pid in xrange(players) if pid not in order]
+
+    if log is not None:
+        log.write_game(discard, first, dealt)
+
+    return {
+        'order': order,
+        'cards_left': tuple(len(hand) for hand in hands),
+        'rounds': len(discard),
+    }
+
+
+def swap_phase(hands, swap=bcrowley.swap_cards):
+    """
+    Exchanges cards between the players according to SWAPS. Every player
+    chooses from their hand as dealt, then all the exchanges happen at once.
+
+    INPUTS:
+        hands   - list of 4 hands, mutated in place
+        swap    - function with the signature of `bcrowley.swap_cards`
+
+    RETURNS:
+        None
+    """
+
+    given = [swap(list(hands[giver]), giver) for giver, receiver in SWAPS]
+
+    for (giver, receiver), cards in zip(SWAPS, given):
+        for card in cards:
+            hands[giver].remove(card)
+            hands[receiver].append(card)
+
+
+def play_round(agents, hands, discard, order, leader, stats=None):
+    """
+    Plays the current round, discard[-1], to completion.
+
+    INPUTS:
+        agents  - list of agent functions, indexed by player ID
+        hands   - list of hands, mutated as cards are played
+        discard - the game so far, discard[-1] is the round being played
+        order   - player IDs that have gone out, appended to in place
+        leader  - player ID that leads the round
+        stats   - optional SimulationStats to accumulate decision timings
+
+    RETURNS:
+        int     - player ID that leads the next round
+    """
+
+    rnd = discard[-1]
+    state = bcrowley.RoundState(rnd)
+    players = len(hands)
+    pid = leader
+    last_player = leader
+    passes = 0
+
+    while True:
+
+        if hands[pid]:
+            holding = tuple(len(hand) for hand in hands)
+
+            start = default_timer()
+            play = agents[pid](rnd, hands[pid], discard, holding)
+            taken = default_timer() - start
+
+            if stats is not None:
+                stats.decisions += 1
+                stats.decision_time += taken
+                stats.max_decision = max(stats.max_decision, taken)
+
+            check_play(play, state, hands[pid], pid)
+            rnd.append(play)
+            state.push(play)
+
+            if play is None:
+                passes += 1
+            else:
+                for card in play:
+                    hands[pid].remove(card)
+
+                last_player = pid
+                passes = 0
+
+                if not hands[pid]:
+                    order.append(pid)
+
+            active = players - len(order)
+
+            # everyone still in the game has passed on the last play
+            if active <= 1 or \
+                    passes >= active - (0 if last_player in order else 1):
+                break
+
+        pid = (pid + 1) % players
+
+    # the round winner leads, or the next player if they have gone out
+    while not hands[last_player] and players - len(order) > 1:
+        last_player = (last_player + 1) % players
+
+    return last_player
+
+
+def check_play(play, rnd, hand, pid):
+    """
+    Raises a ValueError if `play` is not a legal move for the player holding
+    `hand` at this point of the round.
+
+    INPUTS:
+        play    - the play returned by the agent
+        rnd     - the round to date, as a list or a bcrowley.RoundState
+        hand    - the cards held by the player
+        pid     - the player ID, used in the error message
+
+    RETURNS:
+        None
+    """
+
+    if play is not None:
+        mask = bcrowley.encode_hand(play)
+
+        if (
+            bcrowley.count_cards(mask) != len(play) or
+            mask & ~bcrowley.encode_hand(hand) or
+            not (bcrowley.get_n_of_a_kind_mask(mask) or
+                 bcrowley.is_straight_mask(mask))
+        ):
+            raise ValueError(
+                "player {0} cannot play {1} from {2}".format(pid, play, hand))
+
+    if not bcrowley.is_valid_play(play and list(play), rnd):
+        raise ValueError(
+            "player {0} cannot play {1} on {2}".format(pid, play, rnd))
+
+
+def simulate(games, agents=None, swap=bcrowley.swap_cards, rng=None,
+             log=None):
+    """
+    Plays `games` games and returns the results, throughput and latency
+    totals.
+
+    INPUTS:
+        games   - number of games to play
+        agents  - list of 4 agent functions, defaults to `default_agents()`
+        swap    - function with the signature of `bcrowley.swap_cards`
+        rng     - optional random.Random used for the deals
+        log     - optional gamelog.GameLogWriter the games are written to
+
+    RETURNS:
+        SimulationStats
+    """
+
+    if agents is None:
+        agents = default_agents()
+
+    stats = SimulationStats()
+    start = default_timer()
+
+    for i in xrange(games):
+        stats.record(simulate_game(agents, swap, stats=stats, rng=rng,
+                                   log=log))
+
+    stats.elapsed = default_timer() - start
+
+    return stats
+
+
+if __name__ == "__main__":
+    print simulate(int(sys.argv[1]) if len(sys.argv) > 1 else 100).summary()
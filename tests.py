@@ -1,3 +1,18 @@
+# the game so far of the endgame positions, passed to play and play_anytime
+ENDGAME_DISCARD = [
+    [['9S', '0S', 'JS'], None, None, None],
+    [['4S', '4H'], ['5H', '5D'], ['7H', '7D'], None, ['0C', '0D'], ['JH', 'JC'], ['KS', 'KD'], None, None, None],
+    [['8S', '8D'], None, None, ['9H', '9D'], ['AS', 'AD'], None, None, None],
+    [['6H'], ['7S'], ['8H'], ['QS'], ['2C'], None, None, None],
+    [['9C'], ['QD'], ['KC'], None, None, ['AC'], None, None, None],
+    [['5C', '6C', '7C'], None, None, None],
+    [['3S', '3C'], None, ['4C', '4D'], None, None, None],
+    [['3H'], ['0H'], ['2H'], None, None, None],
+    [['5S'], ['6D'], ['8C'], ['QH'], ['2S'], None, None],
+    [['6S'], ['JD'], ['QC'], ['2D'], None, None],
+    [],
+    ]
+
 # dictionary of tests, one for each function in the project spec; in each case, list a number of function calls (as a str), and the correct output for each
 tests = {
     "swap_cards":[
@@ -17,6 +32,94 @@ tests = {
         ('submission.generate_plays(["3S", "3C", "3H", "3D", "4D", "5D", "6D"])', [['3S'], ['3C'], ['3H'], ['3D'], ['3S', '3C'], ['3S', '3H'], ['3S', '3D'], ['3C', '3H'], ['3C', '3D'], ['3H', '3D'], ['3S', '3C', '3H'], ['3S', '3C', '3D'], ['3S', '3H', '3D'], ['3C', '3H', '3D'], ['3S', '3C', '3H', '3D'], ['5D'], ['4D'], ['6D'], ['3D', '4D', '5D'], ['4D', '5D', '6D'], ['3D', '4D', '5D', '6D']]),
         ],
 
+    "encode_hand":[
+        ('submission.encode_hand([])', 0),
+        ('submission.encode_hand(["3S"])', 1),
+        ('submission.encode_hand(["3H", "4S"])', 18),
+        ('submission.encode_hand(["2D"])', 1 << 51),
+        ],
+
+    "decode_hand":[
+        ('submission.decode_hand(0)', []),
+        ('submission.decode_hand(submission.encode_hand(["2D", "3S", "0H"]))', ["3S", "0H", "2D"]),
+        ('submission.decode_hand(submission.encode_hand(["3D", "3C", "3H", "3S"])) == ["3S", "3H", "3C", "3D"]', True),
+        ],
+
+    "get_all_straights":[
+        ('submission.get_all_straights(["3H", "4H", "JH", "5S"])', []),
+        ('submission.get_all_straights(["3H", "4H", "5H", "9H", "0H", "JH", "QH"])', [["3H", "4H", "5H"], ["9H", "0H", "JH"], ["0H", "JH", "QH"], ["9H", "0H", "JH", "QH"]]),
+        ('submission.get_all_straights(["KD", "AD", "2D", "3D"])', [["KD", "AD", "2D"]]),
+        ('submission.get_all_straights(["3H", "4H", "5H", "6H", "3S", "4S", "5S", "9C", "0C", "JC"]) == [["3S", "4S", "5S"], ["3H", "4H", "5H"], ["4H", "5H", "6H"], ["3H", "4H", "5H", "6H"], ["9C", "0C", "JC"]]', True),
+        ('len(submission.get_all_straights([rank + "C" for rank in submission.ORDERED_RANKS]))', 66),
+        ],
+
+    "is_rank_higher":[
+        ('submission.is_rank_higher("2", "A")', True),
+        ('submission.is_rank_higher("0", "9")', True),
+        ('submission.is_rank_higher("J", "J")', False),
+        ('submission.is_rank_higher("3", "K")', False),
+        ],
+
+    "HandIndex":[
+        ('submission.HandIndex(["3D", "4D", "5D", "5S"]).generate(["3D", "4D", "5D", "5S"])', [["3D"], ["4D"], ["5D"], ["5S"], ["5S", "5D"], ["3D", "4D", "5D"]]),
+        ('submission.HandIndex(["3D", "4D", "5D", "5S"]).generate(["3D", "5D", "5S"])', [["3D"], ["5D"], ["5S"], ["5S", "5D"]]),
+        ('submission.HandIndex(["3D", "4D"]).generate(["3D", "4D", "5D"])', [["3D"], ["4D"], ["5D"], ["3D", "4D", "5D"]]),
+        ],
+
+    "enable_cache":[
+        ('(submission.enable_cache(2), submission.generate_plays(["3S", "3H"]), submission.generate_plays(["3H", "3S"]), submission.cache_info()["generate_plays"], submission.disable_cache())[3]', {'hits': 1, 'misses': 1, 'evictions': 0, 'size': 1, 'maxsize': 2}),
+        ('(submission.enable_cache(1), submission.generate_plays(["3S"]), submission.generate_plays(["4S"]), submission.cache_info()["generate_plays"]["evictions"], submission.disable_cache())[3]', 1),
+        ('(submission.enable_cache(), submission.generate_plays(["3S"])[0].append("4S"), submission.generate_plays(["3S"]), submission.disable_cache())[2]', [["3S"]]),
+        ],
+
+    "set_trace":[
+        ('(lambda records: (submission.set_trace(records.append), submission.play([["3D"]], ["4C", "5H"], [[["3D"]]], [12, 13, 13, 2]), submission.set_trace(None), [record["event"] for record in records])[3])([])', ["prefs"]),
+        ('(lambda records: (submission.set_trace(records.append), submission.play([], ["3C", "4C", "5C"], [[]], [13, 13, 13, 3]), submission.set_trace(None), records[0]["plays"])[3])([])', [["3C", "4C", "5C"]]),
+        ],
+
+    "generate_follows":[
+        ('submission.generate_follows(["3D", "4D", "4C", "5D", "JS", "JC"], [])', [["3D"], ["4D"], ["4C"], ["5D"], ["JS"], ["JC"], ["4D", "4C"], ["JS", "JC"], ["3D", "4D", "5D"]]),
+        ('submission.generate_follows(["3D", "4D", "4C", "5D", "JS", "JC"], [["9S", "9H"], None])', [["JS", "JC"]]),
+        ('submission.generate_follows(["3D", "4D", "4C", "5D", "JS", "JC"], [["4S"], ["5S"]])', [["JS"]]),
+        ('submission.generate_follows(["3D", "4D", "4C", "5D", "JS", "JC"], [["3S", "4S", "5S"]])', []),
+        ('submission.generate_follows(["3D", "4D", "4C", "5D", "6D", "JC"], [["3S", "4S", "5S"]])', [["4D", "5D", "6D"], ["3D", "4D", "5D", "6D"]]),
+        ],
+
+    "get_play_catalog":[
+        ('[submission.get_play_catalog().kinds.count(kind) for kind in (1, 2, 3, 4, 0)]', [52, 78, 52, 13, 264]),
+        ('submission.get_play_catalog().get_id(["3S", "3S"])', None),
+        ('submission.decode_hand(submission.get_play_catalog().masks[submission.get_play_catalog().get_id(["5D", "3D", "4D"])])', ["3D", "4D", "5D"]),
+        ('[submission.decode_hand(submission.get_play_catalog().masks[i]) for i in submission.get_play_catalog().iter_ids(submission.get_play_catalog().follows(submission.encode_hand(["3D", "4D", "4C", "5D", "JS", "JC", "QS", "QD"]), submission.RoundState([["9S", "9H"]])))]', [["JS", "JC"], ["QS", "QD"]]),
+        ],
+
+    "is_valid_batch":[
+        ('list(submission.is_valid_batch(*submission.encode_batch([(["4D"], [["3D"]]), (["4H"], [["3D"], ["3S"]]), (["4H"], [["3D"], ["3S"]]), (None, []), (["2S"], []), (None, [["3D"]])])))', [True, True, True, False, True, True]),
+        ('list(submission.is_valid_batch(*submission.encode_batch([(["4H"], [["3D"], ["3S"]]), (["5S"], [["3D"], ["4D"]]), (["6S", "6H"], [["5S", "5C"]]), (["3S", "4S", "5S", "6S"], [["5H", "6H", "7H"], None])])))', [True, False, True, False]),
+        ('list(submission.is_valid_batch(range(12), submission.get_play_catalog().get_id(["4C"]), True))', [False] * 10 + [True, False]),
+        ('list(submission.is_valid_batch(*submission.encode_batch(__import__("corpora").long_rounds(200, length=6, seed=5)))) == [submission.is_valid_play(play, rnd) for play, rnd in __import__("corpora").long_rounds(200, length=6, seed=5)]', True),
+        ],
+
+    "play_many":[
+        ('submission.play_many([([["3D"]], ["4C", "5H"], [[["3D"]]], (12, 13, 13, 2)), ([], ["3C", "4C", "5C"], [[]], (13, 13, 13, 3)), ([["3D"]], ["5H", "4C"], [[["3D"]]], (12, 13, 13, 2)), ([["9S"], ["JS"]], ["4C", "5H"], [[["9S"], ["JS"]]], (11, 12, 13, 2))])', [["4C"], ["3C", "4C", "5C"], ["4C"], None]),
+        ('submission.play_many([([["3D"]], ["4C", "5H"], [[["3D"]]], (12, 13, 13, 2))] * 3, processes=2)', [["4C"]] * 3),
+        ('submission.play_many([])', []),
+        ],
+
+    "UnseenTracker":[
+        ('(lambda tracker: (setattr(tracker, "holding", [1, 1, 0, 0]), tracker.fast_forward([[["3S"], ["4S"]]]), tracker.holding, tracker.to_move())[2:])(submission.UnseenTracker(leader=0))', ([0, 0, 0, 0], None)),
+        ('(lambda tracker: (tracker.fast_forward([[["3S"], ["5H"], None, ["2H"]], [["6C", "6D"], None]]), tracker.holding, tracker.to_move(), tracker.twos(), tracker.aces())[1:])(submission.UnseenTracker(["3D", "4D"], 0))', ([12, 12, 13, 10], 1, 3, 4)),
+        ('(lambda tracker: (tracker.fast_forward([[["3S"], ["5H"], None, ["2H"]]]), submission.decode_hand(tracker.excluded[2] & submission.encode_hand(["5S", "6S", "2D"])))[1])(submission.UnseenTracker([], 0))', ["6S", "2D"]),
+        ('(lambda tracker: (tracker.fast_forward([[["3S"], ["5S"], None]]), submission.decode_hand(tracker.excluded[2] & submission.encode_hand(["5H", "6H", "6S", "2S"])))[1])(submission.UnseenTracker([], 0))', ["6S", "2S"]),
+        ('(lambda tracker: (tracker.fast_forward([[["3S", "4S", "5S"]]]), tracker.fast_forward([[["3S", "4S", "5S"], ["6S", "7S", "8S"]]]), submission.count_cards(tracker.unseen), tracker.rank_counts[:6])[2:])(submission.UnseenTracker(["3D"]))', (45, [2, 3, 3, 3, 3, 3])),
+        ],
+
+    "iter_plays":[
+        ('list(submission.iter_plays(["3D", "4D", "4C", "5D", "JS", "JC"])) == [["3D"], ["4C"], ["4D"], ["5D"], ["JS"], ["JC"], ["4C", "4D"], ["JS", "JC"], ["3D", "4D", "5D"]]', True),
+        ('list(submission.iter_plays(["3D", "4D", "4C", "5D", "JS", "JC"], [["9S", "9H"], None]))', [["JS", "JC"]]),
+        ('list(submission.iter_plays(["3D", "4D", "4C", "5D", "6D", "JC"], [["3S", "4S", "5S"]])) == [["4D", "5D", "6D"], ["3D", "4D", "5D", "6D"]]', True),
+        ('next(submission.iter_plays(["3D", "4D", "4C", "5D", "JS", "JC"], [["4S"], ["5S"]]))', ["JS"]),
+        ],
+
     "is_valid_play":[
         ('submission.is_valid_play(["2C"], [["KD"]])',True),
         ('submission.is_valid_play(None, [])',False),
@@ -31,12 +134,379 @@ tests = {
         ('submission.is_valid_play(["QH", "KH", "AH"], [["5H", "6H", "7H"], None, ["9H", "0H", "JH"]])',True),
         ('submission.is_valid_play(["QC", "KC", "AC"], [["5H", "6H", "7H"], None, ["9H", "0H", "JH"]])',False),
         ('submission.is_valid_play(["QC","KC","AC"], [["0S", "JS", "QS"]])',True),
+        ('submission.is_valid_play(["QC", "KC", "AC"], submission.RoundState([["5H", "6H", "7H"], None, ["9H", "0H", "JH"]]))',False),
+        ('submission.is_valid_play(["AH"], submission.RoundState([["5H"], None, ["9H"]]))',True),
+        ('submission.is_valid_play(["7H", "7C"], submission.RoundState([["5S", "5C"], ["6H", "6C"], None]))',True),
+        ('submission.is_valid_play(None, submission.RoundState())',False),
+        ('submission.is_valid_play(submission.to_play(["7H", "7C"]), [["5S", "5C"]])',True),
+        ('submission.is_valid_play(submission.to_play(["8H"]), submission.RoundState([["5H"], ["6H"]]))',True),
+        ('submission.is_valid_play(submission.to_play(["8S"]), submission.RoundState([["5H"], ["6H"]]))',False),
+        ('(lambda play, rnd: (submission.is_valid_play(play, rnd), play, rnd))(["5H", "3H", "4H"], [["8S", "6S", "7S"]])',(False, ["5H", "3H", "4H"], [["8S", "6S", "7S"]])),
+        ],
+
+    "get_card":[
+        ('(lambda card: (card.name, card.rank, card.suit, card.index, card is submission.get_card("7H")))(submission.get_card("7H"))',("7H", 4, 1, 17, True)),
+        ('__import__("pickle").loads(__import__("pickle").dumps(submission.get_card("2D"))) is submission.get_card("2D")',True),
+        ],
+
+    "canonical_suits":[
+        ('submission.canonical_suits([submission.encode_hand(["3S", "4H"]), submission.encode_hand(["5S"])])[0] == submission.canonical_suits([submission.encode_hand(["3C", "4D"]), submission.encode_hand(["5C"])])[0]',True),
+        ('submission.canonical_suits([submission.encode_hand(["3S", "4H"]), submission.encode_hand(["5S"])])[0] == submission.canonical_suits([submission.encode_hand(["3C", "4D"]), submission.encode_hand(["5D"])])[0]',False),
+        ('(lambda masks, perm, inverse: [inverse[perm[suit]] for suit in range(4)])(*submission.canonical_suits([submission.encode_hand(["3S", "2D"]), submission.encode_hand(["4H"])]))',[0, 1, 2, 3]),
+        ],
+
+    "canonical_state":[
+        ('submission.canonical_state(["3S", "4H"], [["5S"], None], ["7D"])[0] == submission.canonical_state(["3H", "4S"], [["5H"], None], ["7C"])[0]',True),
+        ('submission.canonical_state(["3S", "4H"], [["5S"], None], ["7D"])[0][3]',None),
+        ('(lambda key, perm, inverse: submission.permute_cards(submission.permute_cards(["3H", "4S", "5C"], perm), inverse))(*submission.canonical_state(["3H", "4S", "5C"], [["6H", "7H", "8H"]], ["2D"]))',["3H", "4S", "5C"]),
+        ],
+
+    "permute_cards":[
+        ('submission.permute_cards(["3S", "4H", "5C", "6D"], (3, 2, 1, 0))',["3D", "4C", "5H", "6S"]),
+        ('submission.permute_cards(None, (0, 1, 2, 3))',None),
+        ],
+
+    "to_play":[
+        ('(lambda play: (play.kind, play.length, play.rank, play.suit, play.names()))(submission.to_play(["5S", "3S", "4S"]))',(0, 3, 2, 0, ["3S", "4S", "5S"])),
+        ('submission.to_play(["9H", "9D"]) is submission.to_play(["9D", "9H"])',True),
+        ('len(set([submission.to_play(["9H"]), submission.to_play(["9H"]), submission.to_play(["9D"])]))',2),
+        ('submission.from_play(submission.to_play(["KS"]))',["KS"]),
+        ('submission.to_play(None)',None),
+        ('submission.to_play(["JS"]).beats(submission.to_play(["0S"]), True)',True),
+        ('submission.to_play(["JH"]).beats(submission.to_play(["0S"]), True)',False),
         ],
 
     "play":[
+        ("submission.play([], ['JC', 'JS', 'KD'], [[]], (3, 13, 13, 13))", [['JS']]),
+        ("submission.play([['9H']], ['JC', 'JS', 'KD'], [[['9H']]], (3, 13, 13, 12))", [['JS']]),
         ("submission.play([], ['JS', 'QD', 'KC', '7S', '9H', '4C', '0C', '9C', '5H', '3C', 'JH', '2H', '8D'], [[]], [13,13,13,13])", [['3C'], ['4C'], ['5H'], ['7S'], ['8D'], ['9H'], ['9C'], ['9H', '9C'], ['0C'], ['JS'], ['JH'], ['JS', 'JH'], ['QD'], ['KC'], ['2H']]),
         ("submission.play([['3D']], ['JS', 'QD', 'KC', '7S', '9H', '4C', '0C', '9C', '5H', '3C', 'JH', '2H', '8D'], [[['3D']]], [12,13,13,13])", [['4C'], ['5H'], ['7S'], ['8D'], ['9H'], ['9C'], ['0C'], ['JS'], ['JH'], ['QD'], ['KC'], ['2H']]),
+        ("submission.play([], ['3D', 'AH'], __import__('tests').ENDGAME_DISCARD, (2, 1, 0, 0), endgame=__import__('endgame').EndgameSolver())", [['AH']]),
+        ("submission.play([], ['3D', 'AH'], __import__('tests').ENDGAME_DISCARD, (2, 1, 0, 0), endgame=__import__('endgame').EndgameSolver(threshold=2))", [['3D']]),
+        ],
+
+    "play_anytime":[
+        ("submission.play_anytime([['3D']], ['JS', 'QD', 'KC', '7S', '9H', '4C', '0C', '9C', '5H', '3C', 'JH', '2H', '8D'], [[['3D']]], [12,13,13,13])[0]", ['4C']),
+        ("(lambda result: (result[1]['budget'], result[1]['fraction'], result[1]['improvements'], result[1]['complete']))(submission.play_anytime([], ['3D', 'AH'], __import__('tests').ENDGAME_DISCARD, (2, 1, 0, 0)))", (None, None, 0, True)),
+        ("submission.play_anytime([], ['3D', 'AH'], __import__('tests').ENDGAME_DISCARD, (2, 1, 0, 0), budget=5.0)[0]", ['3D']),
+        ("(lambda result: (result[0], result[1]['budget'], result[1]['improvements'], result[1]['complete']))(submission.play_anytime([], ['3D', 'AH'], __import__('tests').ENDGAME_DISCARD, (2, 1, 0, 0), budget=5.0, improver=__import__('endgame').EndgameSolver()))", (['AH'], 5.0, 1, True)),
+        ("submission.play_anytime([], ['3D', 'AH'], __import__('tests').ENDGAME_DISCARD, (2, 1, 0, 0), budget=0.0, improver=__import__('endgame').EndgameSolver())[0]", ['3D']),
+        ],
+
+    "simulator.simulate_game":[
+        ('(lambda simulator, random: [simulator.simulate_game(simulator.default_agents(), rng=random.Random(seed))["order"] for seed in (0, 1)])(__import__("simulator"), __import__("random"))', [[3, 1, 2, 0], [3, 2, 0, 1]]),
+        ('(lambda simulator, random: [simulator.simulate_game(simulator.default_agents(), rng=random.Random(seed))["cards_left"].count(0) for seed in xrange(5)])(__import__("simulator"), __import__("random"))', [3] * 5),
+        ('(lambda played, simulator: sum(simulator.simulate_game([(lambda agent: lambda rnd, hand, discard, holding: (lambda play: played.append(len(play or [])) or play)(agent(rnd, hand, discard, holding)))(agent) for agent in simulator.default_agents()], rng=__import__("random").Random(1))["cards_left"]) + sum(played))([], __import__("simulator"))', 52),
+        ],
+
+    "tournament.run_tournament":[
+        ('(lambda results: results[0] == results[1] and results[0][0])([(stats.games, stats.positions, stats.cards_left, stats.rounds, stats.decisions) for stats in [__import__("tournament").run_tournament(40, processes=processes, batch_size=10, seed=3) for processes in (1, 2)]])', 40),
+        ('__import__("tournament").run_tournament(30, processes=1, batch_size=7, seed=3).games', 30),
+        ],
+
+    "search.heuristic_move":[
+        ('(lambda b, search: [b.decode_hand(b.get_play_catalog().masks[search.heuristic_move(b.encode_hand(hand), -1, False)]) == b.play([], hand, [[]], (13, 13, 13, 13)) for hand in b.deal(rng=__import__("random").Random(7))])(__import__("bcrowley"), __import__("search"))', [True] * 4),
+        ('(lambda b, search: search.heuristic_move(b.encode_hand(["JC", "JS", "KD"]), b.get_play_catalog().get_id(["9H"]), False) == b.get_play_catalog().get_id(["JS"]))(__import__("bcrowley"), __import__("search"))', True),
+        ('(lambda b, search: search.heuristic_move(b.encode_hand(["JC", "JS", "KD"]), b.get_play_catalog().get_id(["AH"]), False))(__import__("bcrowley"), __import__("search"))', -1),
+        ],
+
+    "search.rollout":[
+        ('(lambda b, search: [search.rollout([b.encode_hand(["3S"]), b.encode_hand(["4S"]), 0, 0], 0, me, -1, -1, False, False, 0, 0) for me in (0, 1)])(__import__("bcrowley"), __import__("search"))', [2, 3]),
+        ('(lambda b, search: search.rollout(map(b.encode_hand, b.deal(rng=__import__("random").Random(1))), 0, 0, -1, -1, False, False, 0, 0, deadline=0))(__import__("bcrowley"), __import__("search"))', None),
+        ('(lambda b, search, totals: (search.play_out_deal(map(b.encode_hand, b.deal(rng=__import__("random").Random(1))), 0, [-1, 0], (-1, -1, False, False, 0, 0), totals, deadline=0), totals))(__import__("bcrowley"), __import__("search"), [0, 0])', (False, [0, 0])),
+        ],
+
+    "search.sample_hands":[
+        ('(lambda b, search, hand, unseen, holding: all((lambda hands: [b.count_cards(mask) for mask in hands] == list(holding) and hands[1] == hand and sum(hands) == hand | unseen)(search.sample_hands(1, hand, search.get_card_bits(unseen), holding, __import__("random").Random(seed))) for seed in xrange(20)))(__import__("bcrowley"), __import__("search"), __import__("bcrowley").encode_hand(["3S", "4S"]), __import__("bcrowley").encode_hand(["5S", "6S", "7S", "8H", "9H"]), (3, 2, 0, 2))', True),
+        ('(lambda b, search: all(b.decode_hand(search.sample_hands(1, b.encode_hand(["3S"]), search.get_card_bits(b.encode_hand(["5S", "6S", "7S"])), (2, 1, 1, 0), __import__("random").Random(seed), [b.encode_hand(["5S"]), 0, b.encode_hand(["6S", "7S"]), 0])[0]) == ["6S", "7S"] for seed in xrange(10)))(__import__("bcrowley"), __import__("search"))', True),
+        ],
+
+    "search.SearchAgent":[
+        ('(lambda simulator, search, random: [simulator.simulate_game([search.SearchAgent(time_limit=None, rollouts=64, seed=seed)] + simulator.default_agents()[1:], rng=random.Random(seed))["cards_left"].count(0) for seed in xrange(3)])(__import__("simulator"), __import__("search"), __import__("random"))', [3] * 3),
+        ('(lambda agent: (agent.play([["3D"]], ["JC", "JS", "KD", "4D", "5H", "6S", "7S", "8C", "9H", "0D", "QH", "AS", "2C"], [[["3D"]]], (12, 13, 13, 13)), agent.samples))(__import__("search").SearchAgent(time_limit=None, rollouts=140, seed=1))', (["4D"], 10)),
+        ('__import__("search").SearchAgent(time_limit=None, rollouts=140, seed=1).play([["3D"]], ["JC", "JS", "KD", "4D", "5H", "6S", "7S", "8C", "9H", "0D", "QH", "AS", "2C"], [[["3D"]]], (12, 13, 13, 13)) in [[card] for card in ["4D", "5H", "6S", "7S", "8C", "9H", "0D", "JC", "JS", "QH", "KD", "AS", "2C"]] + [None]', True),
+        ],
+
+    "search.ParallelSampler":[
+        ('(lambda search, position: (lambda results: results[0] == results[1] and results[0][1])([(lambda sampler: (sampler.evaluate(position, rollouts=140, rng=__import__("random").Random(5)), sampler.close())[0])(search.ParallelSampler(processes, batch=2)) for processes in (1, 2)]))(__import__("search"), __import__("search").SearchAgent().position([["3D"]], ["JC", "JS", "KD", "4D", "5H", "6S", "7S", "8C", "9H", "0D", "QH", "AS", "2C"], [[["3D"]]], (12, 13, 13, 13)))', 10),
+        ('(lambda sampler: (__import__("tests").raises(ValueError, sampler.evaluate, {}), sampler.close())[0])(__import__("search").ParallelSampler(1))', True),
+        ('(lambda sampler, position: (__import__("tests").raises(IndexError, sampler.evaluate, dict(position, moves=[1 << 20]), rollouts=40), sampler.evaluate(position, rollouts=140, rng=__import__("random").Random(5))[1], sampler.close())[:2])(__import__("search").ParallelSampler(1), __import__("search").SearchAgent().position([["3D"]], ["JC", "JS", "KD", "4D", "5H", "6S", "7S", "8C", "9H", "0D", "QH", "AS", "2C"], [[["3D"]]], (12, 13, 13, 13)))', (True, 10)),
+        ],
+
+    "gamelog.GameLogReader":[
+        ('__import__("tests").with_log(3, 0, lambda reader, played: [list(reader.iter_records(start, stop)) for start, stop in reader.games()] == [__import__("tests").expected_records(*game) for game in played])', True),
+        ('__import__("tests").with_log(3, 0, lambda reader, played: [reader.game(start, stop) for start, stop in reader.games()] == played)', True),
+        ('__import__("tests").with_log(3, 0, lambda reader, played: all(reader.game_start(offset) == start for start, stop in reader.games() for offset in xrange(start, stop)))', True),
+        ('__import__("tests").with_log(3, 0, lambda reader, played: (len(reader), list(reader.game_starts())) == (sum(map(len, map(__import__("tests").expected_records, *zip(*played)))), [0, 127, 256]))', True),
+        ],
+
+    "replay.replay_log":[
+        ('__import__("tests").with_log(3, 0, lambda reader, played: (lambda report: (report.games, report.plays, report.violations))(__import__("replay").replay_log(reader.path)))', (3, 215, [])),
+        ('__import__("tests").with_log(3, 0, lambda reader, played: [(violation["record"], violation["message"]) for violation in __import__("replay").replay_log(__import__("tests").patch_record(reader.path, 61, ["QS", "QH"], 3)).violations][0])', (61, "out of turn, player 1 to play")),
+        ('__import__("tests").with_log(3, 0, lambda reader, played: [(violation["record"], violation["message"]) for violation in __import__("replay").replay_log(__import__("tests").patch_record(reader.path, 67, ["2C"], 3)).violations][0])', (67, "['2C'] is not held")),
+        ('__import__("tests").with_log(3, 0, lambda reader, played: [(violation["record"], violation["message"]) for violation in __import__("replay").replay_log(__import__("tests").patch_record(reader.path, 69, ["9C"], 1)).violations][0])', (69, "['9C'] cannot be played on [['8S'], ['JD']]")),
+        ('__import__("tests").with_records([("3S", 0, 5), ("4S", 1, 4), (["3S"], 0, 2), (["4S"], 1, 0), (None, 2, 0)], lambda path: [(violation["record"], violation["message"]) for violation in __import__("replay").replay_log(path).violations])', [(3, "play after the game ended"), (4, "play after the game ended")]),
+        ],
+
+    "replay.split_log":[
+        ('__import__("tests").with_log(3, 0, lambda reader, played: [(lambda ranges: all(start in list(reader.game_starts()) for path, start, stop in ranges) and [0] + [stop for path, start, stop in ranges] == [start for path, start, stop in ranges] + [len(reader)])(__import__("replay").split_log(reader.path, chunk)) for chunk in (1, 50, 127, 200, 1000)])', [True] * 5),
+        ('__import__("tests").with_log(3, 0, lambda reader, played: [stop - start for path, start, stop in __import__("replay").split_log(reader.path, 50)])', [127, 129, 115]),
+        ],
+
+    "server.GameServer":[
+        ('(lambda server, clients: ([len(table.results) for name, table in sorted(server.tables.items())], server.stats.games, server.stats.tables))(*__import__("tests").run_server(__import__("simulator").default_agents, tables=3, games=4, workers=2))', ([4, 4, 4], 12, 3)),
+        ('(lambda run: run(workers=1) == run(workers=3))(lambda **options: [table.results for name, table in sorted(__import__("tests").run_server(__import__("simulator").default_agents, tables=3, games=2, **options)[0].tables.items())])', True),
+        ('(lambda server, clients: ([[result["order"] for result in results] for results in clients] == [[result["order"] for result in server.tables["0"].results]] == [[result["order"] for result in __import__("tests").run_server(__import__("simulator").default_agents, games=2)[0].tables["0"].results]], server.stats.invalid > 0, server.stats.timeouts))(*__import__("tests").run_server(lambda: ["remote"] + __import__("simulator").default_agents()[1:], games=2, clients=[__import__("functools").partial(__import__("server").run_client, agent=lambda rnd, hand, discard, holding: ["XX"])], move_timeout=5))', (True, True, 0)),
+        ('[(lambda server, clients: (clients, server.stats.games))(*__import__("tests").run_server(lambda: ["remote"] + __import__("simulator").default_agents()[1:], games=2, clients=[__import__("tests").answer_once(play)], move_timeout=None)) for play in ("3D", [3], {"3D": 1})]', [([{"error": "not a list of cards or null"}], 2)] * 3),
+        ('(lambda server, clients: (server.stats.games, server.stats.errors, server.stats.invalid, [result["order"] for result in server.tables["0"].results] == [result["order"] for result in __import__("tests").run_server(__import__("simulator").default_agents)[0].tables["0"].results]))(*__import__("tests").run_server(lambda: [(lambda calls: lambda rnd, hand, discard, holding: calls.append(None) or (1 // 0 if len(calls) == 1 else __import__("bcrowley").play(rnd, hand, discard, holding)))([])] + __import__("simulator").default_agents()[1:]))', (1, 1, 0, True)),
+        ('(lambda entered: (lambda server, clients: (server.stats.games, server.stats.timeouts > 0, max(entered)))(*__import__("tests").run_server(lambda: [__import__("tests").slow_agent(0.02, entered)] + __import__("simulator").default_agents()[1:], games=2, workers=3, move_timeout=0.005)))([])', (2, True, 1)),
         ],
 
         }
 
+
+def raises(exception, function, *args, **kwargs):
+    """
+    Returns whether calling `function` raises `exception`, for the tests of
+    errors, as a test is a single expression.
+    """
+
+    try:
+        function(*args, **kwargs)
+    except exception:
+        return True
+
+    return False
+
+
+def with_log(games, seed, check):
+    """
+    Plays `games` seeded self-play games into a temporary game log, and
+    returns check(reader, played) where reader is a GameLogReader of the
+    log and played holds the (hands, discard, pids) of each game as the
+    simulator played it, pids[round][play] being who made each play.
+    """
+
+    import os
+    import tempfile
+    from random import Random
+
+    import gamelog
+    import simulator
+
+    played = []
+    turns = []
+
+    def seat(agent, pid):
+        def play(rnd, hand, discard, holding):
+            turns.append(pid)
+            return agent(rnd, hand, discard, holding)
+
+        return play
+
+    class Recorder(gamelog.GameLogWriter):
+        def write_game(self, discard, first, hands=None):
+            moves = iter(turns)
+            pids = [[next(moves) for play in rnd] for rnd in discard]
+            played.append(([list(hand) for hand in hands],
+                           [[play and list(play) for play in rnd]
+                            for rnd in discard], pids))
+            del turns[:]
+            gamelog.GameLogWriter.write_game(self, discard, first, hands)
+
+    handle, path = tempfile.mkstemp('.dfgl')
+    os.close(handle)
+    os.remove(path)
+
+    try:
+        writer = Recorder(path)
+        simulator.simulate(games, [seat(agent, pid) for pid, agent in
+                                   enumerate(simulator.default_agents())],
+                           rng=Random(seed), log=writer)
+        writer.close()
+
+        reader = gamelog.GameLogReader(path)
+
+        try:
+            return check(reader, played)
+        finally:
+            reader.close()
+    finally:
+        os.remove(path)
+
+
+def expected_records(hands, discard, pids):
+    """
+    Returns the (play, pid, flags) records a game log should hold for a
+    game, worked out from the game as played rather than by gamelog.
+    """
+
+    import bcrowley
+    import gamelog
+
+    catalog = bcrowley.get_play_catalog()
+    records = [(bcrowley.CARD_TABLE[card][2], pid, gamelog.DEAL)
+               for pid, hand in enumerate(hands) for card in hand]
+
+    for rnd, rnd_pids in zip(discard, pids):
+        records += [(gamelog.PASS if play is None else catalog.get_id(play),
+                     pid, gamelog.ROUND_START if not index else 0)
+                    for index, (play, pid) in enumerate(zip(rnd, rnd_pids))]
+
+    play, pid, flags = records[0]
+    records[0] = (play, pid, flags | gamelog.GAME_START)
+
+    return records
+
+
+def patch_record(path, index, play, pid):
+    """
+    Overwrites the play and player of record `index` of a game log, keeping
+    its flags, and returns the path.
+    """
+
+    import bcrowley
+    import gamelog
+
+    play_id = (gamelog.PASS if play is None else
+               bcrowley.get_play_catalog().get_id(play))
+
+    with open(path, 'r+b') as log:
+        log.seek(gamelog.HEADER.size + index * gamelog.RECORD.size)
+        flags = gamelog.RECORD.unpack(log.read(gamelog.RECORD.size))[2]
+        log.seek(-gamelog.RECORD.size, 1)
+        log.write(gamelog.RECORD.pack(play_id, pid, flags))
+
+    return path
+
+
+def run_server(seats, tables=1, games=1, clients=(), **options):
+    """
+    Serves `tables` tables, seated by calling `seats`, for `games` games
+    each, the deals seeded by table number, while each of `clients` is
+    called with the address of the server on a thread of its own. Returns
+    the server, once closed, and what each client returned.
+    """
+
+    import threading
+    from random import Random
+
+    import server
+
+    if clients:
+        options['address'] = ('127.0.0.1', 0)
+
+    host = server.GameServer(**options)
+    returned = [None] * len(clients)
+
+    for index in xrange(tables):
+        host.add_table(seats(), games, rng=Random(index))
+
+    def connect(index, client):
+        returned[index] = client(host.address)
+
+    threads = [threading.Thread(target=connect, args=(index, client))
+               for index, client in enumerate(clients)]
+
+    try:
+        for thread in threads:
+            thread.start()
+
+        host.serve()
+    finally:
+        for thread in threads:
+            thread.join()
+
+        host.close()
+
+    return host, returned
+
+
+def slow_agent(delay, entered):
+    """
+    Returns `bcrowley.play` slowed down by `delay` seconds, appending to
+    `entered` how many of its calls are running as each one starts.
+    """
+
+    import time
+
+    import bcrowley
+
+    running = []
+
+    def play(rnd, hand, discard, holding):
+        running.append(None)
+        entered.append(len(running))
+
+        try:
+            time.sleep(delay)
+            return bcrowley.play(rnd, hand, discard, holding)
+        finally:
+            running.pop()
+
+    return play
+
+
+def answer_once(play):
+    """
+    Returns a client for `run_server` that takes a seat, answers its first
+    turn with `play` as is, and returns the server's reply.
+    """
+
+    import json
+    import socket
+
+    def client(address):
+        connection = socket.create_connection(address)
+        stream = connection.makefile('r+b')
+
+        try:
+            stream.write(json.dumps({'join': None}) + '\n')
+            stream.flush()
+            stream.readline()
+            turn = json.loads(stream.readline())['turn']
+            stream.write(json.dumps({'turn': turn, 'play': play}) + '\n')
+            stream.flush()
+
+            return json.loads(stream.readline())
+        finally:
+            stream.close()
+            connection.close()
+
+    return client
+
+
+def with_records(records, check):
+    """
+    Writes `records` to a temporary game log as they are, and returns
+    check(path). Each record is (play, pid, flags), play being a card for a
+    DEAL record, otherwise a list of cards or None.
+    """
+
+    import os
+    import tempfile
+
+    import bcrowley
+    import gamelog
+
+    catalog = bcrowley.get_play_catalog()
+    handle, path = tempfile.mkstemp('.dfgl')
+
+    try:
+        with os.fdopen(handle, 'wb') as log:
+            log.write(gamelog.HEADER.pack(gamelog.MAGIC, gamelog.VERSION,
+                                          gamelog.RECORD.size))
+
+            for play, pid, flags in records:
+                if flags & gamelog.DEAL:
+                    play_id = bcrowley.CARD_TABLE[play][2]
+                elif play is None:
+                    play_id = gamelog.PASS
+                else:
+                    play_id = catalog.get_id(play)
+
+                log.write(gamelog.RECORD.pack(play_id, pid, flags))
+
+        return check(path)
+    finally:
+        os.remove(path)
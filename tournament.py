@@ -0,0 +1,114 @@
+# coding=utf-8
+"""*****************************************************************************
+
+Daifugo Tournament
+
+Spreads simulated games across a process pool. The games are cut into shards
+of `batch_size` games, each dealt from its own random.Random seeded from the
+tournament seed and the shard index, so a tournament gives the same results
+for the same seed and batch size whatever the number of processes. Each
+shard sends back one SimulationStats, and the shards are merged as they
+arrive.
+
+    python tournament.py [games] [processes]
+
+*****************************************************************************"""
+
+import sys
+from multiprocessing import Pool, cpu_count
+from random import Random
+from timeit import default_timer
+
+import bcrowley
+from simulator import SimulationStats, simulate
+
+
+def shard_seed(seed, index):
+    """
+    Returns the seed for shard `index` of a tournament seeded with `seed`.
+
+    INPUTS:
+        seed    - int, the tournament seed
+        index   - int, the shard index
+
+    RETURNS:
+        long    - a seed unique to the pair
+    """
+
+    return (seed << 32) + index
+
+
+def run_shard(shard):
+    """
+    Plays one shard of a tournament. Runs in a worker process, so it takes a
+    single picklable tuple.
+
+    INPUTS:
+        shard   - (seed, index, games, agents, swap) tuple
+
+    RETURNS:
+        SimulationStats
+    """
+
+    seed, index, games, agents, swap = shard
+
+    return simulate(games, agents, swap, Random(shard_seed(seed, index)))
+
+
+def run_tournament(games, agents=None, swap=bcrowley.swap_cards, processes=None,
+                   batch_size=250, seed=0):
+    """
+    Plays `games` games across `processes` worker processes and returns the
+    merged statistics. The agents and swap function are sent to the workers,
+    so they must be picklable, i.e. module level functions.
+
+    INPUTS:
+        games       - number of games to play
+        agents      - list of 4 agent functions, defaults to
+                      `simulator.default_agents()` in each worker
+        swap        - function with the signature of `bcrowley.swap_cards`
+        processes   - number of workers, defaults to the number of cores.
+                      With 1, the shards are played in this process.
+        batch_size  - games per shard, i.e. per result sent back
+        seed        - int, the tournament seed
+
+    RETURNS:
+        SimulationStats
+    """
+
+    if processes is None:
+        processes = cpu_count()
+
+    shards = [(seed, index, min(batch_size, games - start), agents, swap)
+              for index, start in enumerate(xrange(0, games, batch_size))]
+
+    stats = SimulationStats()
+    start = default_timer()
+
+    if processes == 1:
+        for shard in shards:
+            stats.merge(run_shard(shard))
+    else:
+        pool = Pool(processes)
+
+        try:
+            for batch in pool.imap_unordered(run_shard, shards):
+                stats.merge(batch)
+        finally:
+            pool.close()
+            pool.join()
+
+    stats.elapsed = default_timer() - start
+
+    return stats
+
+
+if __name__ == "__main__":
+    results = run_tournament(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+        processes=int(sys.argv[2]) if len(sys.argv) > 2 else None)
+
+    print results.summary()
+    print "win rates:      ", results.win_rates()
+    print "mean positions: ", results.mean_positions()
+    print "mean cards left:", results.mean_cards_left()